@@ -0,0 +1,53 @@
+import time
+
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
+from ryu.controller.handler import set_ev_cls
+from ryu.ofproto import ofproto_v1_3
+from ryu.lib import hub
+from packet_fastpath import LazyPacket
+from arp_responder import ArpResponder
+
+class ARP_PROXY(app_manager.RyuApp):
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    def __init__(self, *args, **kwargs):
+        super(ARP_PROXY, self).__init__(*args, **kwargs)
+        self.responder = ArpResponder(max_age = 300, logger = self.logger)
+        self.monitor = hub.spawn(self.report_stats)
+
+    @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
+    def switch_features_handler(self, ev):
+        datapath = ev.msg.datapath
+        self.logger.info('switch joind: datapath: %061x' % datapath.id)
+        self.responder.add_datapath(datapath)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def state_change_handler(self, ev):
+        if ev.datapath.id is not None:
+            self.responder.remove_datapath(ev.datapath.id)
+
+    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    def _packet_in_handler(self, ev):
+        start = time.time()
+        msg = ev.msg
+        pkt = LazyPacket(msg.data)
+        if not pkt.is_arp():
+            return
+        self.responder.packet_in(msg.datapath, msg.match['in_port'], pkt,
+                                 msg, start)
+
+    def report_stats(self):
+        while True:
+            hub.sleep(10)
+            self.responder.expire()
+            stats = self.responder.stats()
+            self.logger.info('arp proxy: %(packet_ins)d packet-ins, '
+                             '%(answered)d answered, %(flooded)d flooded, '
+                             '%(cache_size)d cached, hit rate %(hit_rate).2f, '
+                             '%(responders)d switch responders', stats)
+            if stats['latency_p50'] is not None:
+                self.logger.info('arp proxy: answer latency p50 %.3f ms, '
+                                 'p99 %.3f ms', stats['latency_p50'] * 1000,
+                                 stats['latency_p99'] * 1000)
@@ -0,0 +1,269 @@
+import time
+import socket
+import struct
+import logging
+from collections import deque
+
+from flow_batch import FlowBatch, build_flow_mod
+from packet_template import (PacketOutTemplate, arp_reply, ETH_DST_OFFSET,
+                             ARP_THA_OFFSET, ARP_TPA_OFFSET)
+from shadow_table import cookies
+from util import percentile
+
+LOG = logging.getLogger('arp_responder')
+
+ETH_TYPE_ARP = 0x0806
+ARP_REQUEST = 1
+ARP_REPLY = 2
+ZERO_IP = b'\x00' * 4
+ZERO_MAC = b'\x00' * 6
+
+
+def mac_text(mac):
+    return ':'.join('%02x' % b for b in bytearray(mac))
+
+
+def ip_int(ip):
+    return struct.unpack('!I', ip)[0]
+
+
+class ArpEntry(object):
+    __slots__ = ('mac', 'learned')
+
+    def __init__(self, mac, learned):
+        self.mac = mac
+        self.learned = learned
+
+
+class ArpCache(object):
+    # ip -> mac bindings keyed by the raw 4 and 6 byte strings taken
+    # straight out of the packet, so nothing is decoded on the hot path
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def learn(self, ip, mac, now=None):
+        now = time.time() if now is None else now
+        entry = self.entries.get(ip)
+        if entry is None:
+            self.entries[ip] = ArpEntry(mac, now)
+            return None
+        old = entry.mac
+        entry.mac = mac
+        entry.learned = now
+        return old if old != mac else None
+
+    def lookup(self, ip, now=None):
+        now = time.time() if now is None else now
+        entry = self.entries.get(ip)
+        if entry is not None and now - entry.learned > self.max_age:
+            del self.entries[ip]
+            entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        stale = [ip for ip, entry in self.entries.items()
+                 if now - entry.learned > self.max_age]
+        for ip in stale:
+            del self.entries[ip]
+        return stale
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+
+class ArpResponder(object):
+    def __init__(self, max_age=300, responder_idle=60, max_responders=1024,
+                 priority=100, punt_priority=10, latency_samples=1024,
+                 logger=None):
+        self.cache = ArpCache(max_age)
+        self.responder_idle = responder_idle
+        self.max_responders = max_responders
+        self.priority = priority
+        self.punt_priority = punt_priority
+        self.logger = logger or LOG
+        self.cookies = cookies.allocate('arp_responder')
+        self.datapaths = {}
+        self.templates = {}
+        self.locations = {}
+        self.responders = {}
+        self.latencies = deque(maxlen=latency_samples)
+        self.packet_ins = 0
+        self.answered = 0
+        self.flooded = 0
+
+    def add_datapath(self, datapath):
+        ofproto = datapath.ofproto
+        self.datapaths[datapath.id] = datapath
+        self.responders[datapath.id] = {}
+        batch = FlowBatch(datapath, self.logger)
+        # requests and replies both come up so bindings can be learned;
+        # frames are small, so no buffering
+        batch.add({'priority': self.punt_priority,
+                   'match': {'eth_type': ETH_TYPE_ARP},
+                   'actions': [{'type': 'OUTPUT',
+                                'port': ofproto.OFPP_CONTROLLER,
+                                'max_len': ofproto.OFPCML_NO_BUFFER}]},
+                  ofproto.OFPFC_ADD)
+        batch.send(barrier=False)
+
+    def remove_datapath(self, dpid):
+        self.datapaths.pop(dpid, None)
+        self.responders.pop(dpid, None)
+        for table in (self.templates, self.locations):
+            for key in [k for k in table if k[0] == dpid]:
+                del table[key]
+
+    def _template(self, datapath, ip, entry):
+        key = (datapath.id, ip)
+        template, mac = self.templates.get(key, (None, None))
+        if template is None or mac != entry.mac:
+            ofproto = datapath.ofproto
+            parser = datapath.ofproto_parser
+            data = arp_reply(mac_text(entry.mac), socket.inet_ntoa(ip),
+                             mac_text(ZERO_MAC), socket.inet_ntoa(ZERO_IP))
+            template = PacketOutTemplate(
+                datapath, data, [parser.OFPActionOutput(ofproto.OFPP_IN_PORT)])
+            self.templates[key] = (template, entry.mac)
+        return template
+
+    def _forget(self, ip):
+        # binding moved: drop cached replies and the switch responders
+        # answering for it or answering to it
+        cookie = self.cookies.cookie(ip_int(ip))
+        for key in [k for k in self.templates if k[1] == ip]:
+            del self.templates[key]
+        for dpid, datapath in self.datapaths.items():
+            ofproto = datapath.ofproto
+            installed = self.responders.get(dpid, {})
+            for key in [k for k in installed if ip in (k[2], k[3])]:
+                del installed[key]
+            datapath.send_msg(build_flow_mod(
+                datapath, {'cookie': cookie,
+                           'cookie_mask': 0xffffffffffffffff,
+                           'table_id': ofproto.OFPTT_ALL},
+                ofproto.OFPFC_DELETE))
+            datapath.send_msg(build_flow_mod(
+                datapath, {'cookie': self.cookies.base,
+                           'cookie_mask': self.cookies.mask,
+                           'table_id': ofproto.OFPTT_ALL,
+                           'match': {'eth_type': ETH_TYPE_ARP,
+                                     'arp_spa': socket.inet_ntoa(ip)}},
+                ofproto.OFPFC_DELETE))
+
+    def _install_responder(self, datapath, in_port, req_mac, req_ip, ip,
+                           entry, now):
+        installed = self.responders.get(datapath.id)
+        if installed is None:
+            return
+        key = (in_port, req_mac, req_ip, ip)
+        if now - installed.get(key, -self.responder_idle) < \
+                self.responder_idle:
+            return
+        if len(installed) >= self.max_responders:
+            for stale in [k for k, t in installed.items()
+                          if now - t >= self.responder_idle]:
+                del installed[stale]
+            if len(installed) >= self.max_responders:
+                return
+        installed[key] = now
+        ofproto = datapath.ofproto
+        target_mac = mac_text(entry.mac)
+        target_ip = socket.inet_ntoa(ip)
+        requester_mac = mac_text(req_mac)
+        requester_ip = socket.inet_ntoa(req_ip)
+        # the switch rewrites the request into the reply for this
+        # requester/target pair, so repeats never reach the controller;
+        # the requester's mac is matched too, since it is written into
+        # the reply
+        actions = [{'type': 'SET_FIELD', 'field': f, 'value': v}
+                   for f, v in (('eth_dst', requester_mac),
+                                ('eth_src', target_mac),
+                                ('arp_op', ARP_REPLY),
+                                ('arp_sha', target_mac),
+                                ('arp_spa', target_ip),
+                                ('arp_tha', requester_mac),
+                                ('arp_tpa', requester_ip))]
+        actions.append({'type': 'OUTPUT', 'port': ofproto.OFPP_IN_PORT})
+        datapath.send_msg(build_flow_mod(
+            datapath, {'priority': self.priority,
+                       'cookie': self.cookies.cookie(ip_int(ip)),
+                       'idle_timeout': self.responder_idle,
+                       'hard_timeout': self.cache.max_age,
+                       'match': {'in_port': in_port,
+                                 'eth_type': ETH_TYPE_ARP,
+                                 'arp_op': ARP_REQUEST,
+                                 'arp_sha': requester_mac,
+                                 'arp_spa': requester_ip,
+                                 'arp_tpa': target_ip},
+                       'actions': actions},
+            ofproto.OFPFC_ADD))
+
+    def _output(self, datapath, msg, in_port, port):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        datapath.send_msg(parser.OFPPacketOut(
+            datapath, ofproto.OFP_NO_BUFFER, in_port,
+            [parser.OFPActionOutput(port)], msg.data))
+
+    def packet_in(self, datapath, in_port, pkt, msg, start=None):
+        start = time.time() if start is None else start
+        self.packet_ins += 1
+        sha = pkt.arp_sha
+        spa = pkt.arp_spa
+        self.locations[(datapath.id, sha)] = in_port
+        if spa != ZERO_IP and self.cache.learn(spa, sha, start) is not None:
+            self._forget(spa)
+
+        if pkt.arp_op != ARP_REQUEST:
+            # a reply still has to reach whoever asked
+            port = self.locations.get((datapath.id, pkt.eth_dst))
+            if port is None:
+                port = datapath.ofproto.OFPP_FLOOD
+            self._output(datapath, msg, in_port, port)
+            return ARP_REPLY
+
+        tpa = pkt.arp_tpa
+        entry = self.cache.lookup(tpa, start)
+        if entry is None:
+            self.flooded += 1
+            self._output(datapath, msg, in_port, datapath.ofproto.OFPP_FLOOD)
+            return None
+
+        self._template(datapath, tpa, entry).send(
+            [(ETH_DST_OFFSET, sha), (ARP_THA_OFFSET, sha),
+             (ARP_TPA_OFFSET, spa)], in_port)
+        self.answered += 1
+        self.latencies.append(time.time() - start)
+        self._install_responder(datapath, in_port, sha, spa, tpa, entry,
+                                start)
+        return ARP_REQUEST
+
+    def expire(self, now=None):
+        stale = self.cache.expire(now)
+        for ip in stale:
+            for key in [k for k in self.templates if k[1] == ip]:
+                del self.templates[key]
+        return stale
+
+    def stats(self):
+        latencies = list(self.latencies)
+        return {'packet_ins': self.packet_ins,
+                'answered': self.answered,
+                'flooded': self.flooded,
+                'cache_size': len(self.cache),
+                'hit_rate': self.cache.hit_rate(),
+                'responders': sum(len(r) for r in self.responders.values()),
+                'latency_p50': percentile(latencies, 50),
+                'latency_p99': percentile(latencies, 99)}
@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+
+from emulated_switch import EmulatedFleet
+from ofp_wire import wait_for_port
+
+APPS = ['port_forwarding.py', 'show_port_stats.py', 'test_group.py',
+        'packet_out.py']
+SWITCH_COUNTS = [1, 10, 100, 1000]
+
+# a regression is a drop in a throughput metric or a rise in a latency
+# metric beyond the tolerance
+HIGHER_IS_BETTER = ['flow_mods_per_sec', 'packet_outs_per_sec']
+# stats_rtt_p95 is the controller's own request -> reply time, scraped
+# from the InstrumentedApp metrics endpoint
+LOWER_IS_BETTER = ['programmed_p95', 'stats_rtt_p95']
+METRICS_ADDRESS = ('127.0.0.1', 9101)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def scrape_rtt(address, quantile='0.95'):
+    # worst stats round trip any app reports; None when the app is not
+    # instrumented or never polled
+    try:
+        sock = socket.create_connection(address, 2)
+    except socket.error:
+        return None
+    try:
+        sock.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+        data = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    except socket.error:
+        return None
+    finally:
+        sock.close()
+    rtts = []
+    for line in data.decode('utf-8', 'replace').splitlines():
+        if line.startswith('ryu_stats_rtt_seconds{') and \
+                'quantile="%s"' % quantile in line:
+            rtts.append(float(line.rsplit(' ', 1)[1]))
+    return max(rtts) if rtts else None
+
+
+def run(app, switches, ports, duration, listen_port, ryu_manager):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [HERE] + [p for p in [env.get('PYTHONPATH')] if p])
+    controller = subprocess.Popen(
+        [ryu_manager, '--ofp-tcp-listen-port', str(listen_port),
+         os.path.join(HERE, app)],
+        cwd = HERE, env = env,
+        stdout = open(os.devnull, 'w'), stderr = subprocess.STDOUT)
+    try:
+        if not wait_for_port(listen_port):
+            raise RuntimeError('%s did not start listening' % app)
+        fleet = EmulatedFleet(switches, ports, ('127.0.0.1', listen_port))
+        fleet.start()
+        time.sleep(duration)
+        rtt = scrape_rtt(METRICS_ADDRESS)
+        fleet.stop()
+        summary = fleet.summary()
+        summary['stats_rtt_p95'] = rtt
+        return summary
+    finally:
+        controller.terminate()
+        controller.wait()
+
+
+def regressions(results, baseline, tolerance):
+    failures = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric in HIGHER_IS_BETTER:
+            if base.get(metric) and result.get(metric) is not None and \
+                    result[metric] < base[metric] * (1 - tolerance):
+                failures.append((key, metric, base[metric], result[metric]))
+        for metric in LOWER_IS_BETTER:
+            if base.get(metric) and result.get(metric) is not None and \
+                    result[metric] > base[metric] * (1 + tolerance):
+                failures.append((key, metric, base[metric], result[metric]))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='control-plane benchmarks against emulated switches')
+    parser.add_argument('--apps', nargs='+', default=APPS)
+    parser.add_argument('--switches', type=int, nargs='+',
+                        default=SWITCH_COUNTS)
+    parser.add_argument('--ports', type=int, default=48)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--listen-port', type=int, default=16633)
+    parser.add_argument('--ryu-manager', default='ryu-manager')
+    parser.add_argument('--baseline',
+                        default=os.path.join(HERE, 'bench_baseline.json'))
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--ci', action='store_true',
+                        help='fail when there is no baseline to compare to')
+    parser.add_argument('--output',
+                        default=os.path.join(HERE, 'bench_output.txt'))
+    args = parser.parse_args(argv)
+
+    results = {}
+    for app in args.apps:
+        for count in args.switches:
+            key = '%s/%d' % (app, count)
+            results[key] = run(app, count, args.ports, args.duration,
+                               args.listen_port, args.ryu_manager)
+            summary = results[key]
+            print('%-28s connected=%d flow_mods/s=%.0f packet_outs/s=%.0f '
+                  'programmed_p95=%s stats_rtt_p95=%s'
+                  % (key, summary['connected'], summary['flow_mods_per_sec'],
+                     summary['packet_outs_per_sec'],
+                     summary['programmed_p95'],
+                     summary['stats_rtt_p95']))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('no baseline at %s; run with --update-baseline' % args.baseline)
+        return 1 if args.ci else 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    failures = regressions(results, baseline, args.tolerance)
+    for key, metric, before, after in failures:
+        print('REGRESSION %s %s: %.4g -> %.4g' % (key, metric, before, after))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
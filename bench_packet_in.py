@@ -0,0 +1,230 @@
+import os
+import sys
+import struct
+import timeit
+import pstats
+import inspect
+import argparse
+import cProfile
+import importlib
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from ryu.base import app_manager
+from ryu.controller import handler, ofp_event
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
+from ryu.lib import hub
+
+from bench_flow_encoder import NullDatapath
+from util import percentile
+
+PCAP_MAGIC = {0xa1b2c3d4: ('<', 1e-6), 0xd4c3b2a1: ('>', 1e-6),
+              0xa1b23c4d: ('<', 1e-9), 0x4d3cb2a1: ('>', 1e-9)}
+
+clock = timeit.default_timer
+
+
+def read_pcap(path):
+    # classic libpcap only; pcapng should be converted with editcap first
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        if len(header) < 24:
+            raise ValueError('%s: truncated pcap header' % path)
+        magic = struct.unpack('<I', header[:4])[0]
+        if magic not in PCAP_MAGIC:
+            raise ValueError('%s: not a libpcap file' % path)
+        order, _ = PCAP_MAGIC[magic]
+        record = struct.Struct(order + 'IIII')
+        frames = []
+        while True:
+            head = f.read(record.size)
+            if len(head) < record.size:
+                break
+            _, _, incl_len, _ = record.unpack(head)
+            data = f.read(incl_len)
+            if len(data) < incl_len:
+                break
+            frames.append(data)
+    return frames
+
+
+def load_app(name):
+    module = importlib.import_module(name[:-3] if name.endswith('.py')
+                                     else name)
+    classes = [cls for _, cls in inspect.getmembers(module, inspect.isclass)
+               if issubclass(cls, app_manager.RyuApp)
+               and cls.__module__ == module.__name__]
+    if len(classes) != 1:
+        raise ValueError('%s defines %d apps' % (name, len(classes)))
+    app = classes[0]()
+    handler.register_instance(app)
+    return app
+
+
+def handler_name(func):
+    return getattr(func, '__name__', repr(func))
+
+
+def features(app, datapath, dpid):
+    parser = datapath.ofproto_parser
+    msg = parser.OFPSwitchFeatures(datapath, dpid, 0, 0, 0, 0)
+    ev = ofp_event.EventOFPSwitchFeatures(msg)
+    for func in app.get_handlers(ev, CONFIG_DISPATCHER):
+        func(ev)
+    # then what ryu-manager does once the handshake is over, so apps that
+    # hook the datapath on MAIN_DISPATCHER are measured with their hooks
+    datapath.set_state(MAIN_DISPATCHER)
+    ev = ofp_event.EventOFPStateChange(datapath)
+    ev.state = MAIN_DISPATCHER
+    for func in app.get_handlers(ev, MAIN_DISPATCHER):
+        func(ev)
+
+
+def packet_in_event(datapath, data, in_port):
+    ofproto = datapath.ofproto
+    parser = datapath.ofproto_parser
+    msg = parser.OFPPacketIn(datapath, ofproto.OFP_NO_BUFFER, len(data),
+                             ofproto.OFPR_ACTION, 0, 0,
+                             parser.OFPMatch(in_port = in_port), data)
+    return ofp_event.EventOFPPacketIn(msg)
+
+
+class HandlerProfile(object):
+    def __init__(self):
+        self.profiles = {}
+
+    def call(self, func, ev):
+        name = handler_name(func)
+        profile = self.profiles.get(name)
+        if profile is None:
+            profile = self.profiles[name] = cProfile.Profile()
+        profile.enable()
+        try:
+            func(ev)
+        finally:
+            profile.disable()
+
+    def write(self, out, limit=25):
+        for name, profile in sorted(self.profiles.items()):
+            out.write('=== %s ===\n' % name)
+            stats = pstats.Stats(profile, stream = out)
+            stats.strip_dirs().sort_stats('cumulative').print_stats(limit)
+
+
+def run(app, datapath, frames, count, rate, in_port, profile=None):
+    latencies = []
+    per_handler = {}
+    # live block count before and after: what the run kept, not how much
+    # it allocated on the way
+    blocks = getattr(sys, 'getallocatedblocks', None)
+    blocks_before = blocks() if blocks else None
+    start = clock()
+    for n in range(count):
+        if rate:
+            ahead = start + float(n) / rate - clock()
+            if ahead > 0:
+                hub.sleep(ahead)
+        ev = packet_in_event(datapath, frames[n % len(frames)], in_port)
+        t0 = clock()
+        for func in app.get_handlers(ev, MAIN_DISPATCHER):
+            t1 = clock()
+            if profile is not None:
+                profile.call(func, ev)
+            else:
+                func(ev)
+            per_handler.setdefault(handler_name(func), []).append(
+                clock() - t1)
+        latencies.append(clock() - t0)
+    elapsed = clock() - start
+    blocks_after = blocks() if blocks else None
+    return {'events': count,
+            'elapsed': elapsed,
+            'events_per_sec': count / elapsed if elapsed > 0 else 0.0,
+            'latency_p50': percentile(latencies, 50),
+            'latency_p99': percentile(latencies, 99),
+            'latency_max': max(latencies) if latencies else None,
+            'handlers': dict((name, (len(times), percentile(times, 50),
+                                     percentile(times, 99)))
+                             for name, times in per_handler.items()),
+            'retained_blocks_per_event':
+                (float(blocks_after - blocks_before) / count
+                 if blocks and count else None)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='replay a pcap through an app\'s packet-in handlers')
+    parser.add_argument('pcap')
+    parser.add_argument('--app', default='metadata_test')
+    parser.add_argument('--count', type=int, default=0,
+                        help='events to replay (default: one pass)')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='events per second (default: unpaced)')
+    parser.add_argument('--in-port', type=int, default=1)
+    parser.add_argument('--dpid', type=int, default=1)
+    parser.add_argument('--profile', choices=['cprofile', 'tracemalloc'])
+    parser.add_argument('--report', default='bench_packet_in_report.txt')
+    args = parser.parse_args(argv)
+
+    frames = read_pcap(args.pcap)
+    if not frames:
+        print('%s: no frames' % args.pcap)
+        return 1
+    count = args.count or len(frames)
+    app = load_app(args.app)
+    datapath = NullDatapath(args.dpid)
+    features(app, datapath, args.dpid)
+
+    profile = None
+    if args.profile == 'cprofile':
+        profile = HandlerProfile()
+    elif args.profile == 'tracemalloc':
+        if tracemalloc is None:
+            print('tracemalloc needs Python 3.4+')
+            return 1
+        tracemalloc.start(10)
+
+    result = run(app, datapath, frames, count, args.rate, args.in_port,
+                 profile)
+
+    print('%s: %d events in %.3fs, %.0f events/s' %
+          (args.app, result['events'], result['elapsed'],
+           result['events_per_sec']))
+    print('latency p50=%.1f us p99=%.1f us max=%.1f us' %
+          (result['latency_p50'] * 1e6, result['latency_p99'] * 1e6,
+           result['latency_max'] * 1e6))
+    for name, (calls, p50, p99) in sorted(result['handlers'].items()):
+        print('  %-32s %8d calls p50=%.1f us p99=%.1f us' %
+              (name, calls, p50 * 1e6, p99 * 1e6))
+    if result['retained_blocks_per_event'] is not None:
+        print('blocks retained per event: %.2f' %
+              result['retained_blocks_per_event'])
+    print('sent to datapath: %d bytes' % datapath.sent)
+
+    if profile is not None:
+        with open(args.report, 'w') as out:
+            profile.write(out)
+        print('per-handler profile written to %s' % args.report)
+    elif args.profile == 'tracemalloc':
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)])
+        tracemalloc.stop()
+        print('traced memory: current %d bytes, peak %d bytes '
+              '(%.1f bytes/event)' % (current, peak,
+                                      float(current) / count))
+        here = os.path.dirname(os.path.abspath(__file__))
+        with open(args.report, 'w') as out:
+            for stat in snapshot.statistics('lineno')[:50]:
+                frame = stat.traceback[0]
+                marker = '*' if frame.filename.startswith(here) else ' '
+                out.write('%s %s\n' % (marker, stat))
+        print('allocation hot spots written to %s' % args.report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
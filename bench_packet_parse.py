@@ -0,0 +1,56 @@
+import sys
+import timeit
+
+from ryu.lib.packet import packet
+from ryu.lib.packet import ethernet, ipv4, tcp
+from ryu.ofproto import ether, inet
+
+from packet_fastpath import LazyPacket
+
+
+def sample_frame():
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(ethertype = ether.ETH_TYPE_IP,
+                                       dst = '00:00:00:00:00:02',
+                                       src = '00:00:00:00:00:01'))
+    pkt.add_protocol(ipv4.ipv4(proto = inet.IPPROTO_TCP,
+                               src = '10.0.0.1',
+                               dst = '10.0.0.2'))
+    pkt.add_protocol(tcp.tcp(src_port = 40000, dst_port = 80))
+    pkt.add_protocol(b'x' * 64)
+    pkt.serialize()
+    return pkt.data
+
+
+def full_parse(data):
+    pkt = packet.Packet(data = data)
+    eth = pkt.get_protocol(ethernet.ethernet)
+    ip = pkt.get_protocol(ipv4.ipv4)
+    l4 = pkt.get_protocol(tcp.tcp)
+    return eth.ethertype, ip.src, ip.dst, l4.src_port, l4.dst_port
+
+
+def lazy_parse(data):
+    pkt = LazyPacket(data)
+    return (pkt.eth_type, pkt.ipv4_src, pkt.ipv4_dst,
+            pkt.l4_src, pkt.l4_dst)
+
+
+def lazy_eth_type(data):
+    return LazyPacket(data).eth_type
+
+
+def main(number=100000):
+    data = sample_frame()
+    assert full_parse(data) == lazy_parse(data)
+    for name, func in (('packet.Packet', full_parse),
+                       ('LazyPacket', lazy_parse),
+                       ('LazyPacket eth_type only', lazy_eth_type)):
+        elapsed = min(timeit.repeat(lambda: func(data), number = number,
+                                    repeat = 3))
+        print('%-26s %8.2f us/packet %10.0f packets/s'
+              % (name, elapsed / number * 1e6, number / elapsed))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,352 @@
+import sys
+import json
+import time
+import socket
+import struct
+import argparse
+import threading
+
+from ofp_wire import (HEADER, message, OFPT_HELLO,
+                      OFPT_ECHO_REQUEST, OFPT_ECHO_REPLY,
+                      OFPT_FEATURES_REQUEST, OFPT_FEATURES_REPLY,
+                      OFPT_GET_CONFIG_REQUEST, OFPT_GET_CONFIG_REPLY,
+                      OFPT_PACKET_OUT, OFPT_FLOW_MOD, OFPT_GROUP_MOD,
+                      OFPT_MULTIPART_REQUEST, OFPT_MULTIPART_REPLY,
+                      OFPT_BARRIER_REQUEST, OFPT_BARRIER_REPLY,
+                      OFPT_METER_MOD)
+from util import percentile
+
+OFPMP_DESC = 0
+OFPMP_FLOW = 1
+OFPMP_PORT_STATS = 4
+OFPMP_GROUP_DESC = 7
+OFPMP_PORT_DESC = 13
+OFPMPF_REPLY_MORE = 1
+
+OFPFC_ADD = 0
+OFPFC_MODIFY = 1
+OFPFC_MODIFY_STRICT = 2
+OFPFC_DELETE = 3
+OFPFC_DELETE_STRICT = 4
+OFPGC_ADD = 0
+OFPGC_MODIFY = 1
+OFPGC_DELETE = 2
+OFPTT_ALL = 0xff
+OFPP_ANY = 0xffffffff
+OFPG_ALL = 0xfffffffc
+
+# names used in recorded events and summaries
+RECORDED = {OFPT_FLOW_MOD: 'flow_mod', OFPT_GROUP_MOD: 'group_mod',
+            OFPT_PACKET_OUT: 'packet_out', OFPT_METER_MOD: 'meter_mod',
+            OFPT_BARRIER_REQUEST: 'barrier',
+            OFPT_MULTIPART_REQUEST: 'multipart'}
+
+MULTIPART = struct.Struct('!HH4x')
+FEATURES = struct.Struct('!QIBB2xII')
+PORT = struct.Struct('!I4x6s2x16sIIIIIIII')
+PORT_STATS = struct.Struct('!I4x12QII')
+FLOW_MOD = struct.Struct('!QQBBHHHIIIH2x')
+FLOW_STATS = struct.Struct('!HBxIIHHHH4xQQQ')
+FLOW_STATS_REQUEST = struct.Struct('!B3xII4xQQ')
+GROUP_MOD = struct.Struct('!HBxI')
+
+MAX_REPLY_BODY = 0xff00 - HEADER.size - MULTIPART.size
+EMPTY_MATCH = b'\x00\x01\x00\x04\x00\x00\x00\x00'
+
+
+def split_match(data, offset):
+    length = struct.unpack_from('!H', data, offset + 2)[0]
+    padded = (length + 7) // 8 * 8
+    return data[offset:offset + padded], offset + padded
+
+
+class FlowEntry(object):
+    __slots__ = ('cookie', 'table_id', 'priority', 'idle', 'hard', 'flags',
+                 'match', 'instructions', 'installed')
+
+    def __init__(self, fields, match, instructions):
+        (self.cookie, _, self.table_id, _, self.idle, self.hard,
+         self.priority, _, _, _, self.flags) = fields
+        self.match = match
+        self.instructions = instructions
+        self.installed = time.time()
+
+
+class EmulatedSwitch(threading.Thread):
+    def __init__(self, dpid, ports, address, traffic=1000):
+        super(EmulatedSwitch, self).__init__()
+        self.daemon = True
+        self.dpid = dpid
+        self.ports = ports
+        self.address = address
+        self.traffic = traffic
+        self.sock = None
+        self.running = True
+        self.flows = {}
+        self.groups = {}
+        self.events = []
+        self.stats_service = []
+        self.connected_at = None
+        self.features_at = None
+        self.started = time.time()
+
+    def run(self):
+        try:
+            self.sock = socket.create_connection(self.address)
+        except socket.error:
+            return
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connected_at = time.time()
+        self.send(message(OFPT_HELLO, 0))
+        buf = b''
+        while self.running:
+            try:
+                data = self.sock.recv(65536)
+            except socket.error:
+                break
+            if not data:
+                break
+            buf += data
+            while len(buf) >= HEADER.size:
+                _, msg_type, length, xid = HEADER.unpack_from(buf)
+                if len(buf) < length:
+                    break
+                msg, buf = buf[:length], buf[length:]
+                self.handle(msg_type, xid, msg)
+        self.running = False
+
+    def stop(self):
+        self.running = False
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.sock.close()
+
+    def send(self, data):
+        try:
+            self.sock.sendall(data)
+        except socket.error:
+            self.running = False
+
+    def handle(self, msg_type, xid, msg):
+        now = time.time()
+        if msg_type in RECORDED:
+            self.events.append((now, RECORDED[msg_type], xid, len(msg)))
+        if msg_type == OFPT_ECHO_REQUEST:
+            self.send(message(OFPT_ECHO_REPLY, xid, msg[HEADER.size:]))
+        elif msg_type == OFPT_FEATURES_REQUEST:
+            self.features_at = now
+            self.send(message(OFPT_FEATURES_REPLY, xid,
+                              FEATURES.pack(self.dpid, 256, 254, 0, 0x4f, 0)))
+        elif msg_type == OFPT_GET_CONFIG_REQUEST:
+            self.send(message(OFPT_GET_CONFIG_REPLY, xid,
+                              struct.pack('!HH', 0, 128)))
+        elif msg_type == OFPT_BARRIER_REQUEST:
+            self.send(message(OFPT_BARRIER_REPLY, xid))
+        elif msg_type == OFPT_FLOW_MOD:
+            self.flow_mod(msg)
+        elif msg_type == OFPT_GROUP_MOD:
+            self.group_mod(msg)
+        elif msg_type == OFPT_MULTIPART_REQUEST:
+            self.multipart(xid, msg)
+            self.stats_service.append(time.time() - now)
+
+    def flow_mod(self, msg):
+        fields = FLOW_MOD.unpack_from(msg, HEADER.size)
+        cookie, cookie_mask, table_id, command = fields[:4]
+        priority = fields[6]
+        match, offset = split_match(msg, HEADER.size + FLOW_MOD.size)
+        if command == OFPFC_ADD:
+            entry = FlowEntry(fields, match, msg[offset:])
+            self.flows[(table_id, priority, match)] = entry
+            return
+        strict = command in (OFPFC_MODIFY_STRICT, OFPFC_DELETE_STRICT)
+        for key, entry in list(self.flows.items()):
+            if table_id != OFPTT_ALL and entry.table_id != table_id:
+                continue
+            if strict and (entry.priority != priority or
+                           entry.match != match):
+                continue
+            if not strict and match != EMPTY_MATCH and entry.match != match:
+                continue
+            if entry.cookie & cookie_mask != cookie & cookie_mask:
+                continue
+            if command in (OFPFC_DELETE, OFPFC_DELETE_STRICT):
+                del self.flows[key]
+            else:
+                entry.instructions = msg[offset:]
+
+    def group_mod(self, msg):
+        command, group_type, group_id = GROUP_MOD.unpack_from(msg,
+                                                              HEADER.size)
+        buckets = msg[HEADER.size + GROUP_MOD.size:]
+        if command == OFPGC_DELETE:
+            if group_id == OFPG_ALL:
+                self.groups.clear()
+            else:
+                self.groups.pop(group_id, None)
+        else:
+            self.groups[group_id] = (group_type, buckets)
+
+    def multipart(self, xid, msg):
+        mp_type = MULTIPART.unpack_from(msg, HEADER.size)[0]
+        body = msg[HEADER.size + MULTIPART.size:]
+        if mp_type == OFPMP_PORT_DESC:
+            entries = [self.port_desc(n) for n in range(1, self.ports + 1)]
+        elif mp_type == OFPMP_PORT_STATS:
+            port_no = struct.unpack_from('!I', body)[0]
+            entries = [self.port_stats(n) for n in range(1, self.ports + 1)
+                       if port_no in (OFPP_ANY, n)]
+        elif mp_type == OFPMP_FLOW:
+            entries = self.flow_stats(body)
+        elif mp_type == OFPMP_GROUP_DESC:
+            entries = [GROUP_MOD.pack(GROUP_MOD.size + len(buckets),
+                                      group_type, group_id) + buckets
+                       for group_id, (group_type, buckets)
+                       in sorted(self.groups.items())]
+        elif mp_type == OFPMP_DESC:
+            entries = [b''.join(s.encode('ascii').ljust(n, b'\x00')
+                                for s, n in (('emulated', 256),
+                                             ('emulated_switch', 256),
+                                             ('1.0', 256), ('0', 32),
+                                             ('emulated', 256)))]
+        else:
+            entries = []
+        self.multipart_reply(xid, mp_type, entries)
+
+    def multipart_reply(self, xid, mp_type, entries):
+        # split large bodies the way real switches do so the controller's
+        # OFPMPF_REPLY_MORE reassembly is exercised
+        chunks = [[]]
+        size = 0
+        for entry in entries:
+            if size + len(entry) > MAX_REPLY_BODY and chunks[-1]:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(entry)
+            size += len(entry)
+        for n, chunk in enumerate(chunks):
+            flags = OFPMPF_REPLY_MORE if n < len(chunks) - 1 else 0
+            self.send(message(OFPT_MULTIPART_REPLY, xid,
+                              MULTIPART.pack(mp_type, flags) +
+                              b''.join(chunk)))
+
+    def port_desc(self, port_no):
+        hw_addr = struct.pack('!HI', self.dpid & 0xffff, port_no)
+        name = ('s%d-eth%d' % (self.dpid, port_no)).encode('ascii')
+        return PORT.pack(port_no, hw_addr, name[:15], 0, 4, 0x840, 0x840,
+                         0x840, 0, 10000000, 10000000)
+
+    def port_stats(self, port_no):
+        elapsed = time.time() - self.started
+        packets = int(elapsed * self.traffic * (1 + port_no % 4))
+        return PORT_STATS.pack(port_no, packets, packets, packets * 500,
+                               packets * 500, 0, 0, 0, 0, 0, 0, 0, 0,
+                               int(elapsed), int(elapsed % 1 * 1e9))
+
+    def flow_stats(self, body):
+        table_id, _, _, cookie, cookie_mask = \
+            FLOW_STATS_REQUEST.unpack_from(body)
+        now = time.time()
+        entries = []
+        for entry in self.flows.values():
+            if table_id != OFPTT_ALL and entry.table_id != table_id:
+                continue
+            if entry.cookie & cookie_mask != cookie & cookie_mask:
+                continue
+            duration = now - entry.installed
+            packets = int(duration * self.traffic)
+            length = FLOW_STATS.size + len(entry.match) + \
+                len(entry.instructions)
+            entries.append(FLOW_STATS.pack(
+                length, entry.table_id, int(duration),
+                int(duration % 1 * 1e9), entry.priority, entry.idle,
+                entry.hard, entry.flags, entry.cookie, packets,
+                packets * 500) + entry.match + entry.instructions)
+        return entries
+
+    def received(self, kind):
+        return [e for e in self.events if e[1] == kind]
+
+
+def rate(events):
+    if len(events) < 2:
+        return 0.0
+    span = events[-1][0] - events[0][0]
+    return len(events) / span if span > 0 else float(len(events))
+
+
+class EmulatedFleet(object):
+    def __init__(self, count, ports, address, first_dpid=1, traffic=1000):
+        self.switches = [EmulatedSwitch(first_dpid + n, ports, address,
+                                        traffic)
+                         for n in range(count)]
+
+    def start(self):
+        for switch in self.switches:
+            switch.start()
+
+    def stop(self):
+        for switch in self.switches:
+            switch.stop()
+        for switch in self.switches:
+            switch.join(1)
+
+    def summary(self):
+        flow_mods = []
+        packet_outs = []
+        programmed = []
+        intervals = []
+        service = []
+        for switch in self.switches:
+            mods = switch.received('flow_mod') + switch.received('group_mod')
+            flow_mods.extend(switch.received('flow_mod'))
+            packet_outs.extend(switch.received('packet_out'))
+            if mods and switch.connected_at is not None:
+                programmed.append(mods[-1][0] - switch.connected_at)
+            stats = [e[0] for e in switch.received('multipart')]
+            intervals.extend(b - a for a, b in zip(stats, stats[1:]))
+            service.extend(switch.stats_service)
+        flow_mods.sort()
+        packet_outs.sort()
+        return {
+            'switches': len(self.switches),
+            'connected': sum(1 for s in self.switches
+                             if s.connected_at is not None),
+            'flow_mods': len(flow_mods),
+            'flow_mods_per_sec': rate(flow_mods),
+            'packet_outs': len(packet_outs),
+            'packet_outs_per_sec': rate(packet_outs),
+            'programmed_p50': percentile(programmed, 50),
+            'programmed_p95': percentile(programmed, 95),
+            'programmed_max': percentile(programmed, 100),
+            'stats_interval_p50': percentile(intervals, 50),
+            'stats_interval_p95': percentile(intervals, 95),
+            'stats_service_p95': percentile(service, 95),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='emulated OpenFlow 1.3 switches for load testing')
+    parser.add_argument('--switches', type=int, default=1)
+    parser.add_argument('--ports', type=int, default=4)
+    parser.add_argument('--controller', default='127.0.0.1:6633')
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args(argv)
+
+    host, port = args.controller.rsplit(':', 1)
+    fleet = EmulatedFleet(args.switches, args.ports, (host, int(port)))
+    fleet.start()
+    try:
+        time.sleep(args.duration)
+    finally:
+        fleet.stop()
+    json.dump(fleet.summary(), sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
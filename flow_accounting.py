@@ -0,0 +1,161 @@
+import time
+import logging
+
+from ryu.lib import hub
+
+from shadow_table import cookies
+
+LOG = logging.getLogger('flow_accounting')
+
+COOKIE_MASK_EXACT = 0xffffffffffffffff
+
+
+class FlowAccount(object):
+    __slots__ = ('dpid', 'cookie', 'table_id', 'installed', 'refreshed',
+                 'packets', 'bytes')
+
+    def __init__(self, dpid, cookie, table_id):
+        self.dpid = dpid
+        self.cookie = cookie
+        self.table_id = table_id
+        self.installed = time.time()
+        self.refreshed = self.installed
+        self.packets = 0
+        self.bytes = 0
+
+
+class FlowAccounting(object):
+    def __init__(self, name='flow_accounting', idle_timeout=30,
+                 hard_timeout=0, long_lived=60, refresh=30,
+                 max_requests=64, logger=None):
+        self.cookies = cookies.allocate(name)
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.long_lived = long_lived
+        self.refresh = refresh
+        self.max_requests = max_requests
+        self.logger = logger or LOG
+        self.datapaths = {}
+        self.active = {}
+        self.closed = {}
+        self.ports = {}
+        self.requests = {}
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = hub.spawn(self._run)
+        return self.thread
+
+    def add_datapath(self, datapath):
+        self.datapaths[datapath.id] = datapath
+
+    def remove_datapath(self, dpid):
+        self.datapaths.pop(dpid, None)
+        for key in [k for k in self.active if k[0] == dpid]:
+            self._close(self.active.pop(key))
+
+    def prepare(self, datapath, flow):
+        # every accounted flow gets its own cookie so FlowRemoved and
+        # targeted stats replies map straight back to it
+        ofproto = datapath.ofproto
+        cookie = self.cookies.next()
+        flow = dict(flow, cookie = cookie,
+                    flags = int(flow.get('flags', 0)) |
+                    ofproto.OFPFF_SEND_FLOW_REM)
+        flow.setdefault('idle_timeout', self.idle_timeout)
+        flow.setdefault('hard_timeout', self.hard_timeout)
+        account = FlowAccount(datapath.id, cookie,
+                              int(flow.get('table_id', 0)))
+        self.active[(datapath.id, cookie)] = account
+        return flow
+
+    def _close(self, account):
+        totals = self.closed.setdefault(account.dpid, [0, 0, 0])
+        totals[0] += account.packets
+        totals[1] += account.bytes
+        totals[2] += 1
+
+    def flow_removed(self, ev):
+        msg = ev.msg
+        account = self.active.pop((msg.datapath.id, msg.cookie), None)
+        if account is None:
+            return None
+        # the removal carries the final counters of the entry
+        account.packets = msg.packet_count
+        account.bytes = msg.byte_count
+        self._close(account)
+        return account
+
+    def port_status(self, ev):
+        msg = ev.msg
+        ofproto = msg.datapath.ofproto
+        key = (msg.datapath.id, msg.desc.port_no)
+        if msg.reason == ofproto.OFPPR_DELETE:
+            self.ports.pop(key, None)
+        else:
+            self.ports[key] = msg.desc.state
+        return key
+
+    def port_up(self, dpid, port_no):
+        state = self.ports.get((dpid, port_no))
+        if state is None:
+            return None
+        return not state & 1  # OFPPS_LINK_DOWN
+
+    def _run(self):
+        while True:
+            hub.sleep(self.refresh)
+            self._request_long_lived(time.time())
+
+    def _request_long_lived(self, now):
+        sent = 0
+        for account in sorted(self.active.values(),
+                              key=lambda a: a.refreshed):
+            if sent >= self.max_requests:
+                break
+            if now - account.installed < self.long_lived or \
+                    now - account.refreshed < self.refresh:
+                continue
+            dp = self.datapaths.get(account.dpid)
+            if dp is None:
+                continue
+            ofproto = dp.ofproto
+            parser = dp.ofproto_parser
+            req = parser.OFPFlowStatsRequest(dp, 0, account.table_id,
+                                             ofproto.OFPP_ANY,
+                                             ofproto.OFPG_ANY,
+                                             account.cookie,
+                                             COOKIE_MASK_EXACT,
+                                             parser.OFPMatch())
+            dp.set_xid(req)
+            dp.send_msg(req)
+            self.requests[(dp.id, req.xid)] = now
+            account.refreshed = now
+            sent += 1
+        # requests the switch never answered must not pile up
+        for key, sent_at in list(self.requests.items()):
+            if now - sent_at > self.refresh * 2:
+                del self.requests[key]
+
+    def flow_stats_reply(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        if (dpid, msg.xid) not in self.requests:
+            return False
+        if not msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            del self.requests[(dpid, msg.xid)]
+        for stat in msg.body:
+            account = self.active.get((dpid, stat.cookie))
+            if account is not None:
+                account.packets = stat.packet_count
+                account.bytes = stat.byte_count
+        return True
+
+    def totals(self, dpid):
+        packets, nbytes, flows = self.closed.get(dpid, (0, 0, 0))
+        live = [a for (d, _), a in self.active.items() if d == dpid]
+        return {'packets': packets + sum(a.packets for a in live),
+                'bytes': nbytes + sum(a.bytes for a in live),
+                'active_flows': len(live),
+                'removed_flows': flows}
@@ -0,0 +1,100 @@
+import time
+import logging
+
+from ryu.lib.ofctl_v1_3 import to_match, to_actions
+
+LOG = logging.getLogger('flow_batch')
+
+
+def build_flow_mod(dp, flow, cmd):
+    # same conversion as ofctl_v1_3.mod_flow_entry, but the message is
+    # returned instead of sent so callers can serialize several at once
+    ofproto = dp.ofproto
+    cookie = int(flow.get('cookie', 0))
+    cookie_mask = int(flow.get('cookie_mask', 0))
+    table_id = int(flow.get('table_id', 0))
+    idle_timeout = int(flow.get('idle_timeout', 0))
+    hard_timeout = int(flow.get('hard_timeout', 0))
+    priority = int(flow.get('priority', 0))
+    buffer_id = int(flow.get('buffer_id', ofproto.OFP_NO_BUFFER))
+    out_port = int(flow.get('out_port', ofproto.OFPP_ANY))
+    out_group = int(flow.get('out_group', ofproto.OFPG_ANY))
+    flags = int(flow.get('flags', 0))
+    match = to_match(dp, flow.get('match', {}))
+    inst = to_actions(dp, flow.get('actions', []))
+    return dp.ofproto_parser.OFPFlowMod(dp, cookie, cookie_mask, table_id,
+                                        cmd, idle_timeout, hard_timeout,
+                                        priority, buffer_id, out_port,
+                                        out_group, flags, match, inst)
+
+
+class FlowBatch(object):
+    def __init__(self, datapath, logger=None, shadow=None, encoder=None):
+        self.datapath = datapath
+        self.logger = logger or LOG
+        self.shadow = shadow
+        self.encoder = encoder
+        self.bufs = []
+        self.count = 0
+        self.elapsed = 0.0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, flow, cmd):
+        start = time.time()
+        if self.encoder is not None:
+            buf, msg = self.encoder.encode(self.datapath, flow, cmd)
+            self.bufs.append(buf)
+            self.count += 1
+            self._record(msg)
+        else:
+            msg = build_flow_mod(self.datapath, flow, cmd)
+            self.add_msg(msg)
+        self.elapsed += time.time() - start
+        return msg
+
+    def _record(self, msg):
+        if self.shadow is not None and \
+                msg.cls_msg_type == self.datapath.ofproto.OFPT_FLOW_MOD:
+            self.shadow.record(msg, self.datapath.id)
+
+    def add_msg(self, msg):
+        self.datapath.set_xid(msg)
+        msg.serialize()
+        self.bufs.append(msg.buf)
+        self.count += 1
+        self._record(msg)
+        return msg
+
+    def send(self, barrier=True):
+        dp = self.datapath
+        start = time.time()
+        xid = None
+        if barrier:
+            req = dp.ofproto_parser.OFPBarrierRequest(dp)
+            dp.set_xid(req)
+            req.serialize()
+            self.bufs.append(req.buf)
+            xid = req.xid
+        if self.bufs:
+            dp.send(b''.join(self.bufs))
+        self.elapsed += time.time() - start
+
+        count = self.count
+        rate = count / self.elapsed if self.elapsed > 0 else 0.0
+        self.logger.info('datapath %016x: %d flow-mods in %.3f ms '
+                         '(%.0f flow-mods/s)',
+                         dp.id, count, self.elapsed * 1000, rate)
+        self.bufs = []
+        self.count = 0
+        self.elapsed = 0.0
+        return xid, rate
+
+
+def install_flows(datapath, flows, cmd, logger=None, barrier=True,
+                  shadow=None, encoder=None):
+    batch = FlowBatch(datapath, logger, shadow, encoder)
+    for flow in flows:
+        batch.add(flow, cmd)
+    return batch.send(barrier)
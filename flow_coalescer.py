@@ -0,0 +1,96 @@
+import logging
+from collections import OrderedDict
+
+from ryu.lib import hub
+
+from flow_batch import FlowBatch
+from util import freeze, merge_flow_mods
+
+LOG = logging.getLogger('flow_coalescer')
+
+
+class PendingFlows(object):
+    def __init__(self, datapath):
+        self.datapath = datapath
+        self.mods = OrderedDict()
+        self.epoch = 0
+        self.changes = []
+        self.timer = None
+
+
+class FlowCoalescer(object):
+    def __init__(self, window=0.05, logger=None, shadow=None):
+        self.window = window
+        self.logger = logger or LOG
+        self.shadow = shadow
+        self.pending = {}
+        self.on_flush = None
+        self.submitted = 0
+        self.suppressed = 0
+        self.sent = 0
+
+    def submit(self, datapath, flow, cmd, change=None):
+        ofproto = datapath.ofproto
+        state = self.pending.get(datapath.id)
+        if state is None:
+            state = self.pending[datapath.id] = PendingFlows(datapath)
+        self.submitted += 1
+        if change is not None:
+            state.changes.append(change)
+
+        if cmd in (ofproto.OFPFC_ADD, ofproto.OFPFC_MODIFY_STRICT,
+                   ofproto.OFPFC_DELETE_STRICT):
+            key = (state.epoch, int(flow.get('table_id', 0)),
+                   int(flow.get('priority', 0)),
+                   freeze(flow.get('match', {})))
+            prev = state.mods.get(key)
+            if prev is not None:
+                self.suppressed += 1
+                state.mods[key] = merge_flow_mods(ofproto, prev, cmd, flow)
+            else:
+                state.mods[key] = (flow, cmd)
+        else:
+            # a wildcard command may touch any pending key, so nothing
+            # queued before it can merge with anything queued after it
+            state.epoch += 1
+            state.mods[(state.epoch, object())] = (flow, cmd)
+            state.epoch += 1
+
+        if state.timer is None:
+            state.timer = hub.spawn_after(self.window, self.flush, datapath)
+
+    def flush(self, datapath):
+        state = self.pending.pop(datapath.id, None)
+        if state is None:
+            return None
+        if state.timer is not None:
+            # no-op when the timer itself is doing the flush
+            state.timer.cancel()
+        batch = FlowBatch(datapath, self.logger, self.shadow)
+        for flow, cmd in state.mods.values():
+            batch.add(flow, cmd)
+        self.sent += len(batch)
+        xid, _ = batch.send()
+        if self.on_flush is not None:
+            self.on_flush(datapath, xid, state.changes)
+        return xid
+
+    def discard(self, dpid):
+        state = self.pending.pop(dpid, None)
+        if state is None:
+            return 0
+        if state.timer is not None:
+            state.timer.cancel()
+        for change in state.changes:
+            change.cancelled = True
+            change._event.set()
+        return len(state.mods)
+
+    def flush_all(self):
+        for state in list(self.pending.values()):
+            self.flush(state.datapath)
+
+    def stats(self):
+        return {'submitted': self.submitted,
+                'suppressed': self.suppressed,
+                'sent': self.sent}
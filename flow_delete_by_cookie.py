@@ -1,37 +1,59 @@
-import time
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.ofproto.ether import ETH_TYPE_IP
-from ryu.lib.ofctl_v1_3 import mod_flow_entry
+from flow_batch import FlowBatch
+from flow_scheduler import FlowScheduler
+from shadow_table import ShadowTables, cookies
+from match_index import compact
 
 class Flow_Delete_by_Cookie(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
     def __init__(self, *args, **kwargs):
         super(Flow_Delete_by_Cookie, self).__init__(*args, **kwargs)
+        self.shadow = ShadowTables()
+        self.cookies = cookies.allocate('flow_delete_by_cookie')
+        self.scheduler = FlowScheduler(self.logger, shadow = self.shadow)
     
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
         ofproto = datapath.ofproto 
 
-        mod_flow_entry(datapath, {}, ofproto.OFPFC_DELETE)
+        batch = FlowBatch(datapath, self.logger, self.shadow)
+        batch.add({}, ofproto.OFPFC_DELETE)
         priority = 100
         self.logger.info('switch joind: datapath: %061x' % datapath.id) 
-        mod_flow_entry(datapath,
-                      {'priority' : priority,
-                       'cookie' : 1234605616436508552,
-                       'cookie_mask': 0,
-                       'match' : {'dl_type' : ETH_TYPE_IP,
-                                  'ipv4_dst' : '192.168.1.1'},
-                       'actions' : [{'type' : 'OUTPUT', 'port' : 2}]},
-                      ofproto.OFPFC_ADD)
+        flows, report = compact([{'priority' : priority,
+                                  'cookie' : self.cookies.cookie(1),
+                                  'cookie_mask': 0,
+                                  'match' : {'dl_type' : ETH_TYPE_IP,
+                                             'ipv4_dst' : '192.168.1.1'},
+                                  'actions' : [{'type' : 'OUTPUT', 'port' : 2}]}],
+                                logger = self.logger)
+        for flow in flows:
+            batch.add(flow, ofproto.OFPFC_ADD)
+        batch.send()
 
         self.logger.info("----flow mod----")
-        time.sleep(10)
-        self.logger.info("---flow delete---")
-        mod_flow_entry(datapath, {'cookie':1234605616436508552},
-                      ofproto.OFPFC_DELETE)
+        self.scheduler.delete(datapath, 10, {'cookie' : self.cookies.base,
+                                             'cookie_mask' : self.cookies.mask,
+                                             'table_id' : ofproto.OFPTT_ALL})
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def barrier_reply_handler(self, ev):
+        changes = self.scheduler.barrier_reply(ev)
+        if any(change.delay for change in changes):
+            table = self.shadow.table(ev.msg.datapath.id)
+            self.logger.info("---flow delete--- %d flows left under cookie %x",
+                             len(table.flows_by_cookie(self.cookies.base,
+                                                       self.cookies.mask)),
+                             self.cookies.base)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def state_change_handler(self, ev):
+        if ev.datapath.id is not None:
+            self.scheduler.forget(ev.datapath.id)
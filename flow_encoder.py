@@ -0,0 +1,78 @@
+import struct
+from collections import OrderedDict
+
+from flow_batch import build_flow_mod
+from packet_template import OFP_XID_OFFSET, next_xid
+from util import freeze
+
+OFP_FLOW_MOD_COOKIE_OFFSET = 8
+
+
+class FlowModEncoder(object):
+    # wire bytes do not depend on the datapath, only on the OpenFlow
+    # version, so one compiled spec serves every switch
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    def _compile(self, datapath, flow, cmd):
+        # the cookie is patched like the xid, so flows that differ only
+        # in it (one cookie per accounted flow) share an entry
+        if 'cookie' in flow:
+            flow = dict(flow)
+            del flow['cookie']
+        key = (datapath.ofproto.OFP_VERSION, cmd, freeze(flow))
+        entry = self.cache.pop(key, None)
+        if entry is not None:
+            self.hits += 1
+            self.cache[key] = entry
+            return entry
+        self.misses += 1
+        msg = build_flow_mod(datapath, flow, cmd)
+        msg.xid = 0
+        msg.serialize()
+        entry = (bytes(msg.buf), msg)
+        self.cache[key] = entry
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def encode(self, datapath, flow, cmd):
+        buf, template = self._compile(datapath, flow, cmd)
+        buf = bytearray(buf)
+        xid = next_xid(datapath)
+        struct.pack_into('!I', buf, OFP_XID_OFFSET, xid)
+        cookie = int(flow.get('cookie', 0))
+        if cookie:
+            struct.pack_into('!Q', buf, OFP_FLOW_MOD_COOKIE_OFFSET, cookie)
+        # the cached message belongs to whichever switch compiled it first;
+        # callers get their own with this send's xid, cookie and bytes
+        msg = template.__class__.__new__(template.__class__)
+        msg.__dict__.update(template.__dict__)
+        msg.datapath = datapath
+        msg.xid = xid
+        msg.cookie = cookie
+        msg.buf = bytes(buf)
+        return msg.buf, msg
+
+    def send(self, datapath, flow, cmd):
+        buf, msg = self.encode(datapath, flow, cmd)
+        datapath.send(buf)
+        return msg
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'size': len(self.cache), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': float(self.hits) / total if total else 0.0}
+
+
+# shared by every app in the process so a spec compiles once per fleet
+encoder = FlowModEncoder()
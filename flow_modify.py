@@ -1,42 +1,59 @@
-import time
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.ofctl_v1_3 import mod_flow_entry
+from flow_batch import FlowBatch
+from flow_scheduler import FlowScheduler
+from flow_coalescer import FlowCoalescer
 
 class SAMPLE_APP(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    # seconds to hold scheduled changes so superseding writes collapse;
+    # 0 sends every change as soon as it is due
+    COALESCE_WINDOW = 0.05
 
     def __init__(self, *args, **kwargs):
         super(SAMPLE_APP, self).__init__(*args, **kwargs)
+        self.coalescer = None
+        if self.COALESCE_WINDOW:
+            self.coalescer = FlowCoalescer(self.COALESCE_WINDOW, self.logger)
+        self.scheduler = FlowScheduler(self.logger, coalescer = self.coalescer)
     
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
         ofproto = datapath.ofproto 
 
-        mod_flow_entry(datapath, {}, ofproto.OFPFC_DELETE)
+        batch = FlowBatch(datapath, self.logger)
+        batch.add({}, ofproto.OFPFC_DELETE)
         priority = 100
         self.logger.info('switch joind: datapath: %061x' % datapath.id) 
-        mod_flow_entry(datapath,
-                      {'priority' : priority,
-                       'match' : {'in_port' : 1},
-                       'actions' : [{'type' : 'SET_FIELD',
-                                     'field': 'ipv4_dst',
-                                     'value': '172.16.0.1'},
-                                    {'type' : 'OUTPUT', 'port' :2}]},
-                      ofproto.OFPFC_ADD)
+        batch.add({'priority' : priority,
+                   'match' : {'in_port' : 1},
+                   'actions' : [{'type' : 'SET_FIELD',
+                                 'field': 'ipv4_dst',
+                                 'value': '172.16.0.1'},
+                                {'type' : 'OUTPUT', 'port' :2}]},
+                  ofproto.OFPFC_ADD)
+        batch.send()
 
-        time.sleep(3)
-        mod_flow_entry(datapath,
+        self.scheduler.modify_strict(datapath, 3,
                       {'priority' : priority,
                        'match' : {'in_port' : 1},
                        'actions' : [{'type' : 'SET_FIELD',
                                      'field': 'ipv4_dst',
                                      'value': '192.168.0.1'},
-                                    {'type' : 'OUTPUT', 'port' :2}]},
-                       ofproto.OFPFC_MODIFY_STRICT)
+                                    {'type' : 'OUTPUT', 'port' :2}]})
 
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def barrier_reply_handler(self, ev):
+        if self.scheduler.barrier_reply(ev) and self.coalescer is not None:
+            self.logger.info('coalescer: %(submitted)d submitted, '
+                             '%(suppressed)d suppressed, %(sent)d sent',
+                             self.coalescer.stats())
 
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def state_change_handler(self, ev):
+        if ev.datapath.id is not None:
+            self.scheduler.forget(ev.datapath.id)
@@ -0,0 +1,135 @@
+import time
+import logging
+from collections import deque
+
+from ryu.lib import hub
+
+from flow_batch import FlowBatch
+
+LOG = logging.getLogger('flow_scheduler')
+
+
+class FlowChange(object):
+    def __init__(self, datapath, changes, delay):
+        self.datapath = datapath
+        self.changes = changes
+        self.delay = delay
+        self.xid = None
+        self.sent_at = None
+        self.done_at = None
+        self.cancelled = False
+        self._event = hub.Event()
+
+    @property
+    def done(self):
+        return self.done_at is not None
+
+    @property
+    def latency(self):
+        if self.done_at is None:
+            return None
+        return self.done_at - self.sent_at
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+        return self.done
+
+    def _complete(self):
+        self.done_at = time.time()
+        self._event.set()
+
+
+class FlowScheduler(object):
+    def __init__(self, logger=None, history=100, shadow=None,
+                 coalescer=None):
+        self.logger = logger or LOG
+        self.shadow = shadow
+        self.history = history
+        self.pending = {}
+        self.scheduled = {}
+        self.latencies = {}
+        self.coalescer = coalescer
+        if coalescer is not None:
+            coalescer.on_flush = self._flushed
+
+    def schedule_batch(self, datapath, delay, changes):
+        change = FlowChange(datapath, list(changes), delay)
+        self.scheduled.setdefault(datapath.id, set()).add(change)
+        hub.spawn_after(delay, self._fire, change)
+        return change
+
+    def schedule(self, datapath, delay, flow, cmd):
+        return self.schedule_batch(datapath, delay, [(flow, cmd)])
+
+    def add(self, datapath, delay, flow):
+        return self.schedule(datapath, delay, flow,
+                             datapath.ofproto.OFPFC_ADD)
+
+    def modify_strict(self, datapath, delay, flow):
+        return self.schedule(datapath, delay, flow,
+                             datapath.ofproto.OFPFC_MODIFY_STRICT)
+
+    def delete(self, datapath, delay, flow):
+        return self.schedule(datapath, delay, flow,
+                             datapath.ofproto.OFPFC_DELETE)
+
+    def cancel(self, change):
+        change.cancelled = True
+
+    def _fire(self, change):
+        dp = change.datapath
+        waiting = self.scheduled.get(dp.id)
+        if waiting is not None:
+            waiting.discard(change)
+            if not waiting:
+                del self.scheduled[dp.id]
+        if change.cancelled:
+            return
+        change.sent_at = time.time()
+        if self.coalescer is not None:
+            for flow, cmd in change.changes:
+                self.coalescer.submit(dp, flow, cmd, change)
+            return
+        batch = FlowBatch(dp, self.logger, self.shadow)
+        for flow, cmd in change.changes:
+            batch.add(flow, cmd)
+        xid, _ = batch.send()
+        self._flushed(dp, xid, [change])
+
+    def _flushed(self, datapath, xid, changes):
+        for change in changes:
+            change.xid = xid
+        self.pending.setdefault((datapath.id, xid), []).extend(changes)
+
+    def barrier_reply(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        changes = self.pending.pop((dpid, msg.xid), [])
+        for change in changes:
+            change._complete()
+            samples = self.latencies.setdefault(dpid,
+                                                deque(maxlen=self.history))
+            samples.append(change.latency)
+            self.logger.info('datapath %016x: %d flow change(s) confirmed '
+                             'in %.3f ms', dpid, len(change.changes),
+                             change.latency * 1000)
+        return changes
+
+    def forget(self, dpid):
+        # the switch is gone: timers still pending must not fire at its
+        # socket, and unanswered barriers will never be answered
+        for change in self.scheduled.pop(dpid, ()):
+            change.cancelled = True
+            change._event.set()
+        if self.coalescer is not None:
+            self.coalescer.discard(dpid)
+        for key in [k for k in self.pending if k[0] == dpid]:
+            for change in self.pending.pop(key):
+                change.cancelled = True
+                change._event.set()
+
+    def mean_latency(self, dpid):
+        samples = self.latencies.get(dpid)
+        if not samples:
+            return None
+        return sum(samples) / len(samples)
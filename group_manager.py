@@ -0,0 +1,153 @@
+import logging
+
+from ryu.lib.ofctl_v1_3 import to_action
+
+from util import freeze
+
+LOG = logging.getLogger('group_manager')
+
+GROUP_TYPES = {'ALL': 0, 'SELECT': 1, 'INDIRECT': 2, 'FF': 3}
+
+
+def split_fanout(actions):
+    # a SET_FIELD/OUTPUT chain becomes one bucket per OUTPUT carrying the
+    # fields set so far; anything else cannot be moved into buckets safely
+    buckets = []
+    fields = []
+    for action in actions:
+        kind = action.get('type')
+        if kind == 'SET_FIELD':
+            fields = [f for f in fields if f['field'] != action['field']]
+            fields.append(action)
+        elif kind == 'OUTPUT':
+            buckets.append({'actions': fields + [action]})
+        else:
+            return None
+    if len(buckets) < 2 or actions[-1].get('type') != 'OUTPUT':
+        return None
+    return buckets
+
+
+class GroupEntry(object):
+    __slots__ = ('group_id', 'key', 'group_type', 'buckets', 'refs')
+
+    def __init__(self, group_id, key, group_type, buckets):
+        self.group_id = group_id
+        self.key = key
+        self.group_type = group_type
+        self.buckets = buckets
+        self.refs = 0
+
+
+class DatapathGroups(object):
+    def __init__(self, first_id=1):
+        self.by_key = {}
+        self.by_id = {}
+        self.next_id = first_id
+        self.free = []
+
+    def allocate(self):
+        if self.free:
+            return self.free.pop()
+        group_id = self.next_id
+        self.next_id += 1
+        return group_id
+
+
+class GroupManager(object):
+    def __init__(self, logger=None, first_id=1):
+        self.logger = logger or LOG
+        self.first_id = first_id
+        self.datapaths = {}
+
+    def _groups(self, dpid):
+        groups = self.datapaths.get(dpid)
+        if groups is None:
+            groups = self.datapaths[dpid] = DatapathGroups(self.first_id)
+        return groups
+
+    def remove_datapath(self, dpid):
+        self.datapaths.pop(dpid, None)
+
+    def reset(self, datapath, batch=None):
+        # groups outlive the controller connection; start from empty
+        self.remove_datapath(datapath.id)
+        ofproto = datapath.ofproto
+        mod = datapath.ofproto_parser.OFPGroupMod(
+            datapath, ofproto.OFPGC_DELETE, ofproto.OFPGT_ALL,
+            ofproto.OFPG_ALL, [])
+        if batch is not None:
+            batch.add_msg(mod)
+        else:
+            datapath.send_msg(mod)
+
+    def _buckets(self, datapath, buckets):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        return [parser.OFPBucket(int(b.get('weight', 0)),
+                                 int(b.get('watch_port', ofproto.OFPP_ANY)),
+                                 int(b.get('watch_group', ofproto.OFPG_ANY)),
+                                 [to_action(datapath, a)
+                                  for a in b.get('actions', [])])
+                for b in buckets]
+
+    def _send(self, datapath, cmd, entry, batch):
+        mod = datapath.ofproto_parser.OFPGroupMod(
+            datapath, cmd, GROUP_TYPES[entry.group_type], entry.group_id,
+            self._buckets(datapath, entry.buckets))
+        if batch is not None:
+            batch.add_msg(mod)
+        else:
+            datapath.send_msg(mod)
+
+    def acquire(self, datapath, buckets, group_type='ALL', batch=None):
+        groups = self._groups(datapath.id)
+        key = (group_type, freeze(buckets))
+        entry = groups.by_key.get(key)
+        if entry is None:
+            entry = GroupEntry(groups.allocate(), key, group_type, buckets)
+            groups.by_key[key] = entry
+            groups.by_id[entry.group_id] = entry
+            self._send(datapath, datapath.ofproto.OFPGC_ADD, entry, batch)
+        entry.refs += 1
+        return entry.group_id
+
+    def release(self, datapath, group_id, batch=None):
+        groups = self._groups(datapath.id)
+        entry = groups.by_id.get(group_id)
+        if entry is None:
+            return
+        entry.refs -= 1
+        if entry.refs > 0:
+            return
+        del groups.by_id[group_id]
+        if groups.by_key.get(entry.key) is entry:
+            del groups.by_key[entry.key]
+        groups.free.append(group_id)
+        self._send(datapath, datapath.ofproto.OFPGC_DELETE, entry, batch)
+
+    def modify(self, datapath, group_id, buckets, batch=None):
+        # every flow pointing at the group follows the new buckets, so the
+        # group is changed in place rather than deleted and recreated
+        groups = self._groups(datapath.id)
+        entry = groups.by_id[group_id]
+        if groups.by_key.get(entry.key) is entry:
+            del groups.by_key[entry.key]
+        entry.buckets = buckets
+        entry.key = (entry.group_type, freeze(buckets))
+        groups.by_key.setdefault(entry.key, entry)
+        self._send(datapath, datapath.ofproto.OFPGC_MODIFY, entry, batch)
+
+    def fanout(self, datapath, actions, batch=None):
+        buckets = split_fanout(actions)
+        if buckets is None:
+            return actions, None
+        group_id = self.acquire(datapath, buckets, 'ALL', batch)
+        return [{'type': 'GROUP', 'group_id': group_id}], group_id
+
+    def convert_flow(self, datapath, flow, batch=None):
+        actions, group_id = self.fanout(datapath, flow.get('actions', []),
+                                        batch)
+        if group_id is None:
+            return flow, None
+        return dict(flow, actions = actions), group_id
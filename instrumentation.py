@@ -0,0 +1,258 @@
+import time
+import bisect
+import logging
+import functools
+
+from ryu.controller import ofp_event
+from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER
+from ryu.controller.handler import set_ev_cls
+from ryu.lib import hub
+
+from ofp_wire import HEADER, OFPT_FLOW_MOD
+from shard_ipc import shard_id
+
+LOG = logging.getLogger('instrumentation')
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+clock = time.time
+
+
+class Histogram(object):
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        running = 0
+        for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), self.counts):
+            running += n
+            yield bound, running
+
+
+class DatapathMetrics(object):
+    def __init__(self, datapath):
+        self.datapath = datapath
+        self.flow_mods = 0
+        self.last = (0, clock())
+        self.rate = 0.0
+        self.send_q_max = 0
+
+
+def count_flow_mods(buf):
+    # a batch carries many messages back to back; walk their headers
+    count = 0
+    offset = 0
+    end = len(buf)
+    while offset + HEADER.size <= end:
+        _, msg_type, length, _ = HEADER.unpack_from(buf, offset)
+        if msg_type == OFPT_FLOW_MOD:
+            count += 1
+        if length < HEADER.size:
+            break
+        offset += length
+    return count
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (k, str(v).replace('"', '\\"'))
+                    for k, v in sorted(labels.items()))
+
+
+class MetricsRegistry(object):
+    # one per process: every instrumented app and datapath is scraped
+    # from the same endpoint
+    def __init__(self, sample_interval=0.5):
+        self.sample_interval = sample_interval
+        self.apps = []
+        self.datapaths = {}
+        self.pollers = []
+        self.server = None
+        self.sampler = None
+
+    def add_app(self, app):
+        if app not in self.apps:
+            self.apps.append(app)
+        if self.sampler is None:
+            self.sampler = hub.spawn(self._sample)
+
+    def add_poller(self, name, poller):
+        if (name, poller) not in self.pollers:
+            self.pollers.append((name, poller))
+
+    def serve(self, address):
+        if self.server is None:
+            self.server = hub.StreamServer(address, self._handle)
+            hub.spawn(self.server.serve_forever)
+            LOG.info('metrics on http://%s:%d/metrics', *address)
+        return self.server
+
+    def add_datapath(self, datapath):
+        metrics = self.datapaths.get(datapath.id)
+        if metrics is not None and metrics.datapath is datapath:
+            return metrics
+        metrics = self.datapaths[datapath.id] = DatapathMetrics(datapath)
+        send = datapath.send
+
+        def counting_send(buf, *args, **kwargs):
+            metrics.flow_mods += count_flow_mods(buf)
+            return send(buf, *args, **kwargs)
+        # Datapath.send_msg ends up here too, passing close_socket, so raw
+        # batches and single messages are both counted
+        datapath.send = counting_send
+        return metrics
+
+    def remove_datapath(self, dpid):
+        self.datapaths.pop(dpid, None)
+
+    def _sample(self):
+        while True:
+            hub.sleep(self.sample_interval)
+            now = clock()
+            for app in self.apps:
+                depth = app.events.qsize()
+                if depth > app.event_queue_max:
+                    app.event_queue_max = depth
+            for metrics in self.datapaths.values():
+                send_q = getattr(metrics.datapath, 'send_q', None)
+                if send_q is not None:
+                    metrics.send_q_max = max(metrics.send_q_max,
+                                             send_q.qsize())
+                count, then = metrics.last
+                if now > then:
+                    metrics.rate = (metrics.flow_mods - count) / (now - then)
+                metrics.last = (metrics.flow_mods, now)
+
+    def render(self):
+        lines = ['# HELP ryu_handler_seconds Time spent in set_ev_cls '
+                 'handlers.',
+                 '# TYPE ryu_handler_seconds histogram']
+        for app in self.apps:
+            for (name, event), hist in sorted(app.handler_latency.items()):
+                labels = _labels(app=app.name, handler=name, event=event)
+                for bound, count in hist.cumulative():
+                    lines.append('ryu_handler_seconds_bucket{%s,le="%s"} %d'
+                                 % (labels, bound, count))
+                lines.append('ryu_handler_seconds_sum{%s} %.9f'
+                             % (labels, hist.total))
+                lines.append('ryu_handler_seconds_count{%s} %d'
+                             % (labels, hist.count))
+        lines += ['# HELP ryu_event_queue_depth Events waiting for the app.',
+                  '# TYPE ryu_event_queue_depth gauge']
+        for app in self.apps:
+            labels = _labels(app=app.name)
+            lines.append('ryu_event_queue_depth{%s} %d'
+                         % (labels, app.events.qsize()))
+            lines.append('ryu_event_queue_depth_max{%s} %d'
+                         % (labels, app.event_queue_max))
+            app.event_queue_max = 0
+        lines += ['# HELP ryu_send_queue_depth Messages waiting to be '
+                  'written to the switch.',
+                  '# TYPE ryu_send_queue_depth gauge']
+        for dpid, metrics in sorted(self.datapaths.items()):
+            send_q = getattr(metrics.datapath, 'send_q', None)
+            labels = _labels(dpid='%016x' % dpid)
+            lines.append('ryu_send_queue_depth{%s} %d'
+                         % (labels, send_q.qsize() if send_q else 0))
+            lines.append('ryu_send_queue_depth_max{%s} %d'
+                         % (labels, metrics.send_q_max))
+            metrics.send_q_max = 0
+        lines += ['# TYPE ryu_flow_mods_sent_total counter']
+        lines += ['ryu_flow_mods_sent_total{%s} %d'
+                  % (_labels(dpid='%016x' % dpid), m.flow_mods)
+                  for dpid, m in sorted(self.datapaths.items())]
+        lines += ['# TYPE ryu_flow_mods_per_second gauge']
+        lines += ['ryu_flow_mods_per_second{%s} %.1f'
+                  % (_labels(dpid='%016x' % dpid), m.rate)
+                  for dpid, m in sorted(self.datapaths.items())]
+        lines += ['# HELP ryu_stats_rtt_seconds Stats request to last '
+                  'reply part.',
+                  '# TYPE ryu_stats_rtt_seconds summary']
+        for name, poller in self.pollers:
+            for quantile in (50, 95, 99):
+                rtt = poller.rtt(quantile)
+                if rtt is not None:
+                    lines.append('ryu_stats_rtt_seconds{%s} %.9f'
+                                 % (_labels(app=name,
+                                            quantile=quantile / 100.0), rtt))
+            lines.append('ryu_stats_rtt_seconds_count{%s} %d'
+                         % (_labels(app=name), len(poller.latencies)))
+        return '\n'.join(lines) + '\n'
+
+    def _handle(self, sock, address):
+        try:
+            request = b''
+            while b'\r\n\r\n' not in request and len(request) < 8192:
+                chunk = sock.recv(1024)
+                if not chunk:
+                    break
+                request += chunk
+            body = self.render().encode('utf-8')
+            sock.sendall(b'HTTP/1.0 200 OK\r\n'
+                         b'Content-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() +
+                         b'\r\n\r\n' + body)
+        finally:
+            sock.close()
+
+
+registry = MetricsRegistry()
+
+
+class InstrumentedApp(object):
+    # mix in before app_manager.RyuApp; every set_ev_cls handler is timed
+    # when ryu registers it, so app code does not change
+    METRICS_ADDRESS = ('127.0.0.1', 9101)
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedApp, self).__init__(*args, **kwargs)
+        self.handler_latency = {}
+        self.event_queue_max = 0
+        self._timed = {}
+        registry.add_app(self)
+        if self.METRICS_ADDRESS is not None:
+            host, port = self.METRICS_ADDRESS
+            # shard_controller workers each get their own port
+            registry.serve((host, port + (shard_id() or 0)))
+
+    def register_handler(self, ev_cls, handler):
+        name = getattr(handler, '__name__', repr(handler))
+        hist = self.handler_latency.setdefault((name, ev_cls.__name__),
+                                               Histogram())
+
+        @functools.wraps(handler)
+        def timed(ev):
+            start = clock()
+            try:
+                return handler(ev)
+            finally:
+                hist.observe(clock() - start)
+        # get_handlers() reads the dispatcher states off the handler
+        if hasattr(handler, 'callers'):
+            timed.callers = handler.callers
+        self._timed[(ev_cls, handler)] = timed
+        super(InstrumentedApp, self).register_handler(ev_cls, timed)
+
+    def unregister_handler(self, ev_cls, handler):
+        timed = self._timed.pop((ev_cls, handler), handler)
+        super(InstrumentedApp, self).unregister_handler(ev_cls, timed)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange,
+                [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _instrument_state_change(self, ev):
+        datapath = ev.datapath
+        if datapath.id is None:
+            return
+        if ev.state == MAIN_DISPATCHER:
+            registry.add_datapath(datapath)
+        else:
+            registry.remove_datapath(datapath.id)
@@ -0,0 +1,356 @@
+import socket
+import struct
+import logging
+from collections import OrderedDict
+
+from util import freeze
+
+LOG = logging.getLogger('match_index')
+
+FIELD_BITS = {'in_port': 32, 'eth_type': 16, 'ip_proto': 8,
+              'ipv4_src': 32, 'ipv4_dst': 32,
+              'tcp_src': 16, 'tcp_dst': 16, 'udp_src': 16, 'udp_dst': 16,
+              'sctp_src': 16, 'sctp_dst': 16, 'metadata': 64}
+ALIASES = {'dl_type': 'eth_type', 'nw_src': 'ipv4_src',
+           'nw_dst': 'ipv4_dst', 'nw_proto': 'ip_proto'}
+IPV4_FIELDS = ('ipv4_src', 'ipv4_dst')
+TRIE_FIELD = 'ipv4_dst'
+
+
+def _ip(text):
+    return struct.unpack('!I', socket.inet_aton(text))[0]
+
+
+def _int(text):
+    return int(text, 0) if isinstance(text, str) else int(text)
+
+
+def field_mask(field, value):
+    # (value, mask) for a match value in any form ofctl accepts
+    bits = FIELD_BITS.get(field)
+    if bits is None:
+        return value, None
+    full = (1 << bits) - 1
+    if isinstance(value, (list, tuple)):
+        value, mask = value
+    elif isinstance(value, str) and '/' in value:
+        value, mask = value.split('/', 1)
+    else:
+        mask = full
+    if field in IPV4_FIELDS:
+        value = _ip(value) if isinstance(value, str) else int(value)
+        if isinstance(mask, str):
+            mask = _ip(mask) if '.' in mask else \
+                (full << (bits - int(mask))) & full
+    else:
+        value = _int(value)
+        mask = _int(mask)
+    return value & mask, mask
+
+
+def prefix_len(mask, bits=32):
+    # length of a contiguous mask, None for anything else
+    length = bin(mask).count('1')
+    if mask != ((1 << bits) - 1) ^ ((1 << (bits - length)) - 1):
+        return None
+    return length
+
+
+def format_ipv4(value, length):
+    addr = socket.inet_ntoa(struct.pack('!I', value))
+    return addr if length == 32 else '%s/%d' % (addr, length)
+
+
+def canonical(match):
+    fields = {}
+    proto = match.get('ip_proto', match.get('nw_proto'))
+    for name, value in match.items():
+        name = ALIASES.get(name, name)
+        if name in ('tp_src', 'tp_dst'):
+            name = {6: 'tcp', 17: 'udp', 132: 'sctp'}.get(
+                _int(proto) if proto is not None else None, 'tp') + name[2:]
+        fields[name] = field_mask(name, value)
+    return fields
+
+
+def covers(outer, inner):
+    # every packet matched by inner is matched by outer
+    for name, (value, mask) in outer.items():
+        other = inner.get(name)
+        if other is None:
+            return False
+        if mask is None:
+            if other != (value, mask):
+                return False
+        elif other[1] is None or mask & ~other[1] or \
+                (other[0] & mask) != value:
+            return False
+    return True
+
+
+def overlaps(a, b):
+    for name, (value, mask) in a.items():
+        other = b.get(name)
+        if other is None:
+            continue
+        if mask is None or other[1] is None:
+            if other != (value, mask):
+                return False
+        elif (value ^ other[0]) & mask & other[1]:
+            return False
+    return True
+
+
+def is_permanent(flow):
+    return not int(flow.get('idle_timeout', 0)) and \
+        not int(flow.get('hard_timeout', 0))
+
+
+class IndexedRule(object):
+    __slots__ = ('flow', 'fields', 'priority', 'treatment', 'permanent')
+
+    def __init__(self, flow):
+        self.flow = flow
+        self.fields = canonical(flow.get('match', {}))
+        self.priority = int(flow.get('priority', 0))
+        # a rule with a timeout only shadows or covers until it expires
+        self.permanent = is_permanent(flow)
+        self.treatment = freeze(dict((k, v) for k, v in flow.items()
+                                      if k not in ('match', 'priority')))
+
+    def prefix(self):
+        value, mask = self.fields.get(TRIE_FIELD, (0, 0))
+        length = prefix_len(mask)
+        return None if length is None else (value, length)
+
+
+class TrieNode(object):
+    __slots__ = ('children', 'rules')
+
+    def __init__(self):
+        self.children = [None, None]
+        self.rules = []
+
+
+class PrefixTrie(object):
+    def __init__(self, bits=32):
+        self.bits = bits
+        self.root = TrieNode()
+
+    def _bit(self, value, depth):
+        return (value >> (self.bits - 1 - depth)) & 1
+
+    def insert(self, value, length, item):
+        node = self.root
+        for depth in range(length):
+            bit = self._bit(value, depth)
+            if node.children[bit] is None:
+                node.children[bit] = TrieNode()
+            node = node.children[bit]
+        node.rules.append(item)
+
+    def remove(self, value, length, item):
+        node = self.root
+        for depth in range(length):
+            node = node.children[self._bit(value, depth)]
+            if node is None:
+                return
+        if item in node.rules:
+            node.rules.remove(item)
+
+    def ancestors(self, value, length):
+        # everything stored on a prefix covering value/length
+        node = self.root
+        found = list(node.rules)
+        for depth in range(length):
+            node = node.children[self._bit(value, depth)]
+            if node is None:
+                break
+            found.extend(node.rules)
+        return found
+
+    def descendants(self, value, length):
+        node = self.root
+        for depth in range(length):
+            node = node.children[self._bit(value, depth)]
+            if node is None:
+                return []
+        found = []
+        stack = [c for c in node.children if c is not None]
+        while stack:
+            node = stack.pop()
+            found.extend(node.rules)
+            stack.extend(c for c in node.children if c is not None)
+        return found
+
+
+class MatchIndex(object):
+    # rules of one table, indexed by their ipv4_dst prefix; rules with a
+    # non-contiguous mask are kept aside and checked linearly
+    def __init__(self, table_id=0):
+        self.table_id = table_id
+        self.trie = PrefixTrie()
+        self.irregular = []
+        self.rules = []
+
+    def __len__(self):
+        return len(self.rules)
+
+    def add(self, flow):
+        rule = flow if isinstance(flow, IndexedRule) else IndexedRule(flow)
+        prefix = rule.prefix()
+        if prefix is None:
+            self.irregular.append(rule)
+        else:
+            self.trie.insert(prefix[0], prefix[1], rule)
+        self.rules.append(rule)
+        return rule
+
+    def remove(self, rule):
+        prefix = rule.prefix()
+        if prefix is None:
+            self.irregular.remove(rule)
+        else:
+            self.trie.remove(prefix[0], prefix[1], rule)
+        self.rules.remove(rule)
+
+    def _candidates(self, rule, below=True):
+        prefix = rule.prefix()
+        if prefix is None:
+            return list(self.rules)
+        found = self.trie.ancestors(*prefix)
+        if below:
+            found.extend(self.trie.descendants(*prefix))
+        return found + self.irregular
+
+    def covering(self, rule):
+        return [r for r in self._candidates(rule, below=False)
+                if r is not rule and covers(r.fields, rule.fields)]
+
+    def overlapping(self, rule):
+        return [r for r in self._candidates(rule)
+                if r is not rule and overlaps(r.fields, rule.fields)]
+
+    def shadowing(self, rule):
+        return [r for r in self.covering(rule)
+                if r.permanent and r.priority > rule.priority]
+
+    def lookup(self, packet):
+        # highest-priority rule matching a packet given as exact fields
+        fields = canonical(packet)
+        best = None
+        addr = fields.get(TRIE_FIELD, (0, 0))[0]
+        for rule in self.trie.ancestors(addr, 32) + self.irregular:
+            if covers(rule.fields, fields) and \
+                    (best is None or rule.priority > best.priority):
+                best = rule
+        return best
+
+
+def aggregate(flows, field=TRIE_FIELD):
+    # merge sibling prefixes of rules that differ only in one ipv4 field
+    groups = OrderedDict()
+    passthrough = []
+    for flow in flows:
+        match = flow.get('match', {})
+        names = [n for n in match if ALIASES.get(n, n) == field]
+        if len(names) != 1 or not is_permanent(flow):
+            # merged siblings would share one idle timer
+            passthrough.append(flow)
+            continue
+        value, mask = field_mask(field, match[names[0]])
+        length = prefix_len(mask)
+        if length is None:
+            passthrough.append(flow)
+            continue
+        rest = dict((k, v) for k, v in match.items() if k != names[0])
+        key = (freeze(dict(flow, match = rest)), names[0])
+        groups.setdefault(key, (flow, set()))[1].add((value, length))
+
+    merged = []
+    for (_, name), (template, prefixes) in groups.items():
+        for length in range(32, 0, -1):
+            for value, plen in sorted(p for p in prefixes if p[1] == length):
+                sibling = (value ^ (1 << (32 - length)), length)
+                if (value, plen) in prefixes and sibling in prefixes:
+                    prefixes -= set([(value, plen), sibling])
+                    parent = length - 1
+                    pmask = (0xffffffff << (32 - parent)) & 0xffffffff
+                    prefixes.add((value & pmask, parent))
+        for value, length in sorted(prefixes):
+            match = dict(template.get('match', {}))
+            match[name] = format_ipv4(value, length)
+            merged.append(dict(template, match = match))
+    return passthrough + merged
+
+
+class CompactReport(object):
+    def __init__(self):
+        self.before = {}
+        self.after = {}
+        self.shadowed = []
+        self.redundant = []
+        self.merged = 0
+
+    def __str__(self):
+        tables = sorted(set(self.before) | set(self.after))
+        occupancy = ', '.join('table %d: %d -> %d' %
+                              (t, self.before.get(t, 0), self.after.get(t, 0))
+                              for t in tables)
+        return '%s (%d merged, %d shadowed, %d redundant)' % \
+            (occupancy or 'empty', self.merged, len(self.shadowed),
+             len(self.redundant))
+
+
+def compact(flows, drop_shadowed=True, drop_redundant=True, logger=None):
+    # flows are ofctl add specs; returns the specs worth installing
+    report = CompactReport()
+    tables = OrderedDict()
+    for flow in flows:
+        table_id = int(flow.get('table_id', 0))
+        tables.setdefault(table_id, []).append(flow)
+        report.before[table_id] = report.before.get(table_id, 0) + 1
+
+    result = []
+    for table_id, table_flows in tables.items():
+        merged = table_flows
+        for field in IPV4_FIELDS:
+            merged = aggregate(merged, field)
+        report.merged += len(table_flows) - len(merged)
+
+        index = MatchIndex(table_id)
+        kept = []
+        for flow in sorted(merged, key=lambda f: -int(f.get('priority', 0))):
+            rule = IndexedRule(flow)
+            if drop_shadowed and index.shadowing(rule):
+                report.shadowed.append(flow)
+                continue
+            kept.append(index.add(rule))
+
+        if drop_redundant:
+            for rule in list(kept):
+                if _redundant(index, rule):
+                    index.remove(rule)
+                    kept.remove(rule)
+                    report.redundant.append(rule.flow)
+
+        report.after[table_id] = len(kept)
+        result.extend(rule.flow for rule in kept)
+
+    (logger or LOG).info('match index: %s', report)
+    return result, report
+
+
+def _redundant(index, rule):
+    # a lower rule with the same treatment already catches everything
+    # this one does, and nothing in between claims any of it
+    for lower in index.covering(rule):
+        if not lower.permanent or lower.priority >= rule.priority or \
+                lower.treatment != rule.treatment:
+            continue
+        between = [r for r in index.overlapping(rule)
+                   if r is not lower and
+                   lower.priority <= r.priority <= rule.priority]
+        if not between:
+            return True
+    return False
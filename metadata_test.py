@@ -2,78 +2,80 @@ import time
 import random
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.ofproto.ether import ETH_TYPE_IP
-from ryu.lib.ofctl_v1_3 import mod_flow_entry
+from flow_batch import FlowBatch
+from pipeline import Pipeline
 from ryu.lib.mac import haddr_to_bin
-from ryu.lib.packet import packet
+from packet_fastpath import LazyPacket
+from packet_in_governor import PacketInGovernor
+from instrumentation import InstrumentedApp
+from ryu.lib import hub
 
-class TTP(app_manager.RyuApp):
+# the hand-built version wrote metadata 123456789/15 and matched 0/1 in
+# table 1, so its second flow could never match; tagging makes it fire
+PIPELINE = Pipeline([
+    {'table_id' : 0,
+     'rules' : [{'match' : {'in_port' : 1}, 'tag' : 'in_port1'}]},
+    {'table_id' : 1,
+     'rules' : [{'when' : 'in_port1',
+                 'actions' : [{'type' : 'OUTPUT', 'port' : 2},
+                              {'type' : 'OUTPUT', 'port' : ofproto_v1_3.OFPP_CONTROLLER,
+                               'max_len' : 0}]}]},
+])
+
+class TTP(InstrumentedApp, app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
     def __init__(self, *args, **kwargs):
         super(TTP, self).__init__(*args, **kwargs)
+        self.governor = PacketInGovernor(backlog = self.events.qsize,
+                                         logger = self.logger)
+        self.governor.start()
+        self.monitor = hub.spawn(self.report_stats)
+
+    def report_stats(self):
+        while True:
+            hub.sleep(5)
+            for dpid in list(self.governor.states):
+                rates = self.governor.rates(dpid)
+                self.logger.info("datapath_id=%d packet-in/s received=%.1f "
+                                 "dropped=%.1f handled=%.1f", dpid,
+                                 rates['received'], rates['dropped'],
+                                 rates['handled'])
     
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
         ofproto = datapath.ofproto 
        
-        mod_flow_entry(datapath, {}, ofproto.OFPFC_DELETE)
-        
-#        metadata = 123456789
-
-#        mod_flow_entry(datapath,
-#                      {'priority' : 100,
-#                       'table_id' : 0,
-#                       'cookie':0,
-#                       'cookie_mask' :0,
-#                       'match' : {'in_port' : 1},
-#                       'actions' : [{'type':'WRITE_METADATA', 'metadata':'123456789', 'metadata_mask':'5'},
-#                                    {'type':'GOTO_TABLE', 'table_id':1}]}, datapath.ofproto.OFPFC_ADD)
-
-#        mod_flow_entry(datapath,
-#                      {'priority' : 100,
-#                       'table_id' : 1,
-#                       'cookie' : 0,
-#                       'cookie_mask' : 0,
-#                       'match' : {'metadata':'123456789/15'},
-#                       'actions' : [{'type' : 'OUTPUT', 'port' :2}]}, datapath.ofproto.OFPFC_ADD)
-
-##########
-
+        self.governor.add_datapath(datapath)
+        batch = FlowBatch(datapath, self.logger)
+        batch.add({}, ofproto.OFPFC_DELETE)
+        for flow in self.governor.govern_all(datapath, PIPELINE.flows):
+            batch.add(flow, ofproto.OFPFC_ADD)
+        batch.send()
 
-        parser = datapath.ofproto_parser
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def state_change_handler(self, ev):
+        if ev.datapath.id is not None:
+            self.governor.remove_datapath(ev.datapath.id)
 
-        priority = 100
-        match = parser.OFPMatch()
-        match.set_in_port(1)
-        instructions = [parser.OFPInstructionWriteMetadata(123456789,15), 
-                        parser.OFPInstructionGotoTable(1)]
-        flow_mod = parser.OFPFlowMod(datapath = datapath, 
-                                     table_id=0, 
-                                     priority = priority, 
-                                     match=match, 
-                                     instructions=instructions)
-        datapath.send_msg(flow_mod)
-###
-        output = parser.OFPActionOutput(2,0)
-        output_to_controller = parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, 0)
-        match = parser.OFPMatch()
-        match.set_metadata_masked(0,1)
-        actions = [output, output_to_controller]
-        instructions = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
-        flow_mod = parser.OFPFlowMod(datapath = datapath, table_id=1, priority=priority, match=match, instructions=instructions)
-        datapath.send_msg(flow_mod)
+    @set_ev_cls(ofp_event.EventOFPMeterStatsReply, MAIN_DISPATCHER)
+    def meter_stats_reply_handler(self, ev):
+        self.governor.meter_stats_reply(ev)
 
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
         msg = ev.msg
-        print msg
-        datapath = msg.datapath
-        pkt = packet.Packet(data = msg.data)
+        self.governor.received(msg)
+        # only the first header_len bytes arrive; the packet was already
+        # forwarded to port 2, so the buffered copy is released in bulk
+        pkt = LazyPacket(msg.data)
+        self.governor.release(msg)
+        self.governor.handled(msg)
 #        print pkt    
          
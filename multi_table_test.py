@@ -6,10 +6,20 @@ from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.ofproto.ether import ETH_TYPE_IP
-from ryu.lib.ofctl_v1_3 import mod_flow_entry
+from flow_batch import FlowBatch
+from pipeline import Pipeline
 from ryu.lib.mac import haddr_to_bin
 from ryu.lib.packet import packet
 
+# flat single-table rules; the in_port match is factored into table 0 and
+# the rest is shared per class in table 1
+RULES = [
+    {'match' : {'in_port' : 1},
+     'actions' : [{'type' : 'OUTPUT', 'port' : 2,
+                   'max_len' : ofproto_v1_3.OFPCML_NO_BUFFER}]},
+]
+PIPELINE = Pipeline.from_rules(RULES, ('in_port',))
+
 class TTP(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
@@ -21,66 +31,7 @@ class TTP(app_manager.RyuApp):
         datapath = ev.msg.datapath
         ofproto = datapath.ofproto 
        
-        mod_flow_entry(datapath, {}, ofproto.OFPFC_DELETE)
-        
-#        metadata = 123456789
-
-#        mod_flow_entry(datapath,
-#                      {'priority' : 100,
-#                       'table_id' : 0,
-#                       'cookie':0,
-#                       'cookie_mask' :0,
-#                       'match' : {'in_port' : 1},
-#                       'actions' : [{'type':'WRITE_METADATA', 'metadata':'123456789', 'metadata_mask':'5'},
-#                                    {'type':'GOTO_TABLE', 'table_id':1}]}, datapath.ofproto.OFPFC_ADD)
-
-#        mod_flow_entry(datapath,
-#                      {'priority' : 100,
-#                       'table_id' : 1,
-#                       'cookie' : 0,
-#                       'cookie_mask' : 0,
-#                       'match' : {'metadata':'123456789/15'},
-#                       'actions' : [{'type' : 'OUTPUT', 'port' :2}]}, datapath.ofproto.OFPFC_ADD)
-
-##########
-
-
-        parser = datapath.ofproto_parser
-
-        priority = 100
-        match = parser.OFPMatch()
-        match.set_in_port(1)
-        instructions = [parser.OFPInstructionWriteMetadata(123456789,15), 
-                        parser.OFPInstructionGotoTable(1)]
-        flow_mod = parser.OFPFlowMod(datapath = datapath, 
-                                     table_id=0, 
-                                     priority = priority, 
-                                     match=match, 
-                                     instructions=instructions)
-        datapath.send_msg(flow_mod)
-###
-        output = parser.OFPActionOutput(2,0)
-        match = parser.OFPMatch()
-#        match.set_in_port()
-        instructions = [parser.OFPInstructionGotoTable(2)]
-        flow_mod = parser.OFPFlowMod(datapath = datapath,
-                                     table_id=1,
-                                     priority = priority,
-                                     match = match,
-                                     instructions = instructions)
-        datapath.send_msg(flow_mod)
-        
-        match = parser.OFPMatch()
-#        match.set_in_port(1)
-        actions = [parser.OFPActionOutput(2, ofproto.OFPCML_NO_BUFFER)]
-        instructions = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
-        flow_mod = parser.OFPFlowMod(datapath = datapath, 
-                                     table_id=2, 
-                                     priority=priority, 
-                                     match=match, 
-                                     instructions=instructions)
-        datapath.send_msg(flow_mod)
-
-
-#        print pkt    
-         
+        batch = FlowBatch(datapath, self.logger)
+        batch.add({}, ofproto.OFPFC_DELETE)
+        PIPELINE.install(datapath, self.logger, batch)
+        batch.send()
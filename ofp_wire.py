@@ -0,0 +1,61 @@
+import time
+import socket
+import struct
+
+# OpenFlow 1.3 framing shared by the emulator, the benchmarks and the
+# shard proxy, none of which load ryu
+
+OFP_VERSION = 0x04
+
+OFPT_HELLO = 0
+OFPT_ECHO_REQUEST = 2
+OFPT_ECHO_REPLY = 3
+OFPT_FEATURES_REQUEST = 5
+OFPT_FEATURES_REPLY = 6
+OFPT_GET_CONFIG_REQUEST = 7
+OFPT_GET_CONFIG_REPLY = 8
+OFPT_PACKET_OUT = 13
+OFPT_FLOW_MOD = 14
+OFPT_GROUP_MOD = 15
+OFPT_MULTIPART_REQUEST = 18
+OFPT_MULTIPART_REPLY = 19
+OFPT_BARRIER_REQUEST = 20
+OFPT_BARRIER_REPLY = 21
+OFPT_METER_MOD = 29
+
+HEADER = struct.Struct('!BBHI')
+
+
+def message(msg_type, xid, body=b''):
+    return HEADER.pack(OFP_VERSION, msg_type, HEADER.size + len(body),
+                       xid) + body
+
+
+def read_message(sock):
+    header = b''
+    while len(header) < HEADER.size:
+        data = sock.recv(HEADER.size - len(header))
+        if not data:
+            return None
+        header += data
+    _, msg_type, length, xid = HEADER.unpack(header)
+    body = b''
+    while len(body) < length - HEADER.size:
+        data = sock.recv(length - HEADER.size - len(body))
+        if not data:
+            return None
+        body += data
+    return msg_type, xid, header + body
+
+
+def wait_for_port(port, timeout=30, alive=None):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if alive is not None and not alive():
+            return False
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return True
+        except socket.error:
+            time.sleep(0.2)
+    return False
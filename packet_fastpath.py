@@ -0,0 +1,138 @@
+import socket
+import struct
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+VLAN_TYPES = (0x8100, 0x88a8)
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+_u8 = struct.Struct('!B')
+_u16 = struct.Struct('!H')
+_u32 = struct.Struct('!I')
+_ports = struct.Struct('!HH')
+
+
+class LazyPacket(object):
+    # decodes header fields on demand straight out of a memoryview of the
+    # packet-in payload; layers that are never asked for are never touched
+    __slots__ = ('buf', '_l3', '_eth_type', '_l4')
+
+    def __init__(self, data):
+        self.buf = memoryview(data)
+        self._l3 = None
+        self._eth_type = None
+        self._l4 = None
+
+    def _decode_eth(self):
+        offset = 12
+        eth_type = _u16.unpack_from(self.buf, offset)[0]
+        while eth_type in VLAN_TYPES:
+            offset += 4
+            eth_type = _u16.unpack_from(self.buf, offset)[0]
+        self._eth_type = eth_type
+        self._l3 = offset + 2
+
+    @property
+    def eth_type(self):
+        if self._eth_type is None:
+            self._decode_eth()
+        return self._eth_type
+
+    @property
+    def eth_dst(self):
+        return self.buf[0:6].tobytes()
+
+    @property
+    def eth_src(self):
+        return self.buf[6:12].tobytes()
+
+    @property
+    def l3_offset(self):
+        if self._l3 is None:
+            self._decode_eth()
+        return self._l3
+
+    def is_ipv4(self):
+        return self.eth_type == ETH_TYPE_IP
+
+    @property
+    def ipv4_src_int(self):
+        if not self.is_ipv4():
+            return None
+        return _u32.unpack_from(self.buf, self._l3 + 12)[0]
+
+    @property
+    def ipv4_dst_int(self):
+        if not self.is_ipv4():
+            return None
+        return _u32.unpack_from(self.buf, self._l3 + 16)[0]
+
+    @property
+    def ipv4_src(self):
+        if not self.is_ipv4():
+            return None
+        start = self._l3 + 12
+        return socket.inet_ntoa(self.buf[start:start + 4].tobytes())
+
+    @property
+    def ipv4_dst(self):
+        if not self.is_ipv4():
+            return None
+        start = self._l3 + 16
+        return socket.inet_ntoa(self.buf[start:start + 4].tobytes())
+
+    @property
+    def ip_proto(self):
+        if not self.is_ipv4():
+            return None
+        return _u8.unpack_from(self.buf, self._l3 + 9)[0]
+
+    @property
+    def l4_offset(self):
+        if self._l4 is None and self.is_ipv4():
+            ihl = _u8.unpack_from(self.buf, self._l3)[0] & 0x0f
+            self._l4 = self._l3 + ihl * 4
+        return self._l4
+
+    def l4_ports(self):
+        if self.ip_proto not in (IPPROTO_TCP, IPPROTO_UDP):
+            return None
+        return _ports.unpack_from(self.buf, self.l4_offset)
+
+    @property
+    def l4_src(self):
+        ports = self.l4_ports()
+        return ports[0] if ports else None
+
+    @property
+    def l4_dst(self):
+        ports = self.l4_ports()
+        return ports[1] if ports else None
+
+    def is_arp(self):
+        return self.eth_type == ETH_TYPE_ARP
+
+    @property
+    def arp_op(self):
+        if not self.is_arp():
+            return None
+        return _u16.unpack_from(self.buf, self._l3 + 6)[0]
+
+    @property
+    def arp_sha(self):
+        if not self.is_arp():
+            return None
+        return self.buf[self._l3 + 8:self._l3 + 14].tobytes()
+
+    @property
+    def arp_spa(self):
+        if not self.is_arp():
+            return None
+        return self.buf[self._l3 + 14:self._l3 + 18].tobytes()
+
+    @property
+    def arp_tpa(self):
+        if not self.is_arp():
+            return None
+        return self.buf[self._l3 + 24:self._l3 + 28].tobytes()
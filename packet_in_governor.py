@@ -0,0 +1,259 @@
+import time
+import struct
+import logging
+
+from ryu.lib import hub
+
+from packet_template import OFP_XID_OFFSET, next_xid
+
+LOG = logging.getLogger('packet_in_governor')
+
+PACKET_IN_METER_ID = 0xff00
+PUNT_TABLE_ID = 200
+HEADER_LEN = 128
+
+
+class GovernorState(object):
+    def __init__(self, datapath, rate):
+        self.datapath = datapath
+        self.rate = rate
+        self.received = 0
+        self.handled = 0
+        self.dropped = None
+        self.release_template = None
+        self.releases = []
+        self.last = (0, 0, None)
+        self.rates = {'received': 0.0, 'dropped': 0.0, 'handled': 0.0}
+
+
+class PacketInGovernor(object):
+    # packet-ins are truncated to headers, left buffered on the switch and
+    # rate limited by a meter whose rate follows the handler backlog
+    def __init__(self, rate=1000, min_rate=50, max_rate=10000, burst=None,
+                 header_len=HEADER_LEN, meter_id=PACKET_IN_METER_ID,
+                 punt_table=PUNT_TABLE_ID, backlog=None, low_water=8,
+                 high_water=64, interval=1.0, release_batch=32, logger=None):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.header_len = header_len
+        self.meter_id = meter_id
+        self.punt_table = punt_table
+        self.backlog = backlog
+        self.low_water = low_water
+        self.high_water = high_water
+        self.interval = interval
+        self.release_batch = release_batch
+        self.logger = logger or LOG
+        self.states = {}
+        self.requests = {}
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = hub.spawn(self._run)
+        return self.thread
+
+    def add_datapath(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        state = self.states[datapath.id] = GovernorState(datapath, self.rate)
+        datapath.send_msg(parser.OFPSetConfig(datapath,
+                                              ofproto.OFPC_FRAG_NORMAL,
+                                              self.header_len))
+        # the meter outlives the connection and a second add is refused
+        # with METER_EXISTS; flows using it go with it and are reinstalled
+        # by the caller
+        datapath.send_msg(parser.OFPMeterMod(datapath, ofproto.OFPMC_DELETE,
+                                             0, self.meter_id, []))
+        datapath.send_msg(self._meter_mod(datapath, ofproto.OFPMC_ADD,
+                                          state.rate))
+        out = parser.OFPPacketOut(datapath, 0, ofproto.OFPP_CONTROLLER, [],
+                                  None)
+        out.serialize()
+        state.release_template = bytes(out.buf)
+        return state
+
+    def remove_datapath(self, dpid):
+        self.states.pop(dpid, None)
+        for key in [k for k in self.requests if k[0] == dpid]:
+            del self.requests[key]
+
+    def _meter_mod(self, datapath, command, rate):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        burst = self.burst if self.burst is not None else max(1, rate // 10)
+        band = parser.OFPMeterBandDrop(rate=rate, burst_size=burst)
+        flags = ofproto.OFPMF_PKTPS | ofproto.OFPMF_BURST | ofproto.OFPMF_STATS
+        return parser.OFPMeterMod(datapath, command, flags, self.meter_id,
+                                  [band])
+
+    def _punt_action(self, datapath):
+        return {'type': 'OUTPUT', 'port': datapath.ofproto.OFPP_CONTROLLER,
+                'max_len': self.header_len}
+
+    def punt_flow(self, datapath):
+        # shared metered hop for flows that also forward in the data plane,
+        # so the meter only drops the copy bound for the controller
+        return {'table_id': self.punt_table,
+                'priority': 0,
+                'match': {},
+                'actions': [{'type': 'METER', 'meter_id': self.meter_id},
+                            self._punt_action(datapath)]}
+
+    def govern(self, datapath, flow):
+        controller = datapath.ofproto.OFPP_CONTROLLER
+        actions = flow.get('actions', [])
+        punts = [a for a in actions
+                 if a.get('type') == 'OUTPUT' and a.get('port') == controller]
+        if not punts:
+            return flow
+        others = [a for a in actions if a not in punts]
+        outputs = [a for a in others if a.get('type') in ('OUTPUT', 'GROUP')]
+        if not outputs:
+            actions = [{'type': 'METER', 'meter_id': self.meter_id},
+                       self._punt_action(datapath)] + others
+        elif any(a.get('type') == 'GOTO_TABLE' for a in others) or \
+                int(flow.get('table_id', 0)) >= self.punt_table:
+            # no free goto to reach the punt table: truncate only
+            actions = [self._punt_action(datapath) if a in punts else a
+                       for a in actions]
+        else:
+            actions = others + [{'type': 'GOTO_TABLE',
+                                 'table_id': self.punt_table}]
+        return dict(flow, actions = actions)
+
+    def govern_all(self, datapath, flows):
+        governed = [self.govern(datapath, flow) for flow in flows]
+        goto = {'type': 'GOTO_TABLE', 'table_id': self.punt_table}
+        if any(goto in flow['actions'] for flow in governed
+               if flow not in flows):
+            governed.append(self.punt_flow(datapath))
+        return governed
+
+    def received(self, msg):
+        state = self.states.get(msg.datapath.id)
+        if state is not None:
+            state.received += 1
+
+    def handled(self, msg):
+        state = self.states.get(msg.datapath.id)
+        if state is not None:
+            state.handled += 1
+
+    def packet_out(self, msg, actions, in_port=None):
+        # release the switch buffer instead of echoing the payload back
+        datapath = msg.datapath
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        if in_port is None:
+            in_port = msg.match.get('in_port', ofproto.OFPP_CONTROLLER)
+        data = None
+        if msg.buffer_id == ofproto.OFP_NO_BUFFER:
+            data = msg.data
+        out = parser.OFPPacketOut(datapath, msg.buffer_id, in_port, actions,
+                                  data)
+        datapath.send_msg(out)
+        return out
+
+    def release(self, msg, in_port=None):
+        # drop the buffered copy of a packet the data plane already
+        # forwarded; releases go out release_batch at a time in one send,
+        # so the switch buffers are freed without a write per packet-in
+        datapath = msg.datapath
+        ofproto = datapath.ofproto
+        state = self.states.get(datapath.id)
+        if state is None or msg.buffer_id == ofproto.OFP_NO_BUFFER:
+            return
+        if in_port is None:
+            in_port = msg.match.get('in_port', ofproto.OFPP_CONTROLLER)
+        state.releases.append((msg.buffer_id, in_port))
+        if len(state.releases) >= self.release_batch:
+            self._release(state)
+
+    def _release(self, state):
+        if not state.releases:
+            return
+        datapath = state.datapath
+        bufs = []
+        for buffer_id, in_port in state.releases:
+            buf = bytearray(state.release_template)
+            # xid, buffer_id and in_port sit back to back after the type
+            # and length
+            struct.pack_into('!III', buf, OFP_XID_OFFSET,
+                             next_xid(datapath), buffer_id, in_port)
+            bufs.append(bytes(buf))
+        state.releases = []
+        datapath.send(b''.join(bufs))
+
+    def _run(self):
+        while True:
+            hub.sleep(self.interval)
+            now = time.time()
+            self._adapt()
+            for state in list(self.states.values()):
+                self._release(state)
+                self._sample(state, now)
+                self._request_meter_stats(state.datapath, now)
+
+    def _adapt(self):
+        if self.backlog is None:
+            return
+        depth = self.backlog()
+        if depth > self.high_water:
+            rate = max(self.min_rate, self.rate // 2)
+        elif depth < self.low_water:
+            rate = min(self.max_rate, self.rate + max(1, self.rate // 10))
+        else:
+            return
+        if rate == self.rate:
+            return
+        self.logger.info('packet-in backlog %d: meter rate %d -> %d pkt/s',
+                         depth, self.rate, rate)
+        self.rate = rate
+        for state in self.states.values():
+            dp = state.datapath
+            state.rate = rate
+            dp.send_msg(self._meter_mod(dp, dp.ofproto.OFPMC_MODIFY, rate))
+
+    def _sample(self, state, now):
+        received, handled, then = state.last
+        if then is not None and now > then:
+            elapsed = now - then
+            state.rates['received'] = (state.received - received) / elapsed
+            state.rates['handled'] = (state.handled - handled) / elapsed
+        state.last = (state.received, state.handled, now)
+
+    def _request_meter_stats(self, datapath, now):
+        parser = datapath.ofproto_parser
+        req = parser.OFPMeterStatsRequest(datapath, 0, self.meter_id)
+        datapath.set_xid(req)
+        datapath.send_msg(req)
+        self.requests[(datapath.id, req.xid)] = now
+        for key, sent_at in list(self.requests.items()):
+            if now - sent_at > self.interval * 2:
+                del self.requests[key]
+
+    def meter_stats_reply(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        sent_at = self.requests.pop((dpid, msg.xid), None)
+        state = self.states.get(dpid)
+        if sent_at is None or state is None:
+            return False
+        for stat in msg.body:
+            if stat.meter_id != self.meter_id:
+                continue
+            dropped = sum(b.packet_band_count for b in stat.band_stats)
+            if state.dropped is not None:
+                then, before = state.dropped
+                if sent_at > then:
+                    state.rates['dropped'] = \
+                        max(0, dropped - before) / (sent_at - then)
+            state.dropped = (sent_at, dropped)
+        return True
+
+    def rates(self, dpid):
+        state = self.states.get(dpid)
+        return dict(state.rates) if state is not None else None
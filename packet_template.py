@@ -0,0 +1,70 @@
+import struct
+
+from ryu.lib.packet import packet
+from ryu.lib.packet.arp import arp
+from ryu.lib.packet.ethernet import ethernet
+from ryu.ofproto import ether
+
+# offsets into a serialized ofp_packet_out and the frames it carries
+OFP_XID_OFFSET = 4
+OFP_PACKET_OUT_IN_PORT_OFFSET = 12
+ETH_DST_OFFSET = 0
+ARP_SHA_OFFSET = 14 + 8
+ARP_SPA_OFFSET = 14 + 14
+ARP_THA_OFFSET = 14 + 18
+ARP_TPA_OFFSET = 14 + 24
+
+
+def next_xid(datapath):
+    # mirrors Datapath.set_xid() for messages serialized ahead of time
+    datapath.xid = (datapath.xid + 1) & 0xffffffff
+    return datapath.xid
+
+
+def arp_request(src_mac, src_ip, dst_ip, dst_mac='ff:ff:ff:ff:ff:ff',
+                opcode=1):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet(ethertype = ether.ETH_TYPE_ARP,
+                              dst = dst_mac,
+                              src = src_mac))
+    pkt.add_protocol(arp(opcode = opcode,
+                         src_mac = src_mac,
+                         src_ip = src_ip,
+                         dst_mac = dst_mac,
+                         dst_ip = dst_ip))
+    pkt.serialize()
+    return pkt.data
+
+
+def arp_reply(src_mac, src_ip, dst_mac, dst_ip):
+    return arp_request(src_mac, src_ip, dst_ip, dst_mac, opcode = 2)
+
+
+class PacketOutTemplate(object):
+    def __init__(self, datapath, data, actions, in_port=None):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        if in_port is None:
+            in_port = ofproto.OFPP_CONTROLLER
+        out = parser.OFPPacketOut(datapath = datapath,
+                                  buffer_id = ofproto.OFP_NO_BUFFER,
+                                  in_port = in_port, actions = actions,
+                                  data = data)
+        out.serialize()
+        self.datapath = datapath
+        self.buf = bytearray(out.buf)
+        self.data_offset = len(self.buf) - len(data)
+
+    def render(self, patches=(), in_port=None):
+        buf = bytearray(self.buf)
+        struct.pack_into('!I', buf, OFP_XID_OFFSET, next_xid(self.datapath))
+        if in_port is not None:
+            struct.pack_into('!I', buf, OFP_PACKET_OUT_IN_PORT_OFFSET,
+                             in_port)
+        for offset, value in patches:
+            start = self.data_offset + offset
+            buf[start:start + len(value)] = value
+        return bytes(buf)
+
+    def send(self, patches=(), in_port=None):
+        self.datapath.send(self.render(patches, in_port))
@@ -0,0 +1,156 @@
+import logging
+from collections import OrderedDict
+
+from flow_batch import FlowBatch
+from util import freeze
+
+LOG = logging.getLogger('pipeline')
+
+DEFAULT_PRIORITY = 100
+METADATA_BITS = 64
+
+
+def factor_rules(rules, prefix_fields, table_id=0):
+    # split a flat single-table rule list into two stages: prefix values
+    # with the same set of remaining rules share one metadata class, so
+    # P prefixes x S suffixes becomes P + classes x S entries
+    suffixes = OrderedDict()
+    generic = []
+    for rule in rules:
+        match = rule.get('match', {})
+        if not all(f in match for f in prefix_fields) or \
+                any('/' in str(match[f]) for f in prefix_fields):
+            # masked prefixes could overlap, and a packet can only carry
+            # one class; such rules stay whole in the second table
+            generic.append(rule)
+            continue
+        prefix = tuple((f, match[f]) for f in prefix_fields)
+        rest = dict((k, v) for k, v in match.items()
+                    if k not in prefix_fields)
+        suffix = dict(rule, match = rest)
+        suffixes.setdefault(prefix, []).append(suffix)
+
+    classes = OrderedDict()
+    for prefix, members in suffixes.items():
+        classes.setdefault(freeze(members), []).append(prefix)
+
+    first = {'table_id': table_id, 'rules': []}
+    second = {'table_id': table_id + 1, 'rules': []}
+    for n, (key, prefixes) in enumerate(classes.items()):
+        tag = 'class%d' % n
+        for prefix in prefixes:
+            first['rules'].append({'match': dict(prefix), 'tag': tag})
+        for suffix in suffixes[prefixes[0]]:
+            second['rules'].append(dict(suffix, when = tag))
+    # packets outside every class still need to see the generic rules
+    first['rules'].append({'priority': 0, 'match': {}, 'tag': None})
+    second['rules'].extend(generic)
+    return [first, second]
+
+
+class Pipeline(object):
+    def __init__(self, stages, metadata_offset=0,
+                 priority=DEFAULT_PRIORITY):
+        self.stages = stages
+        self.priority = priority
+        self.tags = []
+        last = stages[-1] if stages else {'rules': []}
+        if any('tag' in rule for rule in last['rules']):
+            raise ValueError('table %d is the last stage; its rules cannot '
+                             'tag packets for a next table'
+                             % last.get('table_id', len(stages) - 1))
+        offset = metadata_offset
+        for stage in stages:
+            names = sorted(set(r['tag'] for r in stage['rules']
+                               if r.get('tag') is not None))
+            values = dict((name, n + 1) for n, name in enumerate(names))
+            bits = len(names).bit_length()
+            mask = ((1 << bits) - 1) << offset
+            self.tags.append((values, offset, mask))
+            offset += bits
+        if offset > METADATA_BITS:
+            raise ValueError('pipeline needs %d metadata bits' % offset)
+        self.flows = self._compile()
+
+    @classmethod
+    def from_rules(cls, rules, prefix_fields, table_id=0, **kwargs):
+        # compile a flat rule list, factoring the shared prefix_fields
+        # matches into a classifying table ahead of the rest
+        return cls(factor_rules(rules, prefix_fields, table_id), **kwargs)
+
+    def _table_id(self, index):
+        return self.stages[index].get('table_id', index)
+
+    def _metadata(self, index, tag):
+        values, offset, mask = self.tags[index]
+        return values[tag] << offset, mask
+
+    def _parents(self, index, rule):
+        when = rule.get('when')
+        if when is None or index == 0:
+            return [None]
+        if isinstance(when, (list, tuple)):
+            return list(when)
+        return [when]
+
+    def _compile(self):
+        flows = []
+        seen = set()
+        for index, stage in enumerate(self.stages):
+            for rule in stage['rules']:
+                for parent in self._parents(index, rule):
+                    flow = self._flow(index, rule, parent)
+                    key = freeze(flow)
+                    if key not in seen:
+                        seen.add(key)
+                        flows.append(flow)
+        return flows
+
+    def _flow(self, index, rule, parent):
+        match = dict(rule.get('match', {}))
+        if parent is not None:
+            value, mask = self._metadata(index - 1, parent)
+            match['metadata'] = '%d/%d' % (value, mask)
+        if 'tag' in rule:
+            actions = list(rule.get('actions', []))
+            if rule['tag'] is not None:
+                value, mask = self._metadata(index, rule['tag'])
+                actions.append({'type': 'WRITE_METADATA',
+                                'metadata': value, 'metadata_mask': mask})
+            actions.append({'type': 'GOTO_TABLE',
+                            'table_id': self._table_id(index + 1)})
+        else:
+            actions = rule.get('actions', [])
+        return {'table_id': self._table_id(index),
+                'priority': rule.get('priority', self.priority),
+                'match': match,
+                'actions': actions}
+
+    def cross_product_size(self):
+        # entries a single table would need for the same policy
+        produced = {}
+        total = 0
+        for index, stage in enumerate(self.stages):
+            for rule in stage['rules']:
+                reach = sum(produced.get((index - 1, p), 0)
+                            if p is not None else 1
+                            for p in self._parents(index, rule))
+                if 'tag' not in rule:
+                    total += reach
+                elif rule['tag'] is not None:
+                    key = (index, rule['tag'])
+                    produced[key] = produced.get(key, 0) + reach
+        return total
+
+    def install(self, datapath, logger=None, batch=None, shadow=None):
+        logger = logger or LOG
+        own = batch is None
+        if own:
+            batch = FlowBatch(datapath, logger, shadow)
+        for flow in self.flows:
+            batch.add(flow, datapath.ofproto.OFPFC_ADD)
+        logger.info('pipeline: %d flows over %d tables '
+                    '(single-table equivalent %d)', len(self.flows),
+                    len(self.stages), self.cross_product_size())
+        if own:
+            return batch.send()
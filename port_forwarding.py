@@ -1,27 +1,71 @@
+import time
+
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.ofctl_v1_3 import mod_flow_entry
+from flow_batch import FlowBatch
+from flow_encoder import encoder
+from reconcile import Reconciler
+from provisioner import Provisioner, load_roles, role_map
+from ryu.lib import hub
+
+FLOWS = [{'priority' : 100,
+          'match' : {'in_port' : 1},
+          'actions' : [{'type' : 'OUTPUT', 'port' : 2}]}]
 
 class SAMPLE_APP(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    # diff against the switch on (re)connect instead of wiping its tables
+    RECONCILE = True
+    # dpid -> spine/leaf/edge, so spines are programmed first after a
+    # controller restart
+    ROLES_FILE = 'roles.json'
 
     def __init__(self, *args, **kwargs):
         super(SAMPLE_APP, self).__init__(*args, **kwargs)
-    
+        self.reconciler = Reconciler(self.logger)
+        self.provisioner = Provisioner(
+            role_of=role_map(load_roles(self.ROLES_FILE)), logger=self.logger)
+        self.provisioner.start()
+
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
-        ofproto = datapath.ofproto 
+        self.logger.info('switch joind: datapath: %061x' % datapath.id)
+        self.provisioner.submit(datapath, self.program)
+
+    def program(self, datapath):
+        ofproto = datapath.ofproto
+        if self.RECONCILE:
+            # hold the worker until the diff is applied so the pool also
+            # bounds how many flow dumps are in flight
+            state = self.reconciler.start(datapath, FLOWS)
+            deadline = time.time() + self.provisioner.barrier_timeout
+            while state.converged is None and time.time() < deadline:
+                hub.sleep(0.01)
+                yield
+            return
+
+        batch = FlowBatch(datapath, self.logger, encoder = encoder)
+        batch.add({}, ofproto.OFPFC_DELETE)
+        for flow in FLOWS:
+            batch.add(flow, ofproto.OFPFC_ADD)
+        batch.send(barrier=False)
+
+    @set_ev_cls([ofp_event.EventOFPFlowStatsReply,
+                 ofp_event.EventOFPGroupDescStatsReply], MAIN_DISPATCHER)
+    def stats_reply_handler(self, ev):
+        self.reconciler.stats_reply(ev)
 
-        mod_flow_entry(datapath, {}, ofproto.OFPFC_DELETE)
-        priority = 100
-        self.logger.info('switch joind: datapath: %061x' % datapath.id) 
-        mod_flow_entry(datapath,
-                      {'priority' : priority,
-                       'match' : {'in_port' : 1},
-                       'actions' : [{'type' : 'OUTPUT', 'port' : 2}]},
-                      ofproto.OFPFC_ADD)
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def barrier_reply_handler(self, ev):
+        if not self.provisioner.barrier_reply(ev):
+            self.reconciler.barrier_reply(ev)
 
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def state_change_handler(self, ev):
+        if ev.datapath.id is not None:
+            self.provisioner.remove_datapath(ev.datapath.id)
+            self.reconciler.remove_datapath(ev.datapath.id)
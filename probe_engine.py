@@ -0,0 +1,91 @@
+import time
+import socket
+import logging
+
+from ryu.lib import hub
+
+from packet_template import PacketOutTemplate, arp_request, ARP_TPA_OFFSET
+
+LOG = logging.getLogger('probe_engine')
+
+PROBE_GROUP_ID = 0xff00
+
+
+class ArpProbeEngine(object):
+    def __init__(self, src_mac, src_ip, targets, ports, interval=3.0,
+                 max_rate=0, burst=64, use_group=False, logger=None):
+        self.data = arp_request(src_mac, src_ip, targets[0])
+        self.targets = [socket.inet_aton(ip) for ip in targets]
+        self.ports = list(ports)
+        self.interval = interval
+        self.max_rate = max_rate
+        self.burst = burst
+        self.use_group = use_group
+        self.logger = logger or LOG
+        self.templates = {}
+        self.sent = 0
+        self.thread = None
+
+    def add_datapath(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        if self.use_group:
+            buckets = [parser.OFPBucket(0, ofproto.OFPP_ANY, ofproto.OFPG_ANY,
+                                        [parser.OFPActionOutput(port, 0)])
+                       for port in self.ports]
+            # the group survives a reconnect; adding it again would be
+            # refused with GROUP_EXISTS
+            datapath.send_msg(parser.OFPGroupMod(datapath,
+                                                 ofproto.OFPGC_DELETE, 0,
+                                                 PROBE_GROUP_ID))
+            datapath.send_msg(parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD,
+                                                 ofproto.OFPGT_ALL,
+                                                 PROBE_GROUP_ID, buckets))
+            actions = [parser.OFPActionGroup(PROBE_GROUP_ID)]
+        else:
+            actions = [parser.OFPActionOutput(port) for port in self.ports]
+        self.templates[datapath.id] = PacketOutTemplate(datapath, self.data,
+                                                        actions)
+
+    def remove_datapath(self, datapath):
+        self.templates.pop(datapath.id, None)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = hub.spawn(self._run)
+        return self.thread
+
+    def stop(self):
+        if self.thread is not None:
+            hub.kill(self.thread)
+            self.thread = None
+
+    def _pace(self, sent, start):
+        if self.max_rate:
+            ahead = float(sent) / self.max_rate - (time.time() - start)
+            if ahead > 0:
+                hub.sleep(ahead)
+        else:
+            # yield so other green threads get the hub between bursts
+            hub.sleep(0)
+
+    def _run(self):
+        while True:
+            start = time.time()
+            sent = 0
+            for template in list(self.templates.values()):
+                for i in range(0, len(self.targets), self.burst):
+                    chunk = self.targets[i:i + self.burst]
+                    template.datapath.send(b''.join(
+                        template.render([(ARP_TPA_OFFSET, tpa)])
+                        for tpa in chunk))
+                    sent += len(chunk)
+                    self._pace(sent, start)
+            self.sent += sent
+            elapsed = time.time() - start
+            if sent:
+                self.logger.info('sent %d ARP probes to %d datapath(s) '
+                                 'in %.3f s (%.0f probes/s)', sent,
+                                 len(self.templates), elapsed,
+                                 sent / elapsed if elapsed > 0 else 0.0)
+            hub.sleep(max(0, self.interval - elapsed))
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import heapq
+import logging
+
+from ryu.lib import hub
+
+from util import percentile
+
+LOG = logging.getLogger('provisioner')
+
+DEFAULT_ROLES = {'spine': 0, 'core': 0, 'leaf': 1, 'edge': 2}
+DEFAULT_PRIORITY = 1
+
+
+def load_roles(path):
+    # {"<dpid>": "<role>"} with decimal or 0x-prefixed dpids; a missing
+    # file leaves every switch at DEFAULT_PRIORITY
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        roles = json.load(f)
+    return dict((int(str(dpid), 0), role) for dpid, role in roles.items())
+
+
+def role_map(roles, default=None):
+    # role_of hook for Provisioner backed by a {dpid: role} map
+    def role_of(datapath):
+        return roles.get(datapath.id, default)
+    return role_of
+
+
+class ProvisionJob(object):
+    def __init__(self, datapath, program, role, priority, seq):
+        self.datapath = datapath
+        self.program = program
+        self.role = role
+        self.priority = priority
+        self.seq = seq
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.barrier_xid = None
+        self.event = hub.Event()
+        self.cancelled = False
+        self.paused = 0.0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    @property
+    def duration(self):
+        if self.finished is None:
+            return None
+        return self.finished - self.submitted
+
+
+class Provisioner(object):
+    # initial programming runs on a bounded pool of workers instead of in
+    # the features handler, so one slow switch cannot stall the others
+    def __init__(self, concurrency=16, high_water=8, poll=0.01,
+                 barrier_timeout=30.0, roles=None, role_of=None,
+                 history=10000, logger=None):
+        self.concurrency = concurrency
+        self.high_water = high_water
+        self.poll = poll
+        self.barrier_timeout = barrier_timeout
+        self.roles = DEFAULT_ROLES if roles is None else roles
+        self.role_of = role_of
+        self.history = history
+        self.logger = logger or LOG
+        self.queue = []
+        self.jobs = {}
+        self.running = {}
+        self.durations = []
+        self.failed = 0
+        self.seq = 0
+        self.wakeup = hub.Event()
+        self.workers = []
+
+    def start(self):
+        if not self.workers:
+            self.workers = [hub.spawn(self._worker)
+                            for _ in range(self.concurrency)]
+        return self.workers
+
+    def submit(self, datapath, program, role=None):
+        if role is None and self.role_of is not None:
+            role = self.role_of(datapath)
+        old = self.jobs.get(datapath.id)
+        if old is not None:
+            # reconnect: the newer connection wins, and a worker still
+            # waiting on the old barrier is released now
+            old.cancelled = True
+            old.event.set()
+        self.seq += 1
+        job = ProvisionJob(datapath, program, role,
+                           self.roles.get(role, DEFAULT_PRIORITY), self.seq)
+        self.jobs[datapath.id] = job
+        heapq.heappush(self.queue, job)
+        self.wakeup.set()
+        return job
+
+    def remove_datapath(self, dpid):
+        job = self.jobs.pop(dpid, None)
+        if job is not None:
+            job.cancelled = True
+            job.event.set()
+
+    def _next(self):
+        while True:
+            while self.queue:
+                job = heapq.heappop(self.queue)
+                if not job.cancelled:
+                    return job
+            self.wakeup.clear()
+            self.wakeup.wait()
+
+    def _backpressure(self, job):
+        send_q = getattr(job.datapath, 'send_q', None)
+        if send_q is None:
+            return
+        start = time.time()
+        while send_q.qsize() > self.high_water and not job.cancelled:
+            hub.sleep(self.poll)
+        job.paused += time.time() - start
+
+    def _worker(self):
+        while True:
+            job = self._next()
+            try:
+                self._run(job)
+            except Exception:
+                self.failed += 1
+                self.logger.exception('datapath %016x: provisioning failed',
+                                      job.datapath.id)
+            finally:
+                if self.running.get(job.datapath.id) is job:
+                    del self.running[job.datapath.id]
+                if self.jobs.get(job.datapath.id) is job:
+                    del self.jobs[job.datapath.id]
+
+    def _run(self, job):
+        dp = job.datapath
+        job.started = time.time()
+        self.running[dp.id] = job
+        steps = job.program(dp)
+        # a generator program yields between chunks so a full send queue
+        # pauses this switch without holding up the rest of the pool
+        for _ in steps or ():
+            if job.cancelled:
+                return
+            self._backpressure(job)
+        if job.cancelled:
+            return
+        self._backpressure(job)
+        req = dp.ofproto_parser.OFPBarrierRequest(dp)
+        dp.set_xid(req)
+        job.barrier_xid = req.xid
+        dp.send_msg(req)
+        if not job.event.wait(timeout=self.barrier_timeout):
+            self.failed += 1
+            self.logger.info('datapath %016x: no barrier reply after %.1fs',
+                             dp.id, self.barrier_timeout)
+            return
+        if job.cancelled:
+            return
+        self.durations.append(job.duration)
+        if len(self.durations) > self.history:
+            del self.durations[:len(self.durations) - self.history]
+        self.logger.info('datapath %016x (%s): programmed in %.3fs '
+                         '(queued %.3fs, paused %.3fs)', dp.id, job.role,
+                         job.duration, job.started - job.submitted,
+                         job.paused)
+        if not self.queue and len(self.running) == 1:
+            # last switch of a burst: report the whole fleet
+            self.logger.info('provisioning drained: %s', self.stats())
+
+    def barrier_reply(self, ev):
+        msg = ev.msg
+        job = self.running.get(msg.datapath.id)
+        if job is None or msg.xid != job.barrier_xid:
+            return False
+        job.finished = time.time()
+        job.event.set()
+        return True
+
+    def percentiles(self, pcts=(50, 90, 99)):
+        return dict((p, percentile(self.durations, p)) for p in pcts)
+
+    def stats(self):
+        stats = {'queued': sum(1 for job in self.queue if not job.cancelled),
+                 'running': len(self.running),
+                 'programmed': len(self.durations),
+                 'failed': self.failed}
+        stats.update(('p%d' % p, v) for p, v in self.percentiles().items())
+        return stats
@@ -0,0 +1,195 @@
+import time
+import logging
+
+from ryu.lib import hub
+
+from flow_batch import FlowBatch, build_flow_mod
+from shadow_table import match_key
+
+LOG = logging.getLogger('reconcile')
+
+
+def wire_bytes(items):
+    # compare instructions and buckets by their encoding; parsed and
+    # locally built objects stringify differently but serialize the same
+    buf = bytearray()
+    for item in items:
+        item.serialize(buf, len(buf))
+    return bytes(buf)
+
+
+class Reconciliation(object):
+    def __init__(self, datapath, flows, groups):
+        self.datapath = datapath
+        self.flows = flows
+        self.groups = groups
+        self.started = time.time()
+        self.converged = None
+        self.xids = {}
+        self.current_flows = []
+        self.current_groups = []
+        self.barrier_xid = None
+        self.sent = 0
+        self.timer = None
+        self.timed_out = False
+
+    @property
+    def baseline(self):
+        # cost of the old behaviour: delete everything, then reinstall
+        deletes = 1 + (1 if self.groups else 0)
+        return deletes + len(self.flows) + len(self.groups)
+
+    @property
+    def saved(self):
+        return self.baseline - self.sent
+
+
+class Reconciler(object):
+    def __init__(self, logger=None, shadow=None, timeout=10.0):
+        self.logger = logger or LOG
+        self.shadow = shadow
+        self.timeout = timeout
+        self.active = {}
+
+    def start(self, datapath, flows, groups=None):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        state = Reconciliation(datapath, flows, groups or {})
+        self.active[datapath.id] = state
+
+        req = parser.OFPFlowStatsRequest(datapath, 0, ofproto.OFPTT_ALL,
+                                         ofproto.OFPP_ANY, ofproto.OFPG_ANY,
+                                         0, 0, parser.OFPMatch())
+        datapath.set_xid(req)
+        datapath.send_msg(req)
+        state.xids[req.xid] = state.current_flows
+
+        req = parser.OFPGroupDescStatsRequest(datapath, 0)
+        datapath.set_xid(req)
+        datapath.send_msg(req)
+        state.xids[req.xid] = state.current_groups
+        if self.timeout:
+            state.timer = hub.spawn_after(self.timeout, self._expire, state)
+        return state
+
+    def remove_datapath(self, dpid):
+        state = self.active.pop(dpid, None)
+        if state is not None and state.timer is not None:
+            state.timer.cancel()
+
+    def _expire(self, state):
+        dp = state.datapath
+        if self.active.get(dp.id) is not state or not state.xids:
+            return
+        # the switch never finished the dump; fall back to wiping it and
+        # installing everything so it is not left unprogrammed
+        self.logger.info('datapath %016x: no state dump after %.1f s, '
+                         'deleting and reinstalling', dp.id, self.timeout)
+        state.xids.clear()
+        state.timed_out = True
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        batch = FlowBatch(dp, self.logger, self.shadow)
+        batch.add({}, ofproto.OFPFC_DELETE)
+        if state.groups:
+            batch.add_msg(parser.OFPGroupMod(dp, ofproto.OFPGC_DELETE,
+                                             ofproto.OFPGT_ALL,
+                                             ofproto.OFPG_ALL, []))
+        for group_id, (group_type, buckets) in state.groups.items():
+            batch.add_msg(parser.OFPGroupMod(dp, ofproto.OFPGC_ADD,
+                                             group_type, group_id, buckets))
+        for flow in state.flows:
+            batch.add(flow, ofproto.OFPFC_ADD)
+        state.sent = len(batch)
+        state.barrier_xid, _ = batch.send()
+
+    def stats_reply(self, ev):
+        msg = ev.msg
+        state = self.active.get(msg.datapath.id)
+        if state is None or msg.xid not in state.xids:
+            return False
+        state.xids[msg.xid].extend(msg.body)
+        if not msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            del state.xids[msg.xid]
+            if not state.xids:
+                self._apply(state)
+        return True
+
+    def barrier_reply(self, ev):
+        msg = ev.msg
+        state = self.active.get(msg.datapath.id)
+        if state is None or state.barrier_xid != msg.xid:
+            return None
+        del self.active[msg.datapath.id]
+        state.converged = time.time() - state.started
+        if state.timed_out:
+            self.logger.info('datapath %016x: reinstalled in %.3f ms with '
+                             '%d mod(s)', msg.datapath.id,
+                             state.converged * 1000, state.sent)
+            return state
+        self.logger.info('datapath %016x: converged in %.3f ms with %d '
+                         'mod(s), %d saved versus delete-and-reinstall',
+                         msg.datapath.id, state.converged * 1000,
+                         state.sent, state.saved)
+        return state
+
+    def _apply(self, state):
+        if state.timer is not None:
+            state.timer.cancel()
+        dp = state.datapath
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        batch = FlowBatch(dp, self.logger, self.shadow)
+
+        current = dict((g.group_id, g) for g in state.current_groups)
+        for group_id, (group_type, buckets) in state.groups.items():
+            have = current.get(group_id)
+            if have is None:
+                cmd = ofproto.OFPGC_ADD
+            elif have.type != group_type or \
+                    wire_bytes(have.buckets) != wire_bytes(buckets):
+                cmd = ofproto.OFPGC_MODIFY
+            else:
+                continue
+            batch.add_msg(parser.OFPGroupMod(dp, cmd, group_type, group_id,
+                                             buckets))
+
+        current = dict(((s.table_id, s.priority, match_key(s.match)), s)
+                       for s in state.current_flows)
+        for flow in state.flows:
+            msg = build_flow_mod(dp, flow, ofproto.OFPFC_ADD)
+            key = (msg.table_id, msg.priority, match_key(msg.match))
+            have = current.pop(key, None)
+            if have is None or have.cookie != msg.cookie or \
+                    have.idle_timeout != msg.idle_timeout or \
+                    have.hard_timeout != msg.hard_timeout or \
+                    have.flags != msg.flags:
+                # modify only touches instructions; an add with the same
+                # match and priority replaces the whole entry
+                batch.add_msg(msg)
+            elif wire_bytes(have.instructions) != \
+                    wire_bytes(msg.instructions):
+                msg.command = ofproto.OFPFC_MODIFY_STRICT
+                batch.add_msg(msg)
+            elif self.shadow is not None:
+                # already on the switch; make sure the shadow knows it
+                self.shadow.record(msg)
+        for stat in current.values():
+            batch.add_msg(parser.OFPFlowMod(dp, 0, 0, stat.table_id,
+                                            ofproto.OFPFC_DELETE_STRICT,
+                                            0, 0, stat.priority,
+                                            ofproto.OFP_NO_BUFFER,
+                                            ofproto.OFPP_ANY,
+                                            ofproto.OFPG_ANY, 0,
+                                            stat.match, []))
+
+        # groups can only go once no flow points at them
+        wanted = set(state.groups)
+        for group_id in set(g.group_id for g in state.current_groups):
+            if group_id not in wanted:
+                batch.add_msg(parser.OFPGroupMod(dp, ofproto.OFPGC_DELETE,
+                                                 ofproto.OFPGT_ALL,
+                                                 group_id, []))
+
+        state.sent = len(batch)
+        state.barrier_xid, _ = batch.send()
@@ -0,0 +1,210 @@
+import logging
+
+from flow_batch import build_flow_mod
+
+LOG = logging.getLogger('shadow_table')
+
+COOKIE_BITS = 64
+NAMESPACE_BITS = 16
+NAMESPACE_SHIFT = COOKIE_BITS - NAMESPACE_BITS
+OFPTT_ALL = 0xff
+
+
+class CookieNamespace(object):
+    def __init__(self, name, prefix):
+        self.name = name
+        self.prefix = prefix
+        self.base = prefix << NAMESPACE_SHIFT
+        self.mask = ((1 << NAMESPACE_BITS) - 1) << NAMESPACE_SHIFT
+        self.last = 0
+
+    def cookie(self, n):
+        return self.base | n
+
+    def next(self):
+        self.last += 1
+        return self.cookie(self.last)
+
+    def __contains__(self, cookie):
+        return cookie & self.mask == self.base
+
+
+class CookieAllocator(object):
+    def __init__(self):
+        self.namespaces = {}
+
+    def allocate(self, name):
+        ns = self.namespaces.get(name)
+        if ns is None:
+            prefix = len(self.namespaces) + 1
+            if prefix >> NAMESPACE_BITS:
+                raise ValueError('cookie namespaces exhausted')
+            ns = self.namespaces[name] = CookieNamespace(name, prefix)
+        return ns
+
+
+# one allocator per controller process so apps never share a prefix
+cookies = CookieAllocator()
+
+
+def match_key(match):
+    return tuple(sorted(match.items()))
+
+
+def out_ports(instructions):
+    ports = set()
+    for inst in instructions:
+        for action in getattr(inst, 'actions', []):
+            port = getattr(action, 'port', None)
+            if port is not None:
+                ports.add(port)
+    return ports
+
+
+class FlowRecord(object):
+    __slots__ = ('key', 'cookie', 'match', 'instructions', 'ports')
+
+    def __init__(self, key, cookie, match, instructions):
+        self.key = key
+        self.cookie = cookie
+        self.match = match
+        self.instructions = instructions
+        self.ports = out_ports(instructions)
+
+    @property
+    def table_id(self):
+        return self.key[0]
+
+    @property
+    def priority(self):
+        return self.key[1]
+
+
+class ShadowFlowTable(object):
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.entries = {}
+        self.by_cookie = {}
+        self.by_namespace = {}
+        self.by_port = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _index(self, rec):
+        self.entries[rec.key] = rec
+        self.by_cookie.setdefault(rec.cookie, set()).add(rec.key)
+        self.by_namespace.setdefault(rec.cookie >> NAMESPACE_SHIFT,
+                                     set()).add(rec.key)
+        for port in rec.ports:
+            self.by_port.setdefault(port, set()).add(rec.key)
+
+    def _unindex(self, key):
+        rec = self.entries.pop(key, None)
+        if rec is None:
+            return None
+        for index, value in ((self.by_cookie, rec.cookie),
+                             (self.by_namespace,
+                              rec.cookie >> NAMESPACE_SHIFT)):
+            keys = index.get(value)
+            keys.discard(key)
+            if not keys:
+                del index[value]
+        for port in rec.ports:
+            keys = self.by_port[port]
+            keys.discard(key)
+            if not keys:
+                del self.by_port[port]
+        return rec
+
+    def _cookie_keys(self, cookie, mask):
+        if not mask:
+            return set(self.entries)
+        if mask == (1 << COOKIE_BITS) - 1:
+            return set(self.by_cookie.get(cookie, ()))
+        if mask == ((1 << NAMESPACE_BITS) - 1) << NAMESPACE_SHIFT:
+            return set(self.by_namespace.get(cookie >> NAMESPACE_SHIFT, ()))
+        keys = set()
+        for value, members in self.by_cookie.items():
+            if value & mask == cookie & mask:
+                keys |= members
+        return keys
+
+    def _select(self, msg, strict):
+        if strict:
+            key = (msg.table_id, msg.priority, match_key(msg.match))
+            return set([key]) if key in self.entries else set()
+        keys = self._cookie_keys(msg.cookie, msg.cookie_mask)
+        fields = match_key(msg.match)
+        selected = set()
+        for key in keys:
+            if msg.table_id != OFPTT_ALL and key[0] != msg.table_id:
+                continue
+            # non-strict commands act on every flow at least as specific
+            if not set(fields).issubset(key[2]):
+                continue
+            rec = self.entries[key]
+            out_port = getattr(msg, 'out_port', None)
+            if out_port not in (None, msg.datapath.ofproto.OFPP_ANY) \
+                    and out_port not in rec.ports:
+                continue
+            selected.add(key)
+        return selected
+
+    def record(self, msg):
+        ofproto = msg.datapath.ofproto
+        cmd = msg.command
+        if cmd == ofproto.OFPFC_ADD:
+            key = (msg.table_id, msg.priority, match_key(msg.match))
+            self._unindex(key)
+            self._index(FlowRecord(key, msg.cookie, msg.match,
+                                   msg.instructions))
+        elif cmd in (ofproto.OFPFC_MODIFY, ofproto.OFPFC_MODIFY_STRICT):
+            for key in self._select(msg, cmd == ofproto.OFPFC_MODIFY_STRICT):
+                rec = self._unindex(key)
+                self._index(FlowRecord(key, rec.cookie, rec.match,
+                                       msg.instructions))
+        elif cmd in (ofproto.OFPFC_DELETE, ofproto.OFPFC_DELETE_STRICT):
+            for key in self._select(msg, cmd == ofproto.OFPFC_DELETE_STRICT):
+                self._unindex(key)
+
+    def flows_to_port(self, port):
+        return [self.entries[key] for key in self.by_port.get(port, ())]
+
+    def flows_by_cookie(self, cookie, mask=(1 << COOKIE_BITS) - 1):
+        return [self.entries[key] for key in self._cookie_keys(cookie, mask)]
+
+    def lookup(self, table_id, priority, match):
+        return self.entries.get((table_id, priority, match_key(match)))
+
+    def delete_by_cookie(self, datapath, cookie, mask, batch=None):
+        records = self.flows_by_cookie(cookie, mask)
+        if not records:
+            return records
+        flow = {'cookie': cookie, 'cookie_mask': mask, 'table_id': OFPTT_ALL}
+        msg = build_flow_mod(datapath, flow, datapath.ofproto.OFPFC_DELETE)
+        if batch is not None:
+            batch.add_msg(msg)
+        else:
+            datapath.send_msg(msg)
+            self.record(msg)
+        return records
+
+
+class ShadowTables(object):
+    def __init__(self):
+        self.tables = {}
+
+    def table(self, dpid):
+        table = self.tables.get(dpid)
+        if table is None:
+            table = self.tables[dpid] = ShadowFlowTable(dpid)
+        return table
+
+    def record(self, msg, dpid=None):
+        if dpid is None:
+            dpid = msg.datapath.id
+        self.table(dpid).record(msg)
+
+    def remove(self, dpid):
+        self.tables.pop(dpid, None)
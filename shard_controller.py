@@ -0,0 +1,503 @@
+import os
+import sys
+import time
+import errno
+import socket
+import struct
+import bisect
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+
+try:
+    import selectors
+except ImportError:
+    # python 2
+    import selectors2 as selectors
+
+from ofp_wire import (HEADER, message, read_message, wait_for_port,
+                      OFPT_HELLO, OFPT_ECHO_REQUEST, OFPT_ECHO_REPLY,
+                      OFPT_FEATURES_REQUEST, OFPT_FEATURES_REPLY)
+from shard_ipc import (ShardCollector, SHARD_ID_ENV, SHARD_COUNT_ENV,
+                       SHARD_IPC_ENV)
+
+LOG = logging.getLogger('shard_controller')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROXY_FEATURES_XID = 0xfffffff0
+HANDSHAKE_TIMEOUT = 10.0
+RESTART_BACKOFF = 1.0
+RESTART_BACKOFF_MAX = 60.0
+# a worker that stayed up this long is healthy again; its next crash
+# restarts it without delay
+STABLE_RUN = 60.0
+RELAY_CHUNK = 65536
+# stop reading one side of a session while this much is still waiting to
+# be written to the other
+RELAY_HIGH_WATER = 1 << 20
+
+
+class HashRing(object):
+    # each worker owns many points so a worker leaving only moves the
+    # datapaths it held, and they spread over the survivors
+    def __init__(self, replicas=64):
+        self.replicas = replicas
+        self.points = []
+        self.owners = {}
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def add(self, node):
+        for i in range(self.replicas):
+            point = self._hash('%s-%d' % (node, i))
+            if point not in self.owners:
+                bisect.insort(self.points, point)
+                self.owners[point] = node
+
+    def remove(self, node):
+        for point in [p for p, n in self.owners.items() if n == node]:
+            del self.owners[point]
+            self.points.remove(point)
+
+    def lookup(self, dpid):
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, self._hash('%016x' % dpid))
+        return self.owners[self.points[index % len(self.points)]]
+
+
+class Worker(object):
+    def __init__(self, index, app, port, count, ipc_path, ryu_manager):
+        self.index = index
+        self.app = app
+        self.port = port
+        self.count = count
+        self.ipc_path = ipc_path
+        self.ryu_manager = ryu_manager
+        self.process = None
+        self.restarts = 0
+        self.started = None
+        self.failures = 0
+        self.retry_at = None
+
+    def start(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [HERE] + [p for p in [env.get('PYTHONPATH')] if p])
+        env[SHARD_ID_ENV] = str(self.index)
+        env[SHARD_COUNT_ENV] = str(self.count)
+        env[SHARD_IPC_ENV] = self.ipc_path
+        self.started = time.time()
+        self.process = subprocess.Popen(
+            [self.ryu_manager, '--ofp-tcp-listen-port', str(self.port),
+             os.path.join(HERE, self.app)], cwd = HERE, env = env)
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if self.alive():
+            self.process.terminate()
+            self.process.wait()
+
+
+class SwitchSession(object):
+    def __init__(self, switch, address):
+        self.switch = switch
+        self.address = address
+        self.worker_sock = None
+        self.dpid = None
+        self.worker = None
+        self.closed = False
+        self.relay = None
+        # bytes waiting to be written to each socket, the selector events
+        # each one is registered for, and the start of the worker's stream
+        # until its hello has been dropped
+        self.out = {}
+        self.events = {}
+        self.head = bytearray()
+
+    def peer(self, sock):
+        return self.worker_sock if sock is self.switch else self.switch
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for sock in (self.switch, self.worker_sock):
+            if sock is None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            if self.relay is None:
+                sock.close()
+        if self.relay is not None:
+            # the relay thread closes a spliced session's sockets, so their
+            # fds are never reused while still registered with it
+            self.relay.add(self)
+
+    def handshake(self):
+        # learn the dpid before choosing a worker: answer the switch's
+        # hello, ask for features, keep the hello to replay to the worker
+        self.switch.settimeout(HANDSHAKE_TIMEOUT)
+        first = read_message(self.switch)
+        if first is None or first[0] != OFPT_HELLO:
+            return None
+        self.switch.sendall(message(OFPT_HELLO, 0) +
+                            message(OFPT_FEATURES_REQUEST,
+                                    PROXY_FEATURES_XID))
+        while True:
+            msg = read_message(self.switch)
+            if msg is None:
+                return None
+            msg_type, xid, data = msg
+            if msg_type == OFPT_ECHO_REQUEST:
+                self.switch.sendall(message(OFPT_ECHO_REPLY, xid,
+                                            data[HEADER.size:]))
+            elif msg_type == OFPT_FEATURES_REPLY and \
+                    xid == PROXY_FEATURES_XID:
+                self.dpid = struct.unpack_from('!Q', data, HEADER.size)[0]
+                self.switch.settimeout(None)
+                return first[2]
+
+    def splice(self, worker, port, hello, relay):
+        self.worker = worker
+        self.worker_sock = socket.create_connection(('127.0.0.1', port))
+        for sock in (self.switch, self.worker_sock):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.worker_sock.sendall(hello)
+        self.relay = relay
+        relay.add(self)
+
+
+class Relay(object):
+    # one selector thread moves the bytes of every spliced session, so a
+    # fleet costs one thread instead of two blocking ones per switch
+    def __init__(self, logger=None):
+        self.logger = logger or LOG
+        self.selector = selectors.DefaultSelector()
+        self.wakeup, self.waker = socket.socketpair()
+        self.wakeup.setblocking(False)
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+        self.lock = threading.Lock()
+        self.added = []
+        self.sessions = set()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+        return self.thread
+
+    def add(self, session):
+        # new sessions, and closed ones to drop, are handed over to the
+        # relay thread
+        with self.lock:
+            self.added.append(session)
+        self.waker.send(b'\0')
+
+    def _run(self):
+        while True:
+            for key, events in self.selector.select(1.0):
+                if key.fileobj is self.wakeup:
+                    self._register()
+                    continue
+                session = key.data
+                if session not in self.sessions:
+                    continue
+                try:
+                    if events & selectors.EVENT_WRITE:
+                        self._write(session, key.fileobj)
+                    if events & selectors.EVENT_READ:
+                        self._read(session, key.fileobj)
+                except socket.error:
+                    session.close()
+                if session.closed:
+                    self._drop(session)
+
+    def _register(self):
+        try:
+            while self.wakeup.recv(4096):
+                pass
+        except socket.error:
+            pass
+        with self.lock:
+            added, self.added = self.added, []
+        for session in added:
+            if not session.events:
+                self.sessions.add(session)
+                for sock in (session.switch, session.worker_sock):
+                    sock.setblocking(False)
+                    session.out[sock] = bytearray()
+                    session.events[sock] = 0
+            if session not in self.sessions:
+                continue
+            if session.closed:
+                self._drop(session)
+            else:
+                self._update(session)
+
+    def _drop(self, session):
+        self.sessions.discard(session)
+        for sock in (session.switch, session.worker_sock):
+            if session.events.get(sock):
+                self.selector.unregister(sock)
+                session.events[sock] = 0
+            sock.close()
+
+    def _read(self, session, sock):
+        data = sock.recv(RELAY_CHUNK)
+        if not data:
+            session.close()
+            return
+        if sock is session.worker_sock and session.head is not None:
+            # the switch already has the proxy's hello
+            session.head += data
+            if len(session.head) < HEADER.size:
+                return
+            _, msg_type, length, _ = HEADER.unpack_from(bytes(
+                session.head[:HEADER.size]))
+            if len(session.head) < length:
+                return
+            data = session.head[length:] if msg_type == OFPT_HELLO \
+                else session.head
+            session.head = None
+        peer = session.peer(sock)
+        session.out[peer] += data
+        self._write(session, peer)
+
+    def _write(self, session, sock):
+        out = session.out[sock]
+        if out:
+            try:
+                del out[:sock.send(out)]
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+        self._update(session)
+
+    def _update(self, session):
+        for sock in (session.switch, session.worker_sock):
+            events = 0
+            if len(session.out[session.peer(sock)]) < RELAY_HIGH_WATER:
+                events |= selectors.EVENT_READ
+            if session.out[sock]:
+                events |= selectors.EVENT_WRITE
+            before = session.events[sock]
+            if events == before:
+                continue
+            if not before:
+                self.selector.register(sock, events, session)
+            elif not events:
+                self.selector.unregister(sock)
+            else:
+                self.selector.modify(sock, events, session)
+            session.events[sock] = events
+
+
+class ShardSupervisor(object):
+    def __init__(self, app, workers, listen=('0.0.0.0', 6633),
+                 first_port=16700, ipc_path=None, ryu_manager='ryu-manager',
+                 report_interval=10.0, logger=None):
+        self.listen = listen
+        self.logger = logger or LOG
+        self.ipc_path = ipc_path or \
+            os.path.join(tempfile.gettempdir(), 'shard-%d.sock' % os.getpid())
+        self.workers = [Worker(i, app, first_port + i, workers,
+                               self.ipc_path, ryu_manager)
+                        for i in range(workers)]
+        self.ring = HashRing()
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.report_interval = report_interval
+        self.collector = ShardCollector(self.ipc_path, logger = self.logger)
+        self.relay = Relay(self.logger)
+        self.running = True
+
+    def start(self):
+        self.collector.start()
+        self.relay.start()
+        for worker in self.workers:
+            self._launch(worker)
+        for target in (self._monitor, self._report):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def _launch(self, worker):
+        worker.start()
+
+        def ready():
+            if wait_for_port(worker.port, alive=worker.alive):
+                with self.lock:
+                    self.ring.add(worker.index)
+                self.logger.info('worker %d up on port %d', worker.index,
+                                 worker.port)
+                self.rebalance()
+        thread = threading.Thread(target=ready)
+        thread.daemon = True
+        thread.start()
+
+    def rebalance(self):
+        # sessions whose owner changed reconnect and land on the new one
+        with self.lock:
+            moved = [s for s in self.sessions.values() if not s.closed and
+                     self.ring.lookup(s.dpid) != s.worker.index]
+        for session in moved:
+            self.logger.info('datapath %016x: moving from worker %d',
+                             session.dpid, session.worker.index)
+            session.close()
+
+    def _monitor(self):
+        while self.running:
+            time.sleep(1)
+            now = time.time()
+            for worker in self.workers:
+                if worker.alive() or not self.running:
+                    continue
+                if worker.retry_at is None:
+                    self._failed(worker, now)
+                elif now >= worker.retry_at:
+                    worker.retry_at = None
+                    worker.restarts += 1
+                    self._launch(worker)
+
+    def _failed(self, worker, now):
+        with self.lock:
+            self.ring.remove(worker.index)
+            orphans = [s for s in self.sessions.values()
+                       if s.worker is worker]
+        for session in orphans:
+            session.close()
+        # back off exponentially so an app that cannot even start does
+        # not respawn every second
+        if now - worker.started >= STABLE_RUN:
+            worker.failures = 0
+        delay = 0
+        if worker.failures:
+            delay = min(RESTART_BACKOFF_MAX,
+                        RESTART_BACKOFF * 2 ** (worker.failures - 1))
+        worker.failures += 1
+        worker.retry_at = now + delay
+        self.logger.info('worker %d exited (%s), restarting in %.0fs',
+                         worker.index, worker.process.returncode, delay)
+
+    def _report(self):
+        while self.running:
+            time.sleep(self.report_interval)
+            with self.lock:
+                per_worker = {}
+                for session in self.sessions.values():
+                    per_worker[session.worker.index] = \
+                        per_worker.get(session.worker.index, 0) + 1
+            self.logger.info('fleet: %d datapaths, per worker %s, '
+                             'reporting shards %s', len(self.sessions),
+                             per_worker, self.collector.shards())
+            for rate, (dpid, port_no) in self.collector.top_ports():
+                self.logger.info('fleet: datapath_id=%d, port=%d, '
+                                 'tx_bytes/s=%.1f', dpid, port_no, rate)
+
+    def _accept(self, sock, address):
+        session = SwitchSession(sock, address)
+        try:
+            hello = session.handshake()
+            if hello is None:
+                session.close()
+                return
+            with self.lock:
+                index = self.ring.lookup(session.dpid)
+                old = self.sessions.get(session.dpid)
+            if index is None:
+                self.logger.info('datapath %016x: no worker available',
+                                 session.dpid)
+                session.close()
+                return
+            if old is not None:
+                old.close()
+            session.splice(self.workers[index], self.workers[index].port,
+                           hello, self.relay)
+            with self.lock:
+                self.sessions[session.dpid] = session
+            self.logger.info('datapath %016x from %s -> worker %d',
+                             session.dpid, address[0], index)
+        except socket.error as e:
+            self.logger.info('%s: handshake failed: %s', address[0], e)
+            session.close()
+
+    def _reap(self):
+        with self.lock:
+            for dpid in [d for d, s in self.sessions.items() if s.closed]:
+                del self.sessions[dpid]
+
+    def serve(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(self.listen)
+        server.listen(1024)
+        server.settimeout(1.0)
+        try:
+            while self.running:
+                self._reap()
+                try:
+                    sock, address = server.accept()
+                except socket.timeout:
+                    continue
+                thread = threading.Thread(target=self._accept,
+                                          args=(sock, address))
+                thread.daemon = True
+                thread.start()
+        finally:
+            server.close()
+
+    def stop(self):
+        self.running = False
+        with self.lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session.close()
+        for worker in self.workers:
+            worker.stop()
+        self.collector.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='run an app as N ryu-manager shards behind one '
+                    'OpenFlow listener')
+    parser.add_argument('app')
+    parser.add_argument('--workers', type=int, default=os.cpu_count()
+                        if hasattr(os, 'cpu_count') else 4)
+    parser.add_argument('--listen-host', default='0.0.0.0')
+    parser.add_argument('--listen-port', type=int, default=6633)
+    parser.add_argument('--first-port', type=int, default=16700)
+    parser.add_argument('--ryu-manager', default='ryu-manager')
+    parser.add_argument('--report-interval', type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    supervisor = ShardSupervisor(args.app, args.workers,
+                                 (args.listen_host, args.listen_port),
+                                 args.first_port,
+                                 ryu_manager = args.ryu_manager,
+                                 report_interval = args.report_interval)
+    supervisor.start()
+    try:
+        supervisor.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
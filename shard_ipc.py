@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import heapq
+import socket
+import logging
+import threading
+
+LOG = logging.getLogger('shard_ipc')
+
+SHARD_ID_ENV = 'SHARD_ID'
+SHARD_COUNT_ENV = 'SHARD_COUNT'
+SHARD_IPC_ENV = 'SHARD_IPC'
+MAX_DATAGRAM = 65536
+
+
+def shard_id():
+    value = os.environ.get(SHARD_ID_ENV)
+    return int(value) if value is not None else None
+
+
+class ShardPublisher(object):
+    # workers fire one datagram per datapath report; a supervisor that
+    # is slow or gone costs a dropped report, never a blocked worker
+    def __init__(self, path=None, shard=None):
+        self.path = path or os.environ.get(SHARD_IPC_ENV)
+        self.shard = shard_id() if shard is None else shard
+        self.sock = None
+        self.dropped = 0
+        if self.path:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+
+    def __bool__(self):
+        return self.sock is not None
+
+    __nonzero__ = __bool__
+
+    def publish(self, kind, dpid, payload):
+        if self.sock is None:
+            return False
+        data = json.dumps({'shard': self.shard, 'kind': kind, 'dpid': dpid,
+                           'time': time.time(), 'data': payload})
+        try:
+            self.sock.sendto(data.encode('utf-8'), self.path)
+            return True
+        except (socket.error, OSError):
+            self.dropped += 1
+            return False
+
+
+class ShardCollector(object):
+    def __init__(self, path, ttl=30.0, logger=None):
+        self.path = path
+        self.ttl = ttl
+        self.logger = logger or LOG
+        self.reports = {}
+        self.received = 0
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def close(self):
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _run(self):
+        while True:
+            try:
+                data = self.sock.recv(MAX_DATAGRAM)
+            except (socket.error, OSError):
+                return
+            try:
+                report = json.loads(data.decode('utf-8'))
+            except ValueError:
+                continue
+            with self.lock:
+                self.received += 1
+                # a datapath reports from whichever shard holds it now,
+                # so the newest report wins after a move
+                key = (report['kind'], report['dpid'])
+                old = self.reports.get(key)
+                if old is None or old['time'] <= report['time']:
+                    self.reports[key] = report
+
+    def current(self, kind, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            return [r for (k, _), r in self.reports.items()
+                    if k == kind and now - r['time'] <= self.ttl]
+
+    def top_ports(self, field='tx_bytes', n=10):
+        return heapq.nlargest(n, ((rates.get(field, 0.0), (r['dpid'],
+                                                           int(port_no)))
+                                  for r in self.current('port')
+                                  for port_no, rates in r['data'].items()))
+
+    def shards(self):
+        counts = {}
+        with self.lock:
+            kinds = set(k for k, _ in self.reports)
+        for kind in kinds:
+            for report in self.current(kind):
+                counts.setdefault(report['shard'], set()).add(report['dpid'])
+        return dict((shard, len(dpids)) for shard, dpids in counts.items())
@@ -1,67 +1,139 @@
-from operator import attrgetter
-
+import os
 import time
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER,MAIN_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER,MAIN_DISPATCHER,DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.ofproto.ether import ETH_TYPE_IP
-from ryu.lib.ofctl_v1_3 import mod_flow_entry
+from flow_batch import FlowBatch
+from flow_encoder import encoder
 from ryu.lib import hub
+from stats_store import StatsStore
+from stats_poller import StatsPoller, FLOW_STATS, PORT_STATS
+from flow_accounting import FlowAccounting
+from stats_log import StatsLog
+from instrumentation import InstrumentedApp, registry
+from shard_ipc import ShardPublisher, shard_id
 
-class show_port_stats(app_manager.RyuApp):
+class show_port_stats(InstrumentedApp, app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    # count flows from FlowRemoved events and targeted refreshes instead
+    # of dumping every flow table on each poll
+    ACCOUNTING = True
+    # binary counter records, read back offline with stats_log.py
+    STATS_LOG_DIR = 'stats_log'
 
     def __init__(self, *args, **kwargs):
         super(show_port_stats, self).__init__(*args, **kwargs)
         self.datapaths={}
-        self.monitor = hub.spawn(self.request_stats)
+        self.store = StatsStore()
+        # under shard_controller every worker reports to the supervisor
+        # and keeps its own log directory
+        self.publisher = ShardPublisher()
+        log_dir = self.STATS_LOG_DIR
+        if shard_id() is not None:
+            log_dir = os.path.join(log_dir, 'shard-%d' % shard_id())
+        self.stats_log = StatsLog(log_dir, logger=self.logger)
+        self.accounting = FlowAccounting('show_port_stats', logger=self.logger)
+        if self.ACCOUNTING:
+            kinds = (PORT_STATS,)
+            self.accounting.start()
+        else:
+            kinds = (FLOW_STATS, PORT_STATS)
+        self.poller = StatsPoller(interval=5, kinds=kinds, logger=self.logger)
+        self.poller.start()
+        registry.add_poller(self.name, self.poller)
+        self.monitor = hub.spawn(self.report_stats)
     
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
         ofproto = datapath.ofproto 
         self.datapaths[datapath.id] = datapath
-        mod_flow_entry(datapath, {}, ofproto.OFPFC_DELETE)
+        self.poller.add_datapath(datapath)
+        self.accounting.add_datapath(datapath)
+        batch = FlowBatch(datapath, self.logger, encoder = encoder)
+        batch.add({}, ofproto.OFPFC_DELETE)
         priority = 100
         self.logger.info('switch joind: datapath: %061x' % datapath.id) 
-        mod_flow_entry(datapath,
-                      {'priority' : priority,
-                       'match' : {'in_port' : 1},
-                       'actions' : [{'type' : 'OUTPUT', 'port' : 2}]},
-                      ofproto.OFPFC_ADD)
+        flow = {'priority' : priority,
+                'match' : {'in_port' : 1},
+                'actions' : [{'type' : 'OUTPUT', 'port' : 2}]}
+        if self.ACCOUNTING:
+            # static forwarding rule: no idle timeout, totals come from
+            # targeted refreshes and the FlowRemoved sent on delete
+            flow = self.accounting.prepare(datapath,
+                                           dict(flow, idle_timeout = 0))
+        batch.add(flow, ofproto.OFPFC_ADD)
+        batch.send()
 
-    def request_stats(self):
-        while True:
-          print ("----------request stats----------")
-          for dp in self.datapaths.values():
-            ofproto = dp.ofproto
-            parser = dp.ofproto_parser
-   
-            req = parser.OFPFlowStatsRequest(dp)
-            dp.send_msg(req)
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def state_change_handler(self, ev):
+        dpid = ev.datapath.id
+        if dpid in self.datapaths:
+            del self.datapaths[dpid]
+            self.poller.remove_datapath(dpid)
+            self.accounting.remove_datapath(dpid)
+            self.store.remove_datapath(dpid)
+
+    def close(self):
+        super(show_port_stats, self).close()
+        self.stats_log.close()
 
-            req = parser.OFPPortStatsRequest(dp, 0, ofproto.OFPP_ANY)
-            dp.send_msg(req)
+    def report_stats(self):
+        while True:
+          print ("----------stats report----------")
+          self.logger.info("missed polls=%d records logged=%d stats rtt p95=%s", self.poller.missed_polls(), self.stats_log.written, self.poller.rtt(95))
+          if self.ACCOUNTING:
+            for dpid in self.datapaths:
+              self.logger.info("datapath_id=%d %s", dpid, self.accounting.totals(dpid))
+          for rate, (dpid, port_no) in self.store.top_ports('tx_bytes', 5):
+            self.logger.info("datapath_id=%d, port=%d, tx_bytes/s=%.1f", dpid, port_no, rate)
+          if self.publisher:
+            # every port's rates in one pass over the store
+            rates = self.store.port_rates(('tx_bytes', 'rx_bytes'))
+            for dpid in self.datapaths:
+              self.publisher.publish('port', dpid, rates.get(dpid, {}))
           hub.sleep(5)
 
     @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
     def flow_stats_reply_handler(self,ev):
-        body = ev.msg.body
-        print("send flow stats reply")
-
-        self.logger.info('---------------------------------------------')
-        for stat in sorted([flow for flow in body if flow.priority == 100],
-                           key=lambda flow:(flow.match['in_port'])):
-          self.logger.info("datapath_id=%d in_port=%d packet_count=%d byte_count=%d",ev.msg.datapath.id,stat.match['in_port'],stat.packet_count,stat.byte_count)
+        now = time.time()
+        if self.accounting.flow_stats_reply(ev):
+            # targeted refreshes keep the history of long-lived flows
+            self.store.add_flow_stats(ev.msg.datapath.id, ev.msg.body, now)
+            self.stats_log.add_flow_stats(ev.msg.datapath.id, ev.msg.body, now)
+            return
+        body = self.poller.reply(ev)
+        if body is None:
+            return
+        # the poller hands back the body once every part has arrived
+        self.store.add_flow_stats(ev.msg.datapath.id, body, now, complete = True)
+        self.stats_log.add_flow_stats(ev.msg.datapath.id, body, now)
 
     @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
     def port_stats_reply_handler(self, ev):
-        body = ev.msg.body
-        print("send port stats reply")
-        print body
-        self.logger.info('---------------------------------------------')
+        body = self.poller.reply(ev)
+        if body is None:
+            return
+        now = time.time()
+        self.store.add_port_stats(ev.msg.datapath.id, body, now)
+        self.stats_log.add_port_stats(ev.msg.datapath.id, body, now)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        account = self.accounting.flow_removed(ev)
+        if account is not None:
+            # the removal carries the final counters; log them and stop
+            # tracking the flow's rate
+            self.stats_log.add_flow_stats(account.dpid, [ev.msg])
+            self.store.remove_flow(account.dpid, ev.msg)
+            self.logger.info("datapath_id=%d cookie=%x removed packet_count=%d byte_count=%d",
+                             account.dpid, account.cookie, account.packets, account.bytes)
 
-        for stat in sorted (body, key =attrgetter('port_no')):
-            self.logger.info("datapath_id=%d, in_port=%d, rx_packets=%d, rx_bytes=%d, rx_errors=%d, tx_packets=%d, tx_bytes=%d, tx_errors=%d", ev.msg.datapath.id,stat.port_no,stat.rx_packets,stat.rx_bytes,stat.rx_errors,stat.tx_packets,stat.tx_bytes,stat.tx_errors)
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    def port_status_handler(self, ev):
+        dpid, port_no = self.accounting.port_status(ev)
+        self.logger.info("datapath_id=%d port=%d up=%s", dpid, port_no,
+                         self.accounting.port_up(dpid, port_no))
@@ -0,0 +1,312 @@
+import os
+import sys
+import json
+import mmap
+import time
+import zlib
+import struct
+import logging
+import argparse
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from stats_store import PORT_FIELDS
+
+LOG = logging.getLogger('stats_log')
+
+MAGIC = b'OFSL'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQ')
+HEADER_SIZE = 64
+# time, dpid, kind, table_id, port_no (priority for flows), cookie,
+# match key, then six counters; 88 bytes, no padding
+RECORD = struct.Struct('<dQHHIQQ6Q')
+COUNTERS = 6
+
+PORT_RECORD = 1
+FLOW_RECORD = 2
+KINDS = {'port': PORT_RECORD, 'flow': FLOW_RECORD}
+FLOW_COUNTERS = ('packet_count', 'byte_count', 'duration_sec',
+                 'duration_nsec')
+COUNTER_FIELDS = {PORT_RECORD: PORT_FIELDS, FLOW_RECORD: FLOW_COUNTERS}
+
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+if numpy is not None:
+    DTYPE = numpy.dtype([('time', '<f8'), ('dpid', '<u8'),
+                         ('kind', '<u2'), ('table_id', '<u2'),
+                         ('port_no', '<u4'), ('cookie', '<u8'),
+                         ('key', '<u8'), ('counters', '<u8', (COUNTERS,))])
+    assert DTYPE.itemsize == RECORD.size
+
+
+def match_hash(match):
+    # stable across processes, unlike hash()
+    return zlib.crc32(repr(sorted(match.items())).encode()) & 0xffffffff
+
+
+def segment_name(seq):
+    return 'stats-%08d%s' % (seq, SEGMENT_SUFFIX)
+
+
+def list_segments(directory):
+    return sorted(os.path.join(directory, name)
+                  for name in os.listdir(directory)
+                  if name.endswith(SEGMENT_SUFFIX))
+
+
+class SegmentIndex(object):
+    def __init__(self):
+        self.count = 0
+        self.t_min = None
+        self.t_max = None
+        self.dpids = {}
+
+    def add(self, dpid, ts):
+        self.count += 1
+        if self.t_min is None or ts < self.t_min:
+            self.t_min = ts
+        if self.t_max is None or ts > self.t_max:
+            self.t_max = ts
+        entry = self.dpids.get(dpid)
+        if entry is None:
+            self.dpids[dpid] = [1, ts, ts]
+        else:
+            entry[0] += 1
+            entry[1] = min(entry[1], ts)
+            entry[2] = max(entry[2], ts)
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump({'count': self.count, 't_min': self.t_min,
+                       't_max': self.t_max,
+                       'dpids': dict((str(k), v)
+                                     for k, v in self.dpids.items())}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        index = cls()
+        index.count = data['count']
+        index.t_min = data['t_min']
+        index.t_max = data['t_max']
+        index.dpids = dict((int(k), v) for k, v in data['dpids'].items())
+        return index
+
+    def overlaps(self, since=None, until=None, dpid=None):
+        if not self.count:
+            return False
+        if dpid is not None:
+            entry = self.dpids.get(dpid)
+            if entry is None:
+                return False
+            t_min, t_max = entry[1], entry[2]
+        else:
+            t_min, t_max = self.t_min, self.t_max
+        if since is not None and t_max < since:
+            return False
+        if until is not None and t_min >= until:
+            return False
+        return True
+
+
+class Segment(object):
+    def __init__(self, path, size):
+        self.path = path
+        self.capacity = (size - HEADER_SIZE) // RECORD.size
+        self.file = open(path, 'w+b')
+        self.file.truncate(HEADER_SIZE + self.capacity * RECORD.size)
+        self.map = mmap.mmap(self.file.fileno(),
+                             HEADER_SIZE + self.capacity * RECORD.size)
+        self.count = 0
+        self.opened = time.time()
+        self.index = SegmentIndex()
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, RECORD.size, 0)
+
+    def full(self):
+        return self.count >= self.capacity
+
+    def append(self, ts, dpid, kind, table_id, port_no, cookie, key,
+               counters):
+        RECORD.pack_into(self.map, HEADER_SIZE + self.count * RECORD.size,
+                         ts, dpid, kind, table_id, port_no, cookie, key,
+                         *counters)
+        self.count += 1
+        # publish the record only once it is fully written
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, RECORD.size,
+                         self.count)
+        self.index.add(dpid, ts)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+        self.index.dump(self.path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX)
+
+
+class StatsLog(object):
+    # append-only binary sink: records are packed straight into a mapped
+    # segment file, so a reply costs one struct.pack_into per counter row
+    def __init__(self, directory, segment_size=64 << 20,
+                 segment_seconds=3600, logger=None):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segment_seconds = segment_seconds
+        self.logger = logger or LOG
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.seq = 0
+        segments = list_segments(directory)
+        if segments:
+            name = os.path.basename(segments[-1])
+            self.seq = int(name[len('stats-'):-len(SEGMENT_SUFFIX)]) + 1
+        self.segment = None
+        self.written = 0
+
+    def _current(self, ts):
+        segment = self.segment
+        if segment is not None and not segment.full() and \
+                ts - segment.opened < self.segment_seconds:
+            return segment
+        if segment is not None:
+            segment.close()
+        path = os.path.join(self.directory, segment_name(self.seq))
+        self.seq += 1
+        self.segment = Segment(path, self.segment_size)
+        self.logger.debug('stats log: new segment %s', path)
+        return self.segment
+
+    def add_port_stats(self, dpid, body, ts=None):
+        ts = time.time() if ts is None else ts
+        for stat in body:
+            self._current(ts).append(ts, dpid, PORT_RECORD, 0, stat.port_no,
+                                     0, 0, [getattr(stat, f)
+                                            for f in PORT_FIELDS])
+        self.written += len(body)
+
+    def add_flow_stats(self, dpid, body, ts=None):
+        ts = time.time() if ts is None else ts
+        for stat in body:
+            self._current(ts).append(ts, dpid, FLOW_RECORD, stat.table_id,
+                                     stat.priority, stat.cookie,
+                                     match_hash(stat.match),
+                                     [stat.packet_count, stat.byte_count,
+                                      stat.duration_sec, stat.duration_nsec,
+                                      0, 0])
+        self.written += len(body)
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+
+class StatsLogReader(object):
+    def __init__(self, directory):
+        if numpy is None:
+            raise RuntimeError('StatsLogReader needs numpy')
+        self.directory = directory
+
+    def _index(self, path):
+        idx = path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+        if os.path.exists(idx):
+            return SegmentIndex.load(idx)
+        # segment still being written: index it from the records
+        index = SegmentIndex()
+        records = self.records(path)
+        for dpid in numpy.unique(records['dpid']):
+            times = records['time'][records['dpid'] == dpid]
+            index.dpids[int(dpid)] = [len(times), float(times.min()),
+                                      float(times.max())]
+        if len(records):
+            index.count = len(records)
+            index.t_min = float(records['time'].min())
+            index.t_max = float(records['time'].max())
+        return index
+
+    def segments(self, since=None, until=None, dpid=None):
+        return [path for path in list_segments(self.directory)
+                if self._index(path).overlaps(since, until, dpid)]
+
+    def records(self, path):
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size, count = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or size != RECORD.size:
+            raise ValueError('%s: not a stats log segment' % path)
+        # the array is a view on the mapping, nothing is copied
+        return numpy.frombuffer(buf, DTYPE, count, HEADER_SIZE)
+
+    def scan(self, since=None, until=None, dpid=None, kind=None):
+        for path in self.segments(since, until, dpid):
+            records = self.records(path)
+            times = records['time']
+            lo = 0 if since is None else numpy.searchsorted(times, since)
+            hi = len(records) if until is None else \
+                numpy.searchsorted(times, until)
+            records = records[lo:hi]
+            if dpid is not None:
+                records = records[records['dpid'] == dpid]
+            if kind is not None:
+                records = records[records['kind'] == kind]
+            if len(records):
+                yield records
+
+    def read(self, since=None, until=None, dpid=None, kind=None):
+        chunks = list(self.scan(since, until, dpid, kind))
+        if not chunks:
+            return numpy.zeros(0, DTYPE)
+        if len(chunks) == 1:
+            return chunks[0]
+        return numpy.concatenate(chunks)
+
+
+def column(records, field):
+    kind = int(records['kind'][0]) if len(records) else PORT_RECORD
+    return records['counters'][:, COUNTER_FIELDS[kind].index(field)]
+
+
+def export_csv(records, out):
+    names = ['time', 'dpid', 'kind', 'table_id', 'port_no', 'cookie', 'key']
+    out.write(','.join(names + ['c%d' % i for i in range(COUNTERS)]) + '\n')
+    for rec in records:
+        out.write(','.join([repr(float(rec['time']))] +
+                           [str(int(rec[n])) for n in names[1:]] +
+                           [str(int(c)) for c in rec['counters']]) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='query a stats log')
+    parser.add_argument('directory')
+    parser.add_argument('--since', type=float)
+    parser.add_argument('--until', type=float)
+    parser.add_argument('--dpid', type=int)
+    parser.add_argument('--kind', choices=sorted(KINDS))
+    parser.add_argument('--csv', action='store_true')
+    args = parser.parse_args(argv)
+
+    reader = StatsLogReader(args.directory)
+    kind = KINDS.get(args.kind)
+    start = time.time()
+    if args.csv:
+        for records in reader.scan(args.since, args.until, args.dpid, kind):
+            export_csv(records, sys.stdout)
+        return
+    records = reader.read(args.since, args.until, args.dpid, kind)
+    elapsed = time.time() - start
+    print('%d records from %d segments in %.3fs' %
+          (len(records), len(reader.segments(args.since, args.until,
+                                             args.dpid)), elapsed))
+    for dpid in numpy.unique(records['dpid']):
+        rows = records[records['dpid'] == dpid]
+        print('datapath %016x: %d records %.0f..%.0f' %
+              (dpid, len(rows), rows['time'].min(), rows['time'].max()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import time
+import heapq
+import logging
+from collections import deque
+
+from ryu.lib import hub
+
+from util import adapt_interval, percentile
+
+LOG = logging.getLogger('stats_poller')
+
+FLOW_STATS = 'flow'
+PORT_STATS = 'port'
+
+
+def phase_offset(dpid):
+    # multiplicative hash spreads sequential dpids across the interval
+    return ((dpid * 2654435761) & 0xffffffff) / float(1 << 32)
+
+
+class PendingRequest(object):
+    __slots__ = ('dpid', 'kind', 'sent_at', 'body')
+
+    def __init__(self, dpid, kind, sent_at):
+        self.dpid = dpid
+        self.kind = kind
+        self.sent_at = sent_at
+        self.body = []
+
+
+class PollState(object):
+    def __init__(self, datapath, interval, due):
+        self.datapath = datapath
+        self.interval = interval
+        self.due = due
+        self.outstanding = 0
+        self.last_total = None
+        self.latency = None
+        self.polls = 0
+        self.missed = 0
+
+
+class StatsPoller(object):
+    def __init__(self, interval=5.0, min_interval=None, max_interval=None,
+                 max_inflight=64, timeout=None, tick=0.05, kinds=None,
+                 history=1024, logger=None):
+        self.interval = interval
+        self.min_interval = min_interval or interval
+        self.max_interval = max_interval or interval * 4
+        self.max_inflight = max_inflight
+        self.timeout = timeout or interval
+        self.tick = tick
+        self.kinds = kinds or (FLOW_STATS, PORT_STATS)
+        self.logger = logger or LOG
+        self.states = {}
+        self.pending = {}
+        self.queue = []
+        # request -> last reply part, over every datapath
+        self.latencies = deque(maxlen=history)
+        self.thread = None
+
+    def add_datapath(self, datapath):
+        due = time.time() + phase_offset(datapath.id) * self.interval
+        self.states[datapath.id] = PollState(datapath, self.interval, due)
+        heapq.heappush(self.queue, (due, datapath.id))
+
+    def remove_datapath(self, dpid):
+        self.states.pop(dpid, None)
+        for xid in [x for x, req in self.pending.items() if req.dpid == dpid]:
+            del self.pending[xid]
+
+    def start(self):
+        if self.thread is None:
+            self.thread = hub.spawn(self._run)
+        return self.thread
+
+    def _run(self):
+        while True:
+            now = time.time()
+            self._expire(now)
+            while self.queue and self.queue[0][0] <= now:
+                if len(self.pending) + len(self.kinds) > self.max_inflight:
+                    break
+                due, dpid = heapq.heappop(self.queue)
+                state = self.states.get(dpid)
+                if state is None or state.due != due:
+                    continue
+                self._poll(state, now)
+            hub.sleep(self.tick)
+
+    def _poll(self, state, now):
+        dp = state.datapath
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        for kind in self.kinds:
+            if kind == FLOW_STATS:
+                req = parser.OFPFlowStatsRequest(dp)
+            else:
+                req = parser.OFPPortStatsRequest(dp, 0, ofproto.OFPP_ANY)
+            dp.set_xid(req)
+            dp.send_msg(req)
+            self.pending[(dp.id, req.xid)] = PendingRequest(dp.id, kind, now)
+        state.outstanding += len(self.kinds)
+        state.polls += 1
+        state.due = now + state.interval
+        heapq.heappush(self.queue, (state.due, dp.id))
+
+    def _expire(self, now):
+        for key, req in list(self.pending.items()):
+            if now - req.sent_at > self.timeout:
+                del self.pending[key]
+                state = self.states.get(req.dpid)
+                if state is not None:
+                    state.outstanding = max(0, state.outstanding - 1)
+                    state.missed += 1
+                self.logger.info('datapath %016x: %s stats request timed out',
+                                 req.dpid, req.kind)
+
+    def reply(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        req = self.pending.get((dpid, msg.xid))
+        if req is None:
+            return None
+        req.body.extend(msg.body)
+        if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            return None
+        del self.pending[(dpid, msg.xid)]
+        state = self.states.get(dpid)
+        if state is not None:
+            state.outstanding = max(0, state.outstanding - 1)
+            state.latency = time.time() - req.sent_at
+            self.latencies.append(state.latency)
+            if req.kind == PORT_STATS:
+                self._adapt(state, req.body)
+        return req.body
+
+    def _adapt(self, state, body):
+        total = sum(s.rx_packets + s.tx_packets for s in body)
+        if state.last_total is not None:
+            state.interval = adapt_interval(state.interval,
+                                            total != state.last_total,
+                                            self.min_interval,
+                                            self.max_interval)
+        state.last_total = total
+
+    def poll_latency(self, dpid):
+        state = self.states.get(dpid)
+        return state.latency if state is not None else None
+
+    def rtt(self, pct):
+        return percentile(self.latencies, pct)
+
+    def missed_polls(self, dpid=None):
+        if dpid is not None:
+            state = self.states.get(dpid)
+            return state.missed if state is not None else 0
+        return sum(state.missed for state in self.states.values())
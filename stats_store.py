@@ -0,0 +1,206 @@
+import time
+
+import numpy
+
+PORT_FIELDS = ('rx_packets', 'tx_packets', 'rx_bytes', 'tx_bytes',
+               'rx_errors', 'tx_errors')
+FLOW_FIELDS = ('packet_count', 'byte_count')
+
+
+class RingTable(object):
+    # one fixed-size ring of samples per key, all of them rows of the same
+    # preallocated arrays, so rates and top-N over every key are single
+    # numpy operations and a key costs size * (fields + 1) doubles
+    def __init__(self, fields, size, capacity=64):
+        self.fields = fields
+        self.size = size
+        self.width = len(fields)
+        self.rows = {}
+        self.by_dpid = {}
+        self.free = list(range(capacity - 1, -1, -1))
+        self.keys = [None] * capacity
+        self.times = numpy.zeros((capacity, size))
+        self.values = numpy.zeros((capacity, size, self.width))
+        self.heads = numpy.zeros(capacity, numpy.intp)
+        self.counts = numpy.zeros(capacity, numpy.intp)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def keys_of(self, dpid):
+        return self.by_dpid.get(dpid, ())
+
+    def count(self, key):
+        row = self.rows.get(key)
+        return 0 if row is None else int(self.counts[row])
+
+    def _grow(self):
+        capacity = len(self.keys)
+        self.keys.extend([None] * capacity)
+        self.times = numpy.concatenate([self.times,
+                                        numpy.zeros_like(self.times)])
+        self.values = numpy.concatenate([self.values,
+                                         numpy.zeros_like(self.values)])
+        self.heads = numpy.concatenate([self.heads,
+                                        numpy.zeros_like(self.heads)])
+        self.counts = numpy.concatenate([self.counts,
+                                         numpy.zeros_like(self.counts)])
+        self.free.extend(range(len(self.keys) - 1, capacity - 1, -1))
+
+    def _row(self, key):
+        row = self.rows.get(key)
+        if row is not None:
+            return row
+        if not self.free:
+            self._grow()
+        row = self.rows[key] = self.free.pop()
+        self.keys[row] = key
+        self.by_dpid.setdefault(key[0], set()).add(key)
+        return row
+
+    def append(self, ts, keys, values):
+        if not keys:
+            return
+        rows = numpy.array([self._row(key) for key in keys], numpy.intp)
+        heads = self.heads[rows]
+        self.times[rows, heads] = ts
+        self.values[rows, heads] = values
+        self.heads[rows] = (heads + 1) % self.size
+        self.counts[rows] = numpy.minimum(self.counts[rows] + 1, self.size)
+
+    def remove(self, key):
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        self.keys[row] = None
+        self.heads[row] = 0
+        self.counts[row] = 0
+        self.free.append(row)
+        keys = self.by_dpid.get(key[0])
+        keys.discard(key)
+        if not keys:
+            del self.by_dpid[key[0]]
+
+    def remove_dpid(self, dpid):
+        for key in list(self.by_dpid.get(dpid, ())):
+            self.remove(key)
+
+    def rows_of(self, keys=None):
+        if keys is None:
+            return numpy.fromiter(self.rows.values(), numpy.intp,
+                                  len(self.rows))
+        return numpy.array([self.rows[key] for key in keys
+                            if key in self.rows], numpy.intp)
+
+    def rates(self, field, intervals=1, rows=None):
+        # per-row rate over the newest `intervals` deltas, or as many as
+        # the row has; a counter that went backwards was reset, so that
+        # delta counts from zero
+        col = self.fields.index(field)
+        rows = self.rows_of() if rows is None else rows
+        steps = numpy.arange(intervals, -1, -1)
+        slots = (self.heads[rows][:, None] - 1 - steps) % self.size
+        times = self.times[rows[:, None], slots]
+        values = self.values[rows[:, None], slots, col]
+        spans = numpy.diff(times, axis=1)
+        deltas = numpy.diff(values, axis=1)
+        deltas = numpy.where(deltas >= 0, deltas, values[:, 1:])
+        valid = steps[1:] < self.counts[rows][:, None] - 1
+        span = numpy.where(valid, spans, 0.0).sum(axis=1)
+        total = numpy.where(valid, deltas, 0.0).sum(axis=1)
+        rates = numpy.zeros(len(rows))
+        moving = span > 0
+        rates[moving] = total[moving] / span[moving]
+        return rates
+
+    def rate(self, key, field, intervals=1):
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        return float(self.rates(field, intervals,
+                                numpy.array([row], numpy.intp))[0])
+
+    def top(self, field, n=10, intervals=1):
+        rows = self.rows_of()
+        rows = rows[self.counts[rows] > 1]
+        if not len(rows) or n <= 0:
+            return []
+        rates = self.rates(field, intervals, rows)
+        if n < len(rows):
+            best = numpy.argpartition(-rates, n - 1)[:n]
+        else:
+            best = numpy.arange(len(rows))
+        best = best[numpy.argsort(-rates[best], kind='stable')]
+        return [(float(rates[i]), self.keys[rows[i]]) for i in best]
+
+
+def flow_key(stat):
+    return (stat.table_id, stat.priority, stat.cookie,
+            tuple(sorted(stat.match.items())))
+
+
+class StatsStore(object):
+    def __init__(self, size=32):
+        self.size = size
+        self.ports = RingTable(PORT_FIELDS, size)
+        self.flows = RingTable(FLOW_FIELDS, size)
+        self._seen_flows = {}
+
+    def add_port_stats(self, dpid, body, ts=None):
+        ts = time.time() if ts is None else ts
+        self.ports.append(ts, [(dpid, stat.port_no) for stat in body],
+                          [[getattr(stat, f) for f in PORT_FIELDS]
+                           for stat in body])
+
+    def add_flow_stats(self, dpid, body, ts=None, complete=False):
+        ts = time.time() if ts is None else ts
+        seen = self._seen_flows.setdefault(dpid, set())
+        keys = [(dpid, flow_key(stat)) for stat in body]
+        seen.update(keys)
+        self.flows.append(ts, keys, [[getattr(stat, f) for f in FLOW_FIELDS]
+                                     for stat in body])
+        if complete:
+            # only the last part of a multipart dump is complete; flows
+            # missing from all of the parts are gone from the switch
+            for key in [k for k in self.flows.keys_of(dpid)
+                        if k not in seen]:
+                self.flows.remove(key)
+            del self._seen_flows[dpid]
+
+    def remove_flow(self, dpid, stat):
+        self.flows.remove((dpid, flow_key(stat)))
+
+    def remove_datapath(self, dpid):
+        self.ports.remove_dpid(dpid)
+        self.flows.remove_dpid(dpid)
+        self._seen_flows.pop(dpid, None)
+
+    def port_rate(self, dpid, port_no, field, intervals=1):
+        return self.ports.rate((dpid, port_no), field, intervals)
+
+    def flow_rate(self, dpid, stat_key, field, intervals=1):
+        return self.flows.rate((dpid, stat_key), field, intervals)
+
+    def port_rates(self, fields, intervals=1):
+        # {dpid: {port_no: {field: rate}}} from one pass over every ring
+        keys = list(self.ports)
+        rows = self.ports.rows_of(keys)
+        columns = [self.ports.rates(f, intervals, rows).tolist()
+                   for f in fields]
+        rates = {}
+        for i, (dpid, port_no) in enumerate(keys):
+            rates.setdefault(dpid, {})[port_no] = \
+                dict((f, column[i]) for f, column in zip(fields, columns))
+        return rates
+
+    def top_ports(self, field='tx_bytes', n=10, intervals=1):
+        return self.ports.top(field, n, intervals)
+
+    def top_flows(self, field='byte_count', n=10, intervals=1):
+        return self.flows.top(field, n, intervals)
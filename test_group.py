@@ -1,45 +1,67 @@
-import time
 import socket
 
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.ofctl_v1_3 import mod_flow_entry
+from flow_batch import FlowBatch
+from group_manager import GroupManager
+from provisioner import Provisioner, load_roles, role_map
 
 class SAMPLE_APP(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    # dpid -> spine/leaf/edge, so spines are programmed first
+    ROLES_FILE = 'roles.json'
 
     def __init__(self, *args, **kwargs):
         super(SAMPLE_APP, self).__init__(*args, **kwargs)
+        self.groups = GroupManager(self.logger)
+        self.provisioner = Provisioner(
+            role_of=role_map(load_roles(self.ROLES_FILE)), logger=self.logger)
+        self.provisioner.start()
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
-        datapath = ev.msg.datapath
+        self.provisioner.submit(ev.msg.datapath, self.program)
+
+    def program(self, datapath):
         ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
 
-        mod_flow_entry(datapath, {}, ofproto.OFPFC_DELETE)
+        batch = FlowBatch(datapath, self.logger)
+        batch.add({}, ofproto.OFPFC_DELETE)
+        self.groups.reset(datapath, batch)
+        batch.send(barrier=False)
+        # the provisioner checks the send queue between chunks
+        yield
         priority = 100
         self.logger.info('switch joind: datapath: %061x' % datapath.id)
-        action = []
-        buckets = []
-        action.append(parser.OFPActionSetField(eth_src="00:00:00:00:00:00"))
-        action.append(parser.OFPActionOutput(1, 0))
-        buckets.append(parser.OFPBucket(0,0,0,actions = action))
-        action = []
-        action.append(parser.OFPActionSetField(eth_src="00:00:00:00:00:01"))
-        action.append(parser.OFPActionOutput(2, 0))
-        buckets.append(parser.OFPBucket(0,0,0,actions = action))
-        mod = parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD, ofproto.OFPGT_ALL, 1, buckets)
-        datapath.send_msg(mod)
-
-        match = parser.OFPMatch(in_port = 1, eth_type = 0x800, ip_proto = socket.IPPROTO_UDP, udp_dst = 63)
-        action = []
-        action.append(parser.OFPActionGroup(group_id = 1))
-        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, action)]
-        mod = parser.OFPFlowMod(datapath = datapath, priority = 100, match = match,
-                                instructions = inst)
-        datapath.send_msg(mod)
+        group_id = self.groups.acquire(datapath,
+                      [{'actions' : [{'type' : 'SET_FIELD',
+                                      'field' : 'eth_src',
+                                      'value' : '00:00:00:00:00:00'},
+                                     {'type' : 'OUTPUT', 'port' : 1}]},
+                       {'actions' : [{'type' : 'SET_FIELD',
+                                      'field' : 'eth_src',
+                                      'value' : '00:00:00:00:00:01'},
+                                     {'type' : 'OUTPUT', 'port' : 2}]}],
+                      'ALL', batch)
+
+        batch.add({'priority' : priority,
+                   'match' : {'in_port' : 1,
+                              'eth_type' : 0x800,
+                              'ip_proto' : socket.IPPROTO_UDP,
+                              'udp_dst' : 63},
+                   'actions' : [{'type' : 'GROUP', 'group_id' : group_id}]},
+                  ofproto.OFPFC_ADD)
+        batch.send(barrier=False)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def barrier_reply_handler(self, ev):
+        self.provisioner.barrier_reply(ev)
 
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def state_change_handler(self, ev):
+        if ev.datapath.id is not None:
+            self.groups.remove_datapath(ev.datapath.id)
+            self.provisioner.remove_datapath(ev.datapath.id)
@@ -0,0 +1,62 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('ryu')
+
+from bench_flow_encoder import FLOW, loopback_pair  # noqa: E402
+from flow_batch import FlowBatch, build_flow_mod  # noqa: E402
+from instrumentation import MetricsRegistry  # noqa: E402
+from ryu.controller.controller import Datapath  # noqa: E402
+from ryu.ofproto import ofproto_v1_3  # noqa: E402
+
+
+class QueuedDatapath(Datapath):
+    # the real send()/send_msg(), writes stay on send_q
+    def __init__(self, dpid):
+        sock, self._peer = loopback_pair()
+        super(QueuedDatapath, self).__init__(sock, sock.getpeername())
+        self.set_version(ofproto_v1_3.OFP_VERSION)
+        self.id = dpid
+
+    def set_state(self, state):
+        self.state = state
+
+
+@pytest.fixture
+def datapath():
+    dp = QueuedDatapath(1)
+    yield dp
+    dp.socket.close()
+    dp._peer.close()
+
+
+def test_send_msg_through_wrapped_send(datapath):
+    metrics = MetricsRegistry().add_datapath(datapath)
+    msg = build_flow_mod(datapath, FLOW, datapath.ofproto.OFPFC_ADD)
+    assert datapath.send_msg(msg)
+    assert datapath.send_msg(msg, close_socket=True)
+    assert metrics.flow_mods == 2
+    assert datapath.send_q.get() == (msg.buf, False)
+    assert datapath.send_q.get() == (msg.buf, True)
+
+
+def test_batch_counts_every_flow_mod(datapath):
+    metrics = MetricsRegistry().add_datapath(datapath)
+    batch = FlowBatch(datapath)
+    for _ in range(3):
+        batch.add(FLOW, datapath.ofproto.OFPFC_ADD)
+    batch.send()
+    assert metrics.flow_mods == 3
+
+
+def test_wrapping_twice_is_a_no_op(datapath):
+    registry = MetricsRegistry()
+    first = registry.add_datapath(datapath)
+    assert registry.add_datapath(datapath) is first
+    datapath.send_msg(build_flow_mod(datapath, FLOW,
+                                     datapath.ofproto.OFPFC_ADD))
+    assert first.flow_mods == 1
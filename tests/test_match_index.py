@@ -0,0 +1,83 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from match_index import aggregate, canonical, compact, covers  # noqa: E402
+
+OUTPUT = [{'type': 'OUTPUT', 'port': 2}]
+
+
+def host_rules(priority=100, **extra):
+    return [dict({'priority': priority,
+                  'match': {'eth_type': 0x800,
+                            'ipv4_dst': '10.0.0.%d' % n},
+                  'actions': OUTPUT}, **extra)
+            for n in range(4)]
+
+
+def test_covers():
+    subnet = canonical({'ipv4_dst': '10.0.0.0/24'})
+    host = canonical({'ipv4_dst': '10.0.0.7', 'eth_type': 0x800})
+    other = canonical({'ipv4_dst': '10.0.1.7'})
+    assert covers(subnet, host)
+    assert not covers(host, subnet)
+    assert not covers(subnet, other)
+    assert covers({}, host)
+    assert not covers(canonical({'in_port': 1}), host)
+
+
+def test_aggregate_merges_siblings():
+    merged = aggregate(host_rules())
+    assert [f['match']['ipv4_dst'] for f in merged] == ['10.0.0.0/30']
+    assert merged[0]['actions'] == OUTPUT
+
+
+def test_aggregate_keeps_different_treatments_apart():
+    flows = host_rules()
+    flows[0] = dict(flows[0], actions = [{'type': 'OUTPUT', 'port': 3}])
+    merged = aggregate(flows)
+    assert sorted(f['match']['ipv4_dst'] for f in merged) == \
+        ['10.0.0.0', '10.0.0.1', '10.0.0.2/31']
+
+
+def test_aggregate_leaves_timed_rules_alone():
+    flows = host_rules(idle_timeout = 10)
+    assert aggregate(flows) == flows
+
+
+def test_compact_drops_shadowed_rules():
+    subnet = {'priority': 200,
+              'match': {'eth_type': 0x800, 'ipv4_dst': '10.0.0.0/24'},
+              'actions': []}
+    flows, report = compact([subnet] + host_rules(), drop_redundant=False)
+    assert flows == [subnet]
+    assert report.before == {0: 5}
+    assert report.after == {0: 1}
+
+
+def test_compact_keeps_rules_under_a_timed_rule():
+    subnet = {'priority': 200, 'hard_timeout': 10,
+              'match': {'eth_type': 0x800, 'ipv4_dst': '10.0.0.0/24'},
+              'actions': []}
+    hosts = host_rules()
+    flows, report = compact([subnet] + hosts, drop_redundant=False)
+    assert report.shadowed == []
+    # the hosts still merge, and outlive the subnet rule
+    assert len(flows) == 2
+
+
+def test_compact_drops_redundant_rules():
+    lower = {'priority': 10,
+             'match': {'eth_type': 0x800, 'ipv4_dst': '10.0.0.0/8'},
+             'actions': OUTPUT}
+    upper = {'priority': 100,
+             'match': {'eth_type': 0x800, 'ipv4_dst': '10.1.0.0/16'},
+             'actions': OUTPUT}
+    flows, report = compact([lower, upper])
+    assert flows == [lower]
+    assert report.redundant == [upper]
+    flows, report = compact([dict(lower, idle_timeout = 30),
+                             dict(upper, idle_timeout = 30)])
+    assert report.redundant == []
+    assert len(flows) == 2
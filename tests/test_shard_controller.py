@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shard_controller import HashRing  # noqa: E402
+
+
+def ring(nodes):
+    ring = HashRing()
+    for node in nodes:
+        ring.add(node)
+    return ring
+
+
+def test_empty_ring():
+    assert HashRing().lookup(1) is None
+
+
+def test_lookup_is_stable():
+    first = ring([0, 1, 2, 3])
+    second = ring([3, 2, 1, 0])
+    assert [first.lookup(d) for d in range(1000)] == \
+        [second.lookup(d) for d in range(1000)]
+
+
+def test_every_node_gets_a_share():
+    r = ring(range(4))
+    owners = [r.lookup(d) for d in range(4000)]
+    for node in range(4):
+        assert owners.count(node) > 500
+
+
+def test_removing_a_node_only_moves_its_datapaths():
+    r = ring(range(4))
+    before = dict((d, r.lookup(d)) for d in range(2000))
+    r.remove(2)
+    after = dict((d, r.lookup(d)) for d in range(2000))
+    moved = [d for d in before if before[d] != after[d]]
+    assert moved and all(before[d] == 2 for d in moved)
+    assert 2 not in after.values()
+    r.add(2)
+    assert dict((d, r.lookup(d)) for d in range(2000)) == before
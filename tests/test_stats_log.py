@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('numpy')
+
+from stats_log import (FLOW_RECORD, HEADER_SIZE, PORT_RECORD,  # noqa: E402
+                       RECORD, StatsLog, StatsLogReader, column,
+                       match_hash)
+from stats_store import PORT_FIELDS  # noqa: E402
+
+
+class Stat(object):
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def port_stat(port_no, base):
+    return Stat(port_no = port_no,
+                **dict((f, base + n) for n, f in enumerate(PORT_FIELDS)))
+
+
+def flow_stat(cookie, packets):
+    return Stat(table_id = 1, priority = 100, cookie = cookie,
+                match = {'in_port': 1}, packet_count = packets,
+                byte_count = packets * 64, duration_sec = 5,
+                duration_nsec = 0)
+
+
+def test_round_trip(tmpdir):
+    directory = str(tmpdir.join('log'))
+    log = StatsLog(directory)
+    log.add_port_stats(1, [port_stat(1, 10), port_stat(2, 20)], ts=100.0)
+    log.add_port_stats(2, [port_stat(1, 30)], ts=101.0)
+    log.add_flow_stats(1, [flow_stat(7, 3)], ts=102.0)
+    assert log.written == 4
+
+    # readable while the segment is still open
+    reader = StatsLogReader(directory)
+    assert len(reader.read()) == 4
+    log.close()
+
+    ports = reader.read(kind=PORT_RECORD)
+    assert list(ports['dpid']) == [1, 1, 2]
+    assert list(ports['port_no']) == [1, 2, 1]
+    assert list(column(ports, 'rx_bytes')) == [12, 22, 32]
+
+    flows = reader.read(dpid=1, kind=FLOW_RECORD)
+    assert len(flows) == 1
+    assert flows['cookie'][0] == 7
+    assert flows['key'][0] == match_hash({'in_port': 1})
+    assert list(column(flows, 'byte_count')) == [192]
+
+    assert len(reader.read(since=101.0)) == 2
+    assert len(reader.read(until=101.0)) == 2
+    assert len(reader.read(dpid=3)) == 0
+
+
+def test_segments_roll_over(tmpdir):
+    directory = str(tmpdir.join('log'))
+    # room for two records per segment
+    log = StatsLog(directory, segment_size=HEADER_SIZE + 2 * RECORD.size)
+    log.add_port_stats(1, [port_stat(1, 0), port_stat(2, 0)], ts=0.0)
+    log.add_port_stats(1, [port_stat(1, 0)], ts=20.0)
+    log.close()
+    reader = StatsLogReader(directory)
+    assert len(reader.segments()) == 2
+    assert reader.segments(since=15.0) == reader.segments()[1:]
+    # a restarted log continues the numbering
+    assert StatsLog(directory).seq == 2
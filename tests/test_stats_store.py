@@ -0,0 +1,81 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('numpy')
+
+from stats_store import RingTable, StatsStore  # noqa: E402
+
+
+class PortStat(object):
+    def __init__(self, port_no, tx_bytes, rx_bytes=0):
+        self.port_no = port_no
+        self.tx_bytes = tx_bytes
+        self.rx_bytes = rx_bytes
+        self.rx_packets = self.tx_packets = 0
+        self.rx_errors = self.tx_errors = 0
+
+
+def test_rate_over_intervals():
+    ring = RingTable(('bytes',), size=4)
+    for ts, value in [(0, 0), (1, 100), (2, 300), (3, 600)]:
+        ring.append(ts, [(1, 1)], [[value]])
+    assert ring.rate((1, 1), 'bytes') == 300.0
+    assert ring.rate((1, 1), 'bytes', intervals=3) == 200.0
+    # more intervals than samples uses what there is
+    assert ring.rate((1, 1), 'bytes', intervals=10) == 200.0
+
+
+def test_rate_needs_two_samples():
+    ring = RingTable(('bytes',), size=4)
+    assert ring.rate((1, 1), 'bytes') is None
+    ring.append(0, [(1, 1)], [[100]])
+    assert ring.rate((1, 1), 'bytes') == 0.0
+
+
+def test_ring_wraps():
+    ring = RingTable(('bytes',), size=3)
+    for ts in range(10):
+        ring.append(ts, [(1, 1)], [[ts * 10]])
+    assert ring.count((1, 1)) == 3
+    assert ring.rate((1, 1), 'bytes', intervals=2) == 10.0
+
+
+def test_counter_reset_counts_from_zero():
+    ring = RingTable(('bytes',), size=4)
+    for ts, value in [(0, 1000), (1, 2000), (2, 50)]:
+        ring.append(ts, [(1, 1)], [[value]])
+    assert ring.rate((1, 1), 'bytes') == 50.0
+    assert ring.rate((1, 1), 'bytes', intervals=2) == 525.0
+
+
+def test_table_grows_and_reuses_rows():
+    ring = RingTable(('bytes',), size=2, capacity=2)
+    keys = [(1, n) for n in range(5)]
+    ring.append(0, keys, [[0]] * 5)
+    ring.append(1, keys, [[n] for n in range(5)])
+    assert len(ring) == 5
+    assert [ring.rate(k, 'bytes') for k in keys] == [0.0, 1.0, 2.0, 3.0, 4.0]
+    ring.remove((1, 4))
+    ring.append(2, [(2, 1)], [[0]])
+    assert ring.count((2, 1)) == 1
+    ring.remove_dpid(1)
+    assert list(ring) == [(2, 1)]
+
+
+def test_top_ports():
+    store = StatsStore(size=4)
+    store.add_port_stats(1, [PortStat(1, 0), PortStat(2, 0)], ts=0)
+    store.add_port_stats(2, [PortStat(1, 0)], ts=0)
+    store.add_port_stats(1, [PortStat(1, 100), PortStat(2, 500)], ts=1)
+    store.add_port_stats(2, [PortStat(1, 300)], ts=1)
+    assert store.top_ports('tx_bytes', 2) == [(500.0, (1, 2)),
+                                              (300.0, (2, 1))]
+    assert len(store.top_ports('tx_bytes', 10)) == 3
+    rates = store.port_rates(('tx_bytes', 'rx_bytes'))
+    assert rates[1][2] == {'tx_bytes': 500.0, 'rx_bytes': 0.0}
+    store.remove_datapath(1)
+    assert store.top_ports('tx_bytes') == [(300.0, (2, 1))]
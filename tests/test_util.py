@@ -0,0 +1,66 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util import (adapt_interval, freeze, merge_flow_mods,  # noqa: E402
+                  percentile)
+
+
+class OFP13(object):
+    OFPFC_ADD = 0
+    OFPFC_MODIFY = 1
+    OFPFC_MODIFY_STRICT = 2
+    OFPFC_DELETE = 3
+    OFPFC_DELETE_STRICT = 4
+
+
+FLOW = {'priority': 10, 'match': {'in_port': 1},
+        'actions': [{'type': 'OUTPUT', 'port': 2}]}
+MODIFIED = dict(FLOW, actions = [{'type': 'OUTPUT', 'port': 3}])
+
+
+def test_freeze_ignores_dict_order():
+    assert freeze({'a': 1, 'b': [1, {'c': 2}]}) == \
+        freeze({'b': [1, {'c': 2}], 'a': 1})
+    assert freeze([1, 2]) != freeze([2, 1])
+
+
+def test_percentile_nearest_rank():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile(range(1, 101), 95) == 95
+    assert percentile([5], 99) == 5
+
+
+def test_adapt_interval():
+    assert adapt_interval(8.0, True, 5.0, 20.0) == 5.0
+    assert adapt_interval(8.0, False, 5.0, 20.0) == 16.0
+    assert adapt_interval(16.0, False, 5.0, 20.0) == 20.0
+    interval = 5.0
+    for _ in range(4):
+        interval = adapt_interval(interval, False, 5.0, 20.0)
+    assert interval == 20.0
+
+
+def test_modify_after_add_stays_an_add():
+    flow, cmd = merge_flow_mods(OFP13, (FLOW, OFP13.OFPFC_ADD),
+                                OFP13.OFPFC_MODIFY_STRICT, MODIFIED)
+    assert cmd == OFP13.OFPFC_ADD
+    assert flow['actions'] == MODIFIED['actions']
+    assert flow['match'] == FLOW['match']
+
+
+def test_modify_after_delete_is_dropped():
+    prev = (FLOW, OFP13.OFPFC_DELETE_STRICT)
+    assert merge_flow_mods(OFP13, prev, OFP13.OFPFC_MODIFY_STRICT,
+                           MODIFIED) is prev
+
+
+def test_last_add_or_delete_wins():
+    assert merge_flow_mods(OFP13, (FLOW, OFP13.OFPFC_ADD),
+                           OFP13.OFPFC_DELETE_STRICT, FLOW) == \
+        (FLOW, OFP13.OFPFC_DELETE_STRICT)
+    assert merge_flow_mods(OFP13, (FLOW, OFP13.OFPFC_DELETE_STRICT),
+                           OFP13.OFPFC_ADD, MODIFIED) == \
+        (MODIFIED, OFP13.OFPFC_ADD)
@@ -0,0 +1,40 @@
+import math
+
+
+def freeze(value):
+    # hashable, order-independent form of an ofctl dict spec
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def percentile(values, pct):
+    # nearest rank on a sorted copy
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered))) - 1
+    return ordered[max(0, min(len(ordered) - 1, rank))]
+
+
+def adapt_interval(interval, changed, min_interval, max_interval):
+    # poll twice as often while counters move, half as often while idle
+    if changed:
+        return max(min_interval, interval / 2)
+    return min(max_interval, interval * 2)
+
+
+def merge_flow_mods(ofproto, prev, cmd, flow):
+    # net effect of the queued (flow, cmd) in prev followed by cmd, flow
+    # on the same strict key
+    prev_flow, prev_cmd = prev
+    if cmd == ofproto.OFPFC_MODIFY_STRICT:
+        if prev_cmd == ofproto.OFPFC_DELETE_STRICT:
+            # OF1.3 modify of a missing entry is a no-op
+            return prev
+        if prev_cmd == ofproto.OFPFC_ADD:
+            return dict(prev_flow, actions = flow.get('actions', [])), \
+                prev_cmd
+    return flow, cmd